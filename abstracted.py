@@ -1,8 +1,45 @@
 import sys 
 import mysql.connector
 import mysql.connector.errorcode as errorcode
+from mysql.connector import FieldType
 from tabulate import tabulate
+import random
 import re
+import time
+
+# InnoDB rolls back (part of) a transaction that hits one of these errors,
+# and running it again usually succeeds
+RETRYABLE_ERRORS = {errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT}
+MAX_RETRIES = 5
+# seconds to wait before the first retry; doubled on every retry
+RETRY_BASE_DELAY = 0.05
+
+# Results with fewer rows than this are handed to tabulate as before; larger
+# results are streamed by print_table_stream. This is also the number of
+# rows fetched from the server at a time.
+STREAM_SAMPLE_SIZE = 50
+
+# Widest value a column of the given MySQL type can hold when printed, so
+# later rows of a streamed table still fit the widths chosen from the sample
+TYPE_WIDTHS = {
+    FieldType.TINY: 4,
+    FieldType.SHORT: 6,
+    FieldType.INT24: 8,
+    FieldType.LONG: 11,
+    FieldType.LONGLONG: 20,
+    FieldType.YEAR: 4,
+    FieldType.DATE: 10,
+    FieldType.NEWDATE: 10,
+    FieldType.DATETIME: 19,
+    FieldType.TIMESTAMP: 19,
+}
+# DECIMAL columns are as wide as their precision plus a sign and a point
+DECIMAL_TYPES = {FieldType.DECIMAL, FieldType.NEWDECIMAL}
+NUMERIC_TYPES = {
+    FieldType.TINY, FieldType.SHORT, FieldType.INT24, FieldType.LONG,
+    FieldType.LONGLONG, FieldType.YEAR, FieldType.DECIMAL,
+    FieldType.NEWDECIMAL, FieldType.FLOAT, FieldType.DOUBLE,
+}
 
 def check_user_or_pass(conn, word, type, is_login):
     cursor = conn.cursor()
@@ -32,6 +69,55 @@ def check_user_or_pass(conn, word, type, is_login):
             return 0
     return 1
 
+def add_connection_args(parser, user="client", password="client_pw"):
+    """
+    Adds the MySQL connection options shared by the command-line tools
+    (export.py, benchmark.py, ...) to an argparse parser.
+    """
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="3306")
+    parser.add_argument("--user", default=user)
+    parser.add_argument("--password", default=password)
+    parser.add_argument("--database", default="retaildb")
+
+
+def connect_from_args(args, **kwargs):
+    """
+    Returns a MySQL connection using the options added by add_connection_args.
+    Extra keyword arguments are passed on to mysql.connector.connect, and 
+    override the options (e.g. user and password).
+    """
+    options = dict(host=args.host, port=args.port, user=args.user, 
+                   password=args.password, database=args.database)
+    options.update(kwargs)
+    return mysql.connector.connect(**options)
+
+
+def run_with_retry(conn, work, max_retries=MAX_RETRIES, 
+                   base_delay=RETRY_BASE_DELAY):
+    """
+    Runs work(cursor) as one transaction and commits it. If the transaction
+    is chosen as a deadlock victim or times out waiting for a lock, it is 
+    rolled back and run again after a randomized, growing delay. Any other
+    error is rolled back and raised. Returns what work returns.
+    """
+    attempt = 0
+    while True:
+        cursor = conn.cursor()
+        try:
+            result = work(cursor)
+            conn.commit()
+            return result
+        except mysql.connector.Error as err:
+            conn.rollback()
+            if err.errno not in RETRYABLE_ERRORS or attempt >= max_retries:
+                raise
+        finally:
+            cursor.close()
+        time.sleep(base_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
 def print_lines():
     print("\n")
     
@@ -42,4 +128,125 @@ def print_section_header(title):
     print("\n" + "=" * 60)
     print(f" {title} ".center(60, " "))
     print("=" * 60 + "\n")
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+def format_cell(value, width, is_numeric):
+    """
+    Pads a value to the column width: numbers right aligned, text left 
+    aligned. Values are never cut off.
+    """
+    text = cell_text(value)
+    return text.rjust(width) if is_numeric else text.ljust(width)
+
+
+def type_width(column):
+    """
+    Returns the widest a value of a cursor.description column can print as,
+    or 0 if the type does not say.
+    """
+    type_code = column[1]
+    if type_code in DECIMAL_TYPES and column[4]:
+        return column[4] + 2
+    return TYPE_WIDTHS.get(type_code, 0)
+
+
+def print_table_stream(cursor, headers, tablefmt="pretty", 
+                       sample_size=STREAM_SAMPLE_SIZE, out=None):
+    """
+    Prints the rows of an executed query as a table while they are fetched.
+    Column widths come from the column types and the first sample_size rows,
+    so the whole result is never held in memory. If a later row does not 
+    fit, its columns are widened and the border and headers printed again.
+    Results smaller than one sample, and tables in any format other than 
+    "pretty" (which is the only one streamed), are printed with tabulate 
+    instead. Returns the number of rows.
+    """
+    out = out or sys.stdout
+    if tablefmt != "pretty":
+        sample = cursor.fetchall()
+    else:
+        sample = cursor.fetchmany(sample_size)
+    if tablefmt != "pretty" or len(sample) < sample_size:
+        if sample:
+            out.write(tabulate(sample, headers=headers, tablefmt=tablefmt) 
+                      + "\n")
+        return len(sample)
+
+    widths = []
+    numeric = []
+    for i, column in enumerate(cursor.description):
+        width = max(len(str(headers[i])),
+                    max(len(cell_text(row[i])) for row in sample))
+        widths.append(max(width, type_width(column)))
+        numeric.append(column[1] in NUMERIC_TYPES)
+
+    def write_header():
+        border = "+" + "+".join("-" * (w + 2) for w in widths) + "+\n"
+        out.write(border)
+        out.write("| " + " | ".join(str(h).center(w) for h, w 
+                                    in zip(headers, widths)) + " |\n")
+        out.write(border)
+        return border
+
+    border = write_header()
+    total_rows = 0
+    rows = sample
+    while rows:
+        lines = []
+        for row in rows:
+            texts = [cell_text(value) for value in row]
+            if any(len(text) > w for text, w in zip(texts, widths)):
+                out.write("".join(lines))
+                lines = []
+                widths = [max(w, len(text)) for text, w 
+                          in zip(texts, widths)]
+                border = write_header()
+            lines.append("| " + " | ".join(
+                format_cell(value, w, n) for value, w, n 
+                in zip(row, widths, numeric)) + " |\n")
+        out.write("".join(lines))
+        out.flush()
+        total_rows += len(rows)
+        rows = cursor.fetchmany(sample_size)
+    out.write(border)
+    return total_rows
     
+
+
+def print_pages(rows, headers, title=None, section=None, page_size=10,
+                tablefmt="pretty"):
+    """
+    Prints rows as a table page_size rows at a time. After each page the
+    user presses N to see the next one or any other key to stop. title is
+    printed above every page, after a section header if section is given.
+    """
+    total_rows = len(rows)
+    total_pages = (total_rows + page_size - 1) // page_size
+    start = 0
+    page_num = 1
+
+    while start < total_rows:
+        end = start + page_size
+        table = [list(row) for row in rows[start:end]]
+        if section:
+            print_section_header(section)
+        if title:
+            print(title)
+        print(tabulate(table, headers=headers, tablefmt=tablefmt))
+
+        print(f"\nPage {page_num} of {total_pages}")
+
+        if end >= total_rows:
+            break
+
+        user_input = input("\nPress 'N' to view next page, or any "
+                           "other key to exit: ").strip().lower()
+        if user_input != 'n':
+            break
+
+        start += page_size
+        page_num += 1
@@ -23,11 +23,37 @@ import sys
 import mysql.connector
 import mysql.connector.errorcode as errorcode
 from tabulate import tabulate
+import csv
 import datetime
+import json
 from abstracted import check_user_or_pass, print_section_header
+from abstracted import print_pages
+import reports
+from export import export_report_interface
+from provision_users import provision_interface
+from completion import InventoryIndex, input_with_completion
+from outbox_worker import drain_outbox, outbox_lag
+from purchases import insert_purchase
+from write_buffer import PurchaseWriteBuffer, FLUSH_ROWS, FLUSH_DELAY_MS
 
 DEBUG = True
 
+# Number of inventory changes sent to sp_batch_restock in one call
+RESTOCK_BATCH_SIZE = 5000
+
+# Store locations and product IDs the purchase page completes and checks
+# without a query; loaded when an admin logs in
+inventory_index = InventoryIndex()
+
+# When set, new purchases are queued in this PurchaseWriteBuffer
+# (on a connection of its own) and committed in batches; toggled from the
+# menu
+purchase_buffer = None
+
+# change version of the last purchase added in this session, so the store
+# chain report can wait until the summaries include it (see outbox_worker.py)
+last_purchase_version = None
+
 # ----------------------------------------------------------------------
 # SQL Utility Functions
 # # ----------------------------------------------------------------------
@@ -128,53 +154,53 @@ def get_next_customer_id(conn):
 
 def view_possible_purchases(conn):
     """
-    Displays under what conditions an admin can insert 
-    """
-    cursor = conn.cursor()
-
-    # Query to display existing products, stores, and store locations
-    query = """
-        SELECT product_id, store_id, store_location FROM purchase;
+    Lets an admin browse the product, store and store location 
+    combinations that can be purchased, filtered by store, location, 
+    category and stock, one page at a time.
     """
+    print_section_header("Inventory Browser")
+    print("Filter the inventory (press Enter to skip a filter).")
+    store_id = input("Store ID: ").strip() or None
+    if store_id is not None and not store_id.isdigit():
+        print(f"Invalid input for {store_id}. Please enter a valid number.")
+        return
+    store_location = input("Store location: ").strip() or None
+    product_category = input("Product category (" 
+                             + ", ".join(reports.PRODUCT_CATEGORIES) 
+                             + "): ").strip() or None
+    in_stock = input("Only show products in stock? (Y/n): "
+                     ).strip().lower() != "n"
+
+    after = None
+    page_num = 1
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if not results:
-            print("No available stores at the moment.")
-        else:
-            headers = ["Product ID", "Store ID", "Store Location"]
-            page_size = 10 
-            total_rows = len(results)
-            total_pages = (total_rows + page_size - 1) // page_size 
-            start = 0
-            page_num = 1
-
-            while start < total_rows:
-                end = start + page_size
-                table = [list(row) for row in results[start:end]]
-                print_section_header("Store Performance Page")
-                
-                print("You are viewing possible product, store, "
-                      "and store location input: ")
-                print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-                print(f"\nPage {page_num} of {total_pages}")
-
-                if end >= total_rows:
-                    break
-                
-                user_input = input("\nPress 'N' to view next page, or any "
-                                   "other key to exit: ").strip().lower()
-                if user_input != 'n':
-                    break
-
-                start += page_size 
-                page_num += 1  
+        while True:
+            rows = reports.inventory_page(conn, after, store_id, 
+                                          store_location, product_category, 
+                                          in_stock)
+            if not rows:
+                print("No matching products." if page_num == 1 
+                      else "No more products.")
+                return
+            print(f"\nPossible product, store, and store location "
+                  f"input (page {page_num}):")
+            print(tabulate(rows, headers=reports.INVENTORY_PAGE_HEADERS, 
+                           tablefmt="pretty"))
+            if len(rows) < reports.INVENTORY_PAGE_SIZE:
+                return
+            user_input = input("\nPress 'N' to view next page, or any "
+                               "other key to exit: ").strip().lower()
+            if user_input != 'n':
+                return
+            # the next page starts after this page's last 
+            # (store_id, store_location, product_id)
+            last = rows[-1]
+            after = (last[2], last[3], last[0])
+            page_num += 1
+    except ValueError as err:
+        print(err)
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 
 def check_input_validity(conn, user_input, input_type):
@@ -232,7 +258,6 @@ def check_input_validity(conn, user_input, input_type):
     return 1
         
 def get_input_transaction(conn):
-    cursor = conn.cursor()
     # 2 indicates successful inputs, 1 indicates stop transaction, 
     # 0 indicates restart inputs
     flag = 2
@@ -273,9 +298,12 @@ def get_input_transaction(conn):
         if check_input_validity(conn, store_id, "store_id"):
             break
         
+    inventory_index.refresh(conn)
     while True:
-        store_location = input("Enter Store Location (or r to restart "
-                               "inputs and q to stop transaction): ").strip()
+        store_location = input_with_completion(
+            "Enter Store Location (Tab to complete, r to restart inputs "
+            "and q to stop transaction): ",
+            inventory_index.store_locations(store_id)).strip()
         if store_location.lower() == "r":
             print("Restarting transaction...\n")
             return (0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
@@ -283,21 +311,25 @@ def get_input_transaction(conn):
             print("Quitting transaction...\n")
             return (1, 0, 0, 0, 0, 0, 0, 0, 0, 0)
         
-        cursor.execute(
-            "SELECT COUNT(*) FROM store WHERE store_id = %s AND "
-            "store_location = %s",
-            (store_id, store_location),
-        )
-        exists = cursor.fetchone()[0]
-        if not exists:
+        location = inventory_index.has_location(conn, store_id, 
+                                                store_location)
+        if location is None:
             print(f"Store ID {store_id} does not have a location at "
                   f"'{store_location}'. Please enter a valid store location. ")
+            locations = inventory_index.store_locations(store_id).values
+            if locations:
+                print("Its locations are: " + ", ".join(locations[:10])
+                      + (" ..." if len(locations) > 10 else ""))
             continue
+        # spelled as in the database, e.g. "san jose" -> "San Jose"
+        store_location = location
         break
     
     while True: 
-        product_id = input("Enter Product ID (or r to restart inputs "
-                           "and q to stop transaction): ").strip()
+        product_id = input_with_completion(
+            "Enter Product ID (Tab to complete, r to restart inputs "
+            "and q to stop transaction): ",
+            inventory_index.store_products(store_id, store_location)).strip()
         if product_id.lower() == "r":
             print("Restarting transaction...\n")
             return (0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
@@ -308,21 +340,15 @@ def get_input_transaction(conn):
         if not check_input_validity(conn, product_id, "product_id"):
             continue
         
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM inventory i
-            WHERE i.product_id = %s 
-            AND i.store_id = %s 
-            AND i.store_location = %s
-        """, (product_id, store_id, store_location))
-
-        product_exists = cursor.fetchone()[0]
-        if not product_exists:
+        product = inventory_index.has_product(conn, store_id, 
+                                              store_location, product_id)
+        if product is None:
             print(f" Product ID does not exist for this store at this "
                   "location. Please choose a product that is sold at "
                   f"{store_id} ({get_store_chain_admin(conn, store_id)}), "
                   f"{store_location}")
             continue
+        product_id = product
         break
     
     while True: 
@@ -377,8 +403,8 @@ def add_new_transaction(conn):
     """
     Allows an admin to add a new transaction manually into the database.
     """
+    global last_purchase_version
     while True: 
-        cursor = conn.cursor()
         print_section_header("Purchase Page")
         print("Adding a New Purchase.")
         print("\n1) This must be at an existing store by an existing customer.")
@@ -403,102 +429,61 @@ def add_new_transaction(conn):
             # quit transaction
             break
         
-        query = """
-                INSERT INTO purchase 
-                    (purchase_id, product_id, store_id, customer_id, 
-                     store_location, payment_method, discount_percent, 
+        purchase = (purchase_id, product_id, store_id, customer_id, 
+                    store_location, payment_method, discount_percent, 
                     txn_date, purchased_product_price_usd)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
         try:
-            cursor.execute(query,
-                        (purchase_id, product_id, store_id, customer_id, 
-                         store_location, payment_method, discount_percent, 
-                         txn_date, purchased_product_price_usd))
-            conn.commit()
+            if purchase_buffer:
+                # waits for the batch holding the purchase to commit
+                last_purchase_version = purchase_buffer.submit(
+                    purchase).result()
+            else:
+                last_purchase_version = insert_purchase(conn, purchase)
             print("Purchase successfully added.")
             break
         except mysql.connector.Error as err:
-            sys.stderr.write(f"Error: {err}\n")
+            if err.sqlstate == "45000":
+                print("This product is out of stock at this store. "
+                      "Please choose another product.")
+            else:
+                sys.stderr.write(f"Error: {err}\n")
             continue
-        finally:
-            cursor.close()
+
+def toggle_buffered_purchases():
+    """
+    Switches between committing each new purchase on its own and queueing
+    purchases in a write buffer that commits them in batches.
+    """
+    global purchase_buffer
+    if purchase_buffer:
+        buffer_conn = purchase_buffer.conn
+        # writes anything still queued first
+        purchase_buffer.close()
+        buffer_conn.close()
+        purchase_buffer = None
+        print("New purchases are committed one at a time.")
+        return
+    purchase_buffer = PurchaseWriteBuffer(get_conn())
+    print(f"New purchases are committed in batches of up to {FLUSH_ROWS} "
+          f"or every {FLUSH_DELAY_MS} ms.")
 
 def view_store_performance(conn):
     """
     Displays store performance reports including revenue, total transactions,
     and average foot traffic per store.
     """
-    cursor = conn.cursor()
-
-    query = """
-        WITH purchase_summary AS (
-            SELECT store_id,
-                store_location,
-                COUNT(*) AS total_transactions,
-                SUM(purchased_product_price_usd) AS total_revenue
-            FROM purchase
-            GROUP BY store_id, store_location
-        ),
-        popularity_summary AS (
-            SELECT store_id,
-                store_location,
-                AVG(foot_traffic) AS avg_foot_traffic
-            FROM popularity
-            GROUP BY store_id, store_location
-        )
-        SELECT s.store_id, 
-            s.store_location,
-            COALESCE(p.total_transactions, 0) AS total_transactions,
-            COALESCE(p.total_revenue, 0)      AS total_revenue,
-            COALESCE(pop.avg_foot_traffic, 0) AS avg_foot_traffic
-        FROM store s
-        LEFT JOIN purchase_summary p 
-            ON s.store_id = p.store_id 
-            AND s.store_location = p.store_location
-        LEFT JOIN popularity_summary pop
-            ON s.store_id = pop.store_id
-            AND s.store_location = pop.store_location;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if not results:
+        result = reports.store_stats(conn)
+        if not result.rows:
             print("No store performance data available.")
         else:
             headers = ["Store ID", "Location", "Total Transactions", 
                        "Total Revenue ($)", "Avg Foot Traffic"]
-            page_size = 10 
-            total_rows = len(results)
-            total_pages = (total_rows + page_size - 1) // page_size 
-            start = 0
-            page_num = 1
-
-            while start < total_rows:
-                end = start + page_size
-                table = [list(row) for row in results[start:end]]
-                print_section_header("Store Performance Page")
-                
-                print("You are viewing the store performance report:")
-                print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-                print(f"\nPage {page_num} of {total_pages}")
-
-                if end >= total_rows:
-                    break
-                
-                user_input = input("\nPress 'N' to view next page, or any "
-                                   "other key to exit: ").strip().lower()
-                if user_input != 'n':
-                    break
-
-                start += page_size 
-                page_num += 1  
+            print_pages(result.rows, headers, 
+                        title="You are viewing the store performance report:",
+                        section="Store Performance Page")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 def view_materialized_store_sales(conn):
     """
@@ -506,56 +491,143 @@ def view_materialized_store_sales(conn):
     Result shows 10 rows per page. Press N to move onto next page 
     or any other key to quit
     """
-    cursor = conn.cursor()
-    query = """
-        SELECT store_id, total_sales, 
-        num_purchases, 
-        avg_discount, 
-        min_price, max_price
-        FROM mv_store_sales_stats;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if not results:
+        try:
+            # include the purchases this admin just added
+            result = reports.materialized_store_sales(
+                conn, min_version=last_purchase_version)
+        except TimeoutError:
+            print("Your latest purchases are not in these statistics yet.")
+            result = reports.materialized_store_sales(conn)
+        if not result.rows:
             print("No sales data available.")
             return
+        print_pages(result.rows, result.headers, 
+                    title="\nStore Sales Statistics", section="View Page")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
 
-        headers = ["Store ID", "Total Sales ($)", "Num Purchases", 
-                   "Avg Discount (%)", "Min Price ($)", "Max Price ($)"]
-
-        page_size = 10 
-        total_rows = len(results)
-        total_pages = (total_rows + page_size - 1) // page_size 
-        start = 0
-        page_num = 1
+def refresh_materialized_store_sales(conn):
+    """
+    Refreshes the materialized view of store sales statistics, either by 
+    applying the sales waiting in the purchase outbox to every summary 
+    (incremental) or by rebuilding it from every purchase (full). Readers 
+    keep seeing the old statistics while a full rebuild runs.
+    """
+    print_section_header("Refresh Page")
+    print("New sales are applied to the store chain performance report "
+          "every few seconds.")
+    try:
+        lag = outbox_lag(conn)
+        if lag.pending:
+            print(f"{lag.pending} new sales are waiting, the oldest for "
+                  f"{lag.oldest_seconds:.1f}s.")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+    print("\nHow would you like to refresh it now?")
+    print("  (a) - Apply new sales (incremental refresh)")
+    print("  (b) - Rebuild from all purchases (full refresh)")
+    ans = input("Enter an option: ").strip().lower()
+    if ans not in ("a", "b"):
+        print("Invalid option. Please try again.")
+        return
 
-        while start < total_rows:
-            end = start + page_size
-            print_section_header("View Page")
-            table = [list(row) for row in results[start:end]]
-            
-            print("\nStore Sales Statistics")
-            print(tabulate(table, headers=headers, tablefmt="pretty"))
+    cursor = conn.cursor()
+    try:
+        if ans == "a":
+            drain_outbox(conn)
+            view_name = "purchase_outbox"
+        else:
+            cursor.callproc("sp_refresh_mv_store_sales_full")
+            conn.commit()
+            view_name = "mv_store_sales_stats"
+        cursor.execute(reports.LAST_REFRESH_QUERY, (view_name,))
+        result = cursor.fetchone()
+        if result:
+            refresh_type, finished_at, seconds, rows_applied = result
+            print(f"\nLast {refresh_type} refresh finished at {finished_at} "
+                  f"in {seconds:.3f}s ({rows_applied} rows).")
+        else:
+            print("\nNo new sales to apply.")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+    finally:
+        cursor.close()
 
-            print(f"\nPage {page_num} of {total_pages}")
+def apply_restock(conn, changes):
+    """
+    Applies a list of inventory changes (dicts with product_id, store_id,
+    store_location and qty_change) with one call to sp_batch_restock per 
+    RESTOCK_BATCH_SIZE changes. Returns the number of applied changes and
+    a list of (index into changes, change, error) for rejected ones.
+    """
+    cursor = conn.cursor()
+    applied = 0
+    rejected = []
+    try:
+        for start in range(0, len(changes), RESTOCK_BATCH_SIZE):
+            batch = changes[start:start + RESTOCK_BATCH_SIZE]
+            result = cursor.callproc("sp_batch_restock", 
+                                     (json.dumps(batch), 0, 0))
+            applied += result[1]
+            for report in cursor.stored_results():
+                for line_no, *_, error in report.fetchall():
+                    index = start + line_no - 1
+                    rejected.append((index, changes[index], error))
+            conn.commit()
+    finally:
+        cursor.close()
+    return applied, rejected
 
-            if end >= total_rows:
-                break
-            
-            user_input = input("\nPress 'N' to view next page, or any "
-                               "other key to exit: ").strip().lower()
-            if user_input != 'n':
-                break
 
-            start += page_size 
-            page_num += 1  
+def batch_restock(conn):
+    """
+    Restocks inventory from a CSV file with the columns product_id, 
+    store_id, store_location and qty_change (negative to remove stock).
+    Changes that would make a quantity negative, or name a product the
+    store does not sell, are rejected and listed; the rest are applied.
+    """
+    print_section_header("Restock Page")
+    path = input("Enter the restock file (CSV with columns product_id, "
+                 "store_id, store_location, qty_change): ").strip()
+    try:
+        with open(path, newline="") as restock_file:
+            changes = list(csv.DictReader(restock_file))
+    except OSError as err:
+        print(f"Could not read {path}: {err}")
+        return
+
+    expected = {"product_id", "store_id", "store_location", "qty_change"}
+    if not changes or not expected.issubset(changes[0]):
+        print("The file must have a header row with product_id, store_id, "
+              "store_location and qty_change.")
+        return
+    changes = [{key: change[key].strip() for key in expected} 
+               for change in changes]
+    for change in changes:
+        # non-numbers are sent as null and rejected by the procedure
+        for key in ("store_id", "qty_change"):
+            try:
+                change[key] = int(change[key])
+            except ValueError:
+                change[key] = None
 
+    try:
+        applied, rejected = apply_restock(conn, changes)
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
+        return
+
+    print(f"\nApplied {applied} of {len(changes)} inventory changes.")
+    if rejected:
+        headers = ["CSV Line", "Product ID", "Store ID", "Store Location", 
+                   "Qty Change", "Error"]
+        # + 2 for the header row and 1-based line numbers
+        table = [[index + 2, change["product_id"], change["store_id"], 
+                  change["store_location"], change["qty_change"], error]
+                 for index, change, error in rejected]
+        print(f"\n{len(rejected)} changes were rejected:")
+        print(tabulate(table, headers=headers, tablefmt="pretty"))
 
 def create_account_admin(conn):
     while True: 
@@ -692,12 +764,25 @@ def show_admin_options():
     # There are also specific statistics only admins can view such as 
     # store performance reports, as if competitors get access to this 
     # information, that might cause issues as that could be private info.
+    try:
+        inventory_index.load(conn)
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
     while True:
         print_section_header("Menu Page")
         print('What would you like to do? ')
         print('  (1) - Add a New Transaction')
         print('  (2) - View Store Specific Performance Reports')
         print('  (3) - View Store Chain Performance Reports')
+        print('  (4) - Export a Report to CSV/JSONL')
+        print('  (5) - Refresh Store Chain Performance Reports')
+        print('  (6) - Restock Inventory from a File')
+        print('  (7) - Create Accounts from a File')
+        if purchase_buffer:
+            print('  (8) - Commit new purchases one at a time '
+                  '(currently buffered)')
+        else:
+            print('  (8) - Buffer new purchases and commit them in batches')
         print('  (q) - quit')
         print()
         ans = input('Enter an option: ').lower()
@@ -707,6 +792,16 @@ def show_admin_options():
             view_store_performance(conn)
         elif ans == '3':
             view_materialized_store_sales(conn)
+        elif ans == '4':
+            export_report_interface(conn, is_admin=True)
+        elif ans == '5':
+            refresh_materialized_store_sales(conn)
+        elif ans == '6':
+            batch_restock(conn)
+        elif ans == '7':
+            provision_interface(conn)
+        elif ans == '8':
+            toggle_buffered_purchases()
         elif ans == 'q':
             quit_ui()
         else:
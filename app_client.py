@@ -25,10 +25,24 @@ import mysql.connector.errorcode as errorcode
 from tabulate import tabulate
 import re
 from abstracted import check_user_or_pass, print_lines, print_section_header
+from abstracted import print_pages, print_table_stream
+import reports
+from export import export_report_interface
+from routing import ConnectionRouter
+import rfm
+import sampling
 
 
 DEBUG = True
 
+# Sends report queries to the read replica when one is configured (see
+# routing.py); set up in __main__
+router = None
+
+# When True, the reports that scan every purchase are estimated from the
+# purchase sample instead (see sampling.py); toggled from the menu
+approximate = False
+
 # ----------------------------------------------------------------------
 # SQL Utility Functions
 # # ----------------------------------------------------------------------
@@ -73,13 +87,28 @@ def get_store_chain_less_format(conn, store_id):
     """
     Given a store_id, retrieves the corresponding store chain name
     """
-    cursor = conn.cursor()
-    cursor.execute("SELECT store_id_to_store_chain(%s);", (store_id,))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    else:
-        return None
+    return reports.store_chain(conn, store_id)
+def report_headers(name):
+    """
+    Column headers the terminal shows for a report in reports.REPORTS.
+    """
+    return reports.REPORTS[name].headers
+
+def print_approximate(conn, name):
+    """
+    Prints the estimate of a report from the purchase sample, with the
+    margin of error of each estimate.
+    """
+    result = sampling.run_sampled_report(conn, name)
+    sampled, sample_rate, min_store_sample = sampling.sample_info(conn)
+    if not result.rows:
+        print("\nNo results found.\n")
+        return
+    print_pages(result.rows, result.headers, title="\n" + result.title + ":")
+    print(f"Estimated from a sample of {sampled} purchases "
+          f"({sample_rate:.2%} of each store's purchases, at least "
+          f"{min_store_sample}); +/- is the 95% margin of error.")
+    print("Choose (I) on the menu page for exact results.")
 
 def transition(conn, type_stats):
     while True:
@@ -110,86 +139,35 @@ def most_popular_payment_method(conn):
     """
     Finds the most commonly used payment method for each store.
     """
-    cursor = conn.cursor()
     print_section_header("Store Analysis Page")
     print("Welcome! You are viewing the payment methods per store.")
-    query = """
-        SELECT p.store_id, 
-            p.store_location, 
-            p.payment_method, 
-            COUNT(*) AS usage_count
-        FROM purchase p
-        GROUP BY p.store_id, p.store_location, p.payment_method
-        ORDER BY p.store_id, p.store_location, usage_count DESC;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if not results:
+        result = reports.payment_methods(conn)
+        if not result.rows:
             print("\nNo results found.\n")
             return
-
-        headers = ["Store ID", "Store Location", "Payment Method", 
-                   "Usage Count"]
-
-        page_size = 10 
-        total_rows = len(results)
-        total_pages = (total_rows + page_size - 1) // page_size 
-        start = 0
-        page_num = 1
-
-        while start < total_rows:
-            end = start + page_size
-            table = [list(row) for row in results[start:end]]  
-            print("\nMost Popular Payment Methods Per Store:")
-            print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-            print(f"\nPage {page_num} of {total_pages}")
-
-            if end >= total_rows:
-                break
-
-            user_input = input("\nPress 'N' to view next page, or any "
-                               "other key to exit: ").strip().lower()
-            if user_input != 'n':
-                break
-            start += page_size
-            page_num += 1
-
+        print_pages(result.rows, result.headers,
+                    title="\nMost Popular Payment Methods Per Store:")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
  
-
 def get_total_purchases_per_age_group(conn):
-    cursor = conn.cursor()
     print_section_header("Age Analysis Page")
     print("Welcome! You are viewing the total number of "
           "purchases by age group.")
-
-    query = """
-            SELECT
-                age_range,
-                SUM(total_sales) AS total_sales
-            FROM sales_summary_by_age_group
-            GROUP BY age_range
-            ORDER BY total_sales DESC;
-            """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        if results:
-            headers = ["Age Group", "Total Sales ($)"]
-            print("\n" + tabulate(results, headers=headers, 
-                                  tablefmt="grid") + "\n")
-        else:
-            print("\nNo results found.\n")
+        if approximate:
+            print_approximate(conn, "age_group_sales")
+            return
+        with reports.open_report(conn, "age_group_sales") as cursor:
+            print()
+            if print_table_stream(cursor, report_headers("age_group_sales"), 
+                                  tablefmt="grid"):
+                print()
+            else:
+                print("No results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
         
 def get_age_stats(conn):
     """
@@ -231,35 +209,19 @@ def get_age_stats(conn):
             print("Invalid option. Please try again. ")
 
 def get_total_avg_per_gender(conn):
-    cursor = conn.cursor()
     print_section_header("Gender Analysis Page")
     print("Welcome! You are viewing the total number of purchases and "
           "average purchase price by gender.")
-    query = """
-                SELECT c.gender, 
-                        COUNT(p.purchase_id) AS total_purchases,
-                        ROUND(AVG(p.purchased_product_price_usd), 2) 
-                        AS avg_spent_per_transaction
-                FROM customer c
-                JOIN purchase p 
-                    ON c.customer_id = p.customer_id
-                GROUP BY c.gender;
-            """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        print("\nRetail Statistics by Gender:")
-        if results:
-            headers = ["Gender", "Total Purchases", 
-                       "Avg Spent Per Transaction ($)"]
-            print("\n" + tabulate(results, headers=headers, tablefmt="pretty")) 
-        else:
-            print("\nNo results found.\n")
-
+        if approximate:
+            print_approximate(conn, "gender_totals")
+            return
+        with reports.open_report(conn, "gender_totals") as cursor:
+            print("\nRetail Statistics by Gender:\n")
+            if not print_table_stream(cursor, report_headers("gender_totals")):
+                print("No results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
             
 def get_gender_stats(conn):
     """
@@ -267,14 +229,15 @@ def get_gender_stats(conn):
     """
     while True:
         print_section_header("Gender Menu")
-        cursor = conn.cursor()
         print("Welcome! You are analyzing gender statistics! ")
         print("\nChoose the type of gender analysis you want to perform:")
         print("  (a) - Get total purchases and avg purchase price "
               "for each gender")
         print("  (b) - Get gender statistics based on product category")
-        print("  (c) - Return to menu page")
-        print("  (d) - Quit")
+        print("  (c) - Get purchases and spending for every gender and "
+              "product category")
+        print("  (d) - Return to menu page")
+        print("  (e) - Quit")
         
         ans = input("Enter an option: ").lower()
         if ans == 'a':
@@ -282,14 +245,11 @@ def get_gender_stats(conn):
             transition(conn, "gender")
         elif ans == 'b':
             while True:
-                product_categories = {"Clothing", "Groceries", 
-                                      "Health & Beauty", "Home & Kitchen", 
-                                      "Books", "Electronics"}
                 print("\nProduct categories are: Clothing, Groceries, "
                       "Health & Beauty, Home & Kitchen, Books, and Electronics")
                 product_category = input("What product category are "
                                          "you interested in? ")
-                if product_category not in product_categories:
+                if product_category not in reports.PRODUCT_CATEGORIES:
                     print("Invalid product category. Please check your "
                           "spelling (and case) and ensure it is a valid "
                           "listed category. ")
@@ -298,63 +258,30 @@ def get_gender_stats(conn):
                 transition(conn, "gender")
                 break
         elif ans == 'c':
-            show_client_options(conn)
+            get_gender_category_pivot(conn)
+            transition(conn, "gender")
         elif ans == 'd':
+            show_client_options(conn)
+        elif ans == 'e':
             quit_ui()
         else:
             print("Invalid option. Please try again. ")
 
         
 def get_many_stats_per_store(conn):
-    cursor = conn.cursor()
     print_section_header("Store Analysis Page")
     print("Welcome! You are viewing retail statistics by store, including "
           "total transactions, total revenue, and average foot traffic.")
-    query = """
-            WITH purchase_summary AS (
-                SELECT store_id,
-                    store_location,
-                    COUNT(*) AS total_transactions,
-                    SUM(purchased_product_price_usd) AS total_revenue
-                FROM purchase
-                GROUP BY store_id, store_location
-            ),
-            -- 2) Average foot traffic per store.
-            popularity_summary AS (
-                SELECT store_id,
-                    store_location,
-                    AVG(foot_traffic) AS avg_foot_traffic
-                FROM popularity
-                GROUP BY store_id, store_location
-            )
-            SELECT s.store_id, 
-                s.store_location,
-                COALESCE(p.total_transactions, 0) AS total_transactions,
-                COALESCE(p.total_revenue, 0)      AS total_revenue,
-                COALESCE(pop.avg_foot_traffic, 0) AS avg_foot_traffic
-            FROM store s
-            LEFT JOIN purchase_summary p 
-                ON s.store_id = p.store_id 
-                AND s.store_location = p.store_location
-            LEFT JOIN popularity_summary pop
-                ON s.store_id = pop.store_id
-                AND s.store_location = pop.store_location;
-        """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        if results:
-            headers = ["Store ID", "Store Location", "Total Purchases", 
-                       "Total Revenue ($)", "Avg Foot Traffic"]
+        if approximate:
+            print_approximate(conn, "store_stats")
+            return
+        with reports.open_report(conn, "store_stats") as cursor:
             print("\nRetail Statistics by Store:")
-            print(tabulate(results, headers=headers, tablefmt="pretty")) 
-        else:
-            print("\nNo results found.\n")
-
+            if not print_table_stream(cursor, report_headers("store_stats")):
+                print("\nNo results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
                 
 def get_store_stats(conn):
     """
@@ -362,7 +289,6 @@ def get_store_stats(conn):
     """
     while True:
         print_section_header("Store Menu")
-        cursor = conn.cursor()
         print("Welcome! You are analyzing store statisicts! ")
         print("\nChoose the type of store analysis you want to perform:")
         print("  (a) - Get the payment method for each store")
@@ -371,8 +297,10 @@ def get_store_stats(conn):
         print("  (c) - Get store statistics based on store_id")
         print("  (d) - Find Store Chain Based on Store ID")
         print("  (e) - Get total profit for each store chain & location")
-        print("  (f) - Return to menu page")
-        print("  (g) - Quit")
+        print("  (f) - Get number of distinct customers per store, chain, "
+              "or location")
+        print("  (g) - Return to menu page")
+        print("  (h) - Quit")
       
         ans = input("Enter an option: ").lower()
         if ans == 'a':
@@ -387,9 +315,8 @@ def get_store_stats(conn):
                 if not store_id_input.isdigit():
                     print(f"Invalid input for {store_id_input}. "
                           "Please enter a valid number.")
-                cursor.execute("SELECT COUNT(*) FROM store WHERE "
-                               "store_id = %s", (store_id_input,))
-                exists = cursor.fetchone()[0]
+                    continue
+                exists = reports.store_exists(conn, store_id_input)
                 if not exists:
                     print(f"Store ID {store_id_input} does not exist. "
                           "Please enter a valid ID next time.")
@@ -409,9 +336,8 @@ def get_store_stats(conn):
                 if not store_id_input.isdigit():
                     print(f"Invalid input for {store_id_input}. "
                           "Please enter a valid number next time.")
-                cursor.execute("SELECT COUNT(*) FROM store WHERE "
-                               "store_id = %s", (store_id_input,))
-                exists = cursor.fetchone()[0]
+                    continue
+                exists = reports.store_exists(conn, store_id_input)
                 if not exists:
                     print(f"Store ID {store_id_input} does not exist. "
                           "Please enter a valid ID next time.")
@@ -437,10 +363,7 @@ def get_store_stats(conn):
                           "999999. Please try again. ")
                     continue
                 try:
-                    cursor.execute("SELECT store_count(%s);", (store_id,))
-                    store_count_result = cursor.fetchone()
-                    num_open_stores = store_count_result[0] \
-                        if store_count_result else 0
+                    num_open_stores, _ = reports.store_summary(conn, store_id)
                     
                     if num_open_stores == 0:
                         print(f"Store ID: {store_id} is not in the database.")
@@ -460,9 +383,7 @@ def get_store_stats(conn):
                     print(f"Invalid input for {store_id_input}. "
                           "Please enter a valid number.")
                     continue
-                cursor.execute("SELECT COUNT(*) FROM store WHERE "
-                               "store_id = %s", (store_id_input,))
-                exists = cursor.fetchone()[0]
+                exists = reports.store_exists(conn, store_id_input)
                 if not exists:
                     print(f"Store ID {store_id_input} does not exist. "
                           "Please enter a valid ID next time.")
@@ -476,9 +397,7 @@ def get_store_stats(conn):
                 print(f"Invalid input for {user_res}. "
                       "Please enter a valid number.")
                 continue
-            cursor.execute("SELECT COUNT(*) FROM store WHERE "
-                           "store_id = %s", (user_res,))
-            exists = cursor.fetchone()[0]
+            exists = reports.store_exists(conn, user_res)
             if not exists:
                 print(f"Store ID {user_res} does not exist. "
                       "Please enter a valid ID next time.")
@@ -489,8 +408,10 @@ def get_store_stats(conn):
         elif ans == 'e':
             get_store_profit_stats(conn)
         elif ans == 'f':
-            show_client_options(conn)
+            get_distinct_customers(conn)
         elif ans == 'g':
+            show_client_options(conn)
+        elif ans == 'h':
             quit_ui()
         else:
             print("Invalid option. Please try again. ")
@@ -500,273 +421,159 @@ def get_store_stats(conn):
 def get_more_gender_analysis(conn, product_category):
     """
     Counts the number of male, female, and non-binary customers 
-    who purchased Health and Beauty products.
+    who purchased products of the given category.
     """
-    cursor = conn.cursor()
     print_section_header("Gender Analysis Page")
     print(f"Welcome! You are viewing the total purchase count for each "
           f"gender for the product category {product_category}. ")
-    query = """
-        SELECT c.gender, 
-            COUNT(*) AS purchase_count
-        FROM customer c
-        JOIN purchase p 
-            ON c.customer_id = p.customer_id
-        JOIN product pr 
-            ON p.product_id = pr.product_id
-        WHERE pr.product_category = %s
-        GROUP BY c.gender;
-    """
     try:
-        cursor.execute(query, (product_category,))
-        results = cursor.fetchall()
-        if not results:
-            print(f"\nError: No purchases found for the product category "
-                  f"'{product_category}'.")
-            print("Please check the spelling or try a different category.")
-            return
+        with reports.open_report(conn, "gender_by_category", 
+                                 (product_category,)) as cursor:
+            print(f"\n{product_category} Product Purchases by Gender:")
+            if not print_table_stream(cursor, 
+                                      report_headers("gender_by_category")):
+                print(f"\nError: No purchases found for the product "
+                      f"category '{product_category}'.")
+                print("Please check the spelling or try a different "
+                      "category.")
+    except ValueError as err:
+        print(err)
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
 
-        headers = ["Gender", "Purchase Count"]
-        print(f"\n{product_category} Product Purchases by Gender:")
-        print(tabulate(results, headers=headers, tablefmt="pretty"))
+
+def get_gender_category_pivot(conn):
+    """
+    Shows the purchase count and amount spent by each gender in every 
+    product category, in one table.
+    """
+    print_section_header("Gender Analysis Page")
+    print("Welcome! You are viewing the total purchases and spending of "
+          "each gender for every product category. ")
+    report = reports.REPORTS["gender_category_pivot"]
+    try:
+        with reports.open_report(conn, "gender_category_pivot") as cursor:
+            print(f"\n{report.title}:")
+            if not print_table_stream(cursor, report.headers):
+                print("\nNo results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 
 def get_min_max_buyers_per_product(conn):
-    cursor = conn.cursor()
     print_section_header("Age Analysis Page")
     print("Welcome! You are viewing the min and max buyer age group "
           "for each product category. ")
-    query = """
-            SELECT product_category, 
-                   MIN(age_range) AS youngest_buyers,
-                   MAX(age_range) AS oldest_buyers
-            FROM sales_summary_by_age_group
-            GROUP BY product_category;
-            """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if results:
-            headers = ["Product Category", "Youngest Buyers", "Oldest Buyers"]
-            print("\n" + tabulate(results, headers=headers, tablefmt="grid") 
-                  + "\n")
-        else:
-            print("\nNo results found.\n")
-
+        with reports.open_report(conn, "min_max_age") as cursor:
+            print()
+            if print_table_stream(cursor, report_headers("min_max_age"), 
+                                  tablefmt="grid"):
+                print()
+            else:
+                print("No results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 
 def get_wants_versus_needs_per_age_group(conn):
-    cursor = conn.cursor()
     print_section_header("Age Analysis Page")
     print("Welcome! You are viewing the spending breakdown of "
           "necessities vs. non-necessities by age group.")
-    query = """
-        SELECT age_range, 
-             ROUND(CAST(SUM(CASE WHEN 
-                    product_category IN ('Groceries', 'Health & Beauty') 
-                    THEN total_sales ELSE 0 END) AS DECIMAL(10,2)), 2)
-                AS necessities,
-             ROUND(CAST(SUM(CASE WHEN 
-                    product_category NOT IN ('Groceries', 'Health & Beauty') 
-                    THEN total_sales ELSE 0 END) AS DECIMAL(10,2)), 2)
-                AS non_necessities
-        FROM sales_summary_by_age_group
-        GROUP BY age_range
-        ORDER BY age_range;
-    """
-
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if results:
-            headers = ["Age Range", "Spent on Necessities ($)", 
-                       "Spent on Non Necessities ($)"]
+        if approximate:
+            print_approximate(conn, "wants_versus_needs")
+            return
+        result = reports.wants_versus_needs(conn)
+        if result.rows:
             formatted_results = [(row[0], f"{row[1]:.2f}", f"{row[2]:.2f}") 
-                                 for row in results]
-            print("\n" + tabulate(formatted_results, headers=headers, 
+                                 for row in result.rows]
+            print("\n" + tabulate(formatted_results, headers=result.headers, 
                                   tablefmt="grid") + "\n")
         else:
             print("\nNo results found.\n")
-
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 
 def get_store_profit_stats(conn):
-    cursor = conn.cursor()
     print_section_header("Store Analysis Page")
     print("Welcome! You are viewing the total profits of each store chain (using id)"
           "and location.")
-    query = """
-            SELECT
-                s.store_chain_name,
-                i.store_location,
-                SUM(p.purchased_product_price_usd - i.product_cost_usd) AS total_profit
-            FROM inventory i
-            JOIN purchase p
-                ON i.product_id = p.product_id
-                AND i.store_id = p.store_id
-                AND i.store_location = p.store_location
-            JOIN store s
-                ON i.store_id = s.store_id
-                AND i.store_location = s.store_location
-            GROUP BY
-                s.store_chain_name,
-                i.store_location;
-            """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        headers = ["Store Chain", "Store Location", "Total Profit"]
-
-        page_size = 10
-        total_rows = len(results)
-        total_pages = (total_rows + page_size - 1) // page_size
-        start = 0
-        page_num = 1
-
-        while start < total_rows:
-            end = start + page_size
-            table = [list(row) for row in results[start:end]]
-
-            print("\nStore Profit Statistics")
-            print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-            print(f"\nPage {page_num} of {total_pages}")
-
-            if end >= total_rows:
-                break
-
-            user_input = input("\nPress 'N' to view next page, or "
-                               "any other key to exit: ").strip().lower()
-            if user_input != 'n':
-                break
+        result = reports.store_profit(conn)
+        print_pages(result.rows, result.headers, 
+                    title="\nStore Profit Statistics")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
 
-            start += page_size
-            page_num += 1
 
+def get_distinct_customers(conn):
+    """
+    Shows the estimated number of distinct customers of each store, store
+    chain, or city, from the distinct customer sketches.
+    """
+    print_section_header("Store Analysis Page")
+    print("Welcome! You are viewing the number of distinct customers who "
+          "visited or bought from the stores.")
+    levels = {"s": reports.distinct_customers_store,
+              "c": reports.distinct_customers_chain,
+              "l": reports.distinct_customers_location}
+    level = input("Count per (s) store, (c) store chain, or (l) location? "
+                  ).lower().strip()
+    if level not in levels:
+        print("Invalid option. Please enter s, c, or l next time.")
+        return
+    try:
+        result = levels[level](conn)
+        if not result.rows:
+            print("\nNo results found.\n")
+            return
+        print_pages(result.rows, result.headers, title="\n" + result.title)
+        print("Counts are estimates; +/- is the 95% margin of error.")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 
 def get_most_popular_store_chains_per_age_group(conn):
     """
     Determines the most common store location visited by different age groups.
     """
-    cursor = conn.cursor()
     print_section_header("Age Analysis Page")
     print("Welcome! You are viewing the most common store location visited "
           "by different age groups. ")
-    # Specify age group categories up to 50 and then just classify as above 
-    # 50 years. Assume customers must be at least 18 (adult) to make a purchase.
-
-    # get the rank of stores by most purchases
-    query = """
-        SELECT 
-            age_group, 
-            store_chain, 
-            total_purchases
-        FROM (
-            SELECT 
-                CASE 
-                    WHEN c.age BETWEEN 18 AND 25 THEN '18-25'
-                    WHEN c.age BETWEEN 26 AND 35 THEN '26-35'
-                    WHEN c.age BETWEEN 36 AND 50 THEN '36-50'
-                    WHEN c.age BETWEEN 40 AND 49 THEN '40-49'
-                    WHEN c.age BETWEEN 50 AND 59 THEN '50-59'
-                    WHEN c.age BETWEEN 60 AND 69 THEN '60-69'
-                    WHEN c.age BETWEEN 70 AND 79 THEN '70-79'
-                    WHEN c.age BETWEEN 80 AND 89 THEN '80-89'
-                    ELSE '90+'
-                END AS age_group,
-                s.store_chain_name AS store_chain,
-                COUNT(*) AS total_purchases
-            FROM customer_visits cv
-            JOIN customer c ON cv.customer_id = c.customer_id
-            JOIN store s ON cv.store_id = s.store_id
-            GROUP BY age_group, s.store_chain_name, s.store_id
-        ) ranked_stores
-        WHERE total_purchases = (
-            SELECT MAX(total_purchases)
-            FROM (
-                SELECT 
-                    CASE 
-                        WHEN c.age BETWEEN 18 AND 25 THEN '18-25'
-                        WHEN c.age BETWEEN 26 AND 35 THEN '26-35'
-                        WHEN c.age BETWEEN 36 AND 50 THEN '36-50'
-                        WHEN c.age BETWEEN 40 AND 49 THEN '40-49'
-                        WHEN c.age BETWEEN 50 AND 59 THEN '50-59'
-                        WHEN c.age BETWEEN 60 AND 69 THEN '60-69'
-                        WHEN c.age BETWEEN 70 AND 79 THEN '70-79'
-                        WHEN c.age BETWEEN 80 AND 89 THEN '80-89'
-                        ELSE '90+'
-                    END AS age_group,
-                    s.store_chain_name,
-                    COUNT(*) AS total_purchases
-                FROM customer_visits cv
-                JOIN customer c ON cv.customer_id = c.customer_id
-                JOIN store s ON cv.store_id = s.store_id
-                GROUP BY age_group, s.store_chain_name, s.store_id
-            ) max_counts
-            WHERE max_counts.age_group = ranked_stores.age_group
-        )
-        ORDER BY age_group;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        headers = ["Age Group", "Store Chain", "Visit Count"]
-        if results:
-            print("\n" + tabulate(results, headers=headers, 
-                                  tablefmt="grid") + "\n")
-        else:
-            print("\nNo results found.\n")
-
+        with reports.open_report(conn, "popular_chain_per_age") as cursor:
+            print()
+            if print_table_stream(cursor, 
+                                  report_headers("popular_chain_per_age"), 
+                                  tablefmt="grid"):
+                print()
+            else:
+                print("No results found.\n")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
 def get_store_chain(conn, store_id):
     """
     Given a store_id, retrieves the corresponding store chain name
     """
     print_section_header("Store Chain Info")
-    cursor = conn.cursor()
-
     if not str(store_id).isdigit():
-            print(f"Invalid input for {store_id}. Please enter a valid number.")
-    cursor.execute("SELECT COUNT(*) FROM store WHERE store_id = %s", (store_id,))
-    exists = cursor.fetchone()[0]
-    if not exists:
-        print(f"Store ID {store_id} does not exist. Please enter a "
-              "valid ID next time.")
+        print(f"Invalid input for {store_id}. Please enter a valid number.")
         return 0
     try:
-        cursor.execute("SELECT store_id_to_store_chain(%s);", (store_id,))
-        result = cursor.fetchone()
-        if result[0]:
-            print(f"Store ID: {store_id}, Store Chain Name: {result[0]}")
+        if not reports.store_exists(conn, store_id):
+            print(f"Store ID {store_id} does not exist. Please enter a "
+                  "valid ID next time.")
+            return 0
+        chain = reports.store_chain(conn, store_id)
+        if chain:
+            print(f"Store ID: {store_id}, Store Chain Name: {chain}")
         else:
             print(f"No associated store chain with given store_id: {store_id}")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
 
         
 def get_specific_store_analysis(conn, store_id):
@@ -774,7 +581,6 @@ def get_specific_store_analysis(conn, store_id):
     Fetches the number of open stores for a store chain (store_count) 
     and calculates the store score (store_score) for a specific store
     """
-    cursor = conn.cursor()
     print_section_header("Store Analysis Page")
     print(f"Welcome! You are viewing the number of chains and chain store "
           f"score for store with store_id {store_id}")
@@ -783,13 +589,7 @@ def get_specific_store_analysis(conn, store_id):
     get_store_chain(conn, store_id)
 
     try:
-        cursor.execute("SELECT store_count(%s);", (store_id,))
-        store_count_result = cursor.fetchone()
-        num_open_stores = store_count_result[0] if store_count_result else 0
-
-        cursor.execute("SELECT store_score(%s);", (store_id,))
-        store_score_result = cursor.fetchone()
-        store_score = store_score_result[0] if store_score_result else 0
+        num_open_stores, store_score = reports.store_summary(conn, store_id)
 
         print(f"\nAnalysis for Store ID: {store_id}")
         print("------------------------------------------------------")
@@ -800,45 +600,19 @@ def get_specific_store_analysis(conn, store_id):
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
 
-    finally:
-        cursor.close()
-
-# WORKING ON RN
 def get_specific_inventory_analysis(conn):
     """
     Retrieves products with the highest price in inventory
     """
     print_section_header("Most Expensive Items")
-    cursor = conn.cursor()
     print("Welcome! You are viewing the 10 most expensive products in "
           "inventory across all stores.")
-    query = """
-        SELECT 
-            inventory.product_id, 
-            store.store_chain_name,
-            inventory.store_location, 
-            inventory.product_price_usd
-        FROM inventory JOIN store 
-        ON inventory.store_id = store.store_id 
-        AND inventory.store_location = store.store_location
-        ORDER BY inventory.product_price_usd DESC
-        LIMIT 10;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        print("\n Store Sale Statistics")
-        headers = ["Product ID", "Store Chain", "Location", "Product Price"]
-        table = []
-        for row in results:
-            table.append([row[0], row[1], row[2], row[3]])
-
-        # Print the table using tabulate
-        print(tabulate(table, headers=headers, tablefmt="pretty"))
+        with reports.open_report(conn, "top_inventory_price") as cursor:
+            print("\n Store Sale Statistics")
+            print_table_stream(cursor, report_headers("top_inventory_price"))
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
     
 def view_materialized_store_sales(conn):
     """
@@ -847,55 +621,45 @@ def view_materialized_store_sales(conn):
     or any other key to quit
     """
     print_section_header("View Page")
-    cursor = conn.cursor()
-    query = """
-        SELECT store_id, total_sales, 
-        num_purchases, 
-        avg_discount, 
-        min_price, max_price
-        FROM mv_store_sales_stats;
-    """
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-
-        if not results:
+        result = reports.materialized_store_sales(conn)
+        if not result.rows:
             print("No sales data available.")
             return
-
-        headers = ["Store ID", "Total Sales ($)", "Num Purchases", 
-                   "Avg Discount (%)", "Min Price ($)", "Max Price ($)"]
-
-        page_size = 10 
-        total_rows = len(results)
-        total_pages = (total_rows + page_size - 1) // page_size 
-        start = 0
-        page_num = 1
-
-        while start < total_rows:
-            end = start + page_size
-            table = [list(row) for row in results[start:end]]
-            
-            print("\nStore Sales Statistics")
-            print(tabulate(table, headers=headers, tablefmt="pretty"))
-
-            print(f"\nPage {page_num} of {total_pages}")
-
-            if end >= total_rows:
-                break
-            
-            user_input = input("\nPress 'N' to view next page, or "
-                               "any other key to exit: ").strip().lower()
-            if user_input != 'n':
-                break
-
-            start += page_size 
-            page_num += 1  
-
+        print_pages(result.rows, result.headers, 
+                    title="\nStore Sales Statistics")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+    
+def get_customer_segments(conn):
+    """
+    Shows how customers split into recency/frequency/monetary (RFM) 
+    segments, and optionally the customers in one segment.
+    """
+    print_section_header("Customer Analysis Page")
+    print("Welcome! You are viewing customer segments based on how recently "
+          "and how often customers buy and how much they spend.")
+    try:
+        result = rfm.rfm_segments(conn)
+        if not result.rows:
+            print("\nNo results found.\n")
+            return
+        print(f"\n{result.title}:")
+        print(tabulate(result.rows, headers=result.headers, tablefmt="pretty"))
+        segment = input("\nEnter a segment name to list its customers, or "
+                        "press Enter to continue: ").strip()
+        if segment == "":
+            return
+        customers = rfm.customer_rfm(conn)
+        rows = [row for row in customers.rows if row[-1] == segment]
+        if not rows:
+            print(f"No customers in segment '{segment}'. Please check the "
+                  "spelling (and case).")
+            return
+        print_pages(rows, customers.headers, 
+                    title=f"\nCustomers in {segment}:")
     except mysql.connector.Error as err:
         sys.stderr.write(f"Error: {err}\n")
-    finally:
-        cursor.close()
     
 def create_account_client(conn):
     while True:
@@ -952,6 +716,8 @@ def create_account_client(conn):
                                    last_name, is_store_manager, 
                                    phone_number, None))
             conn.commit()
+            if router:
+                router.note_write()
             print(f"User account created successfully. ")
             break
 
@@ -1058,6 +824,7 @@ def show_client_options(conn):
     # data science related questions
     # like asking more about beauty products bought by 10-20 year olds. 
     # We can also use user defined functions for this.
+    global approximate
     
     while True:
         print_section_header("Menu Page")
@@ -1068,9 +835,20 @@ def show_client_options(conn):
         print('  (D) - Get Overall Store Statistics. This outputs a view.')
         print('  (E) - Find Chain Store')
         print('  (F) - Get Products with the Highest Price in Inventory of a Store')
+        print('  (G) - Export a Report to CSV/JSONL')
+        print('  (H) - Get Customer Segments (Recency, Frequency, Spend)')
+        if approximate:
+            print('  (I) - Switch to exact results (currently approximate)')
+        else:
+            print('  (I) - Switch to approximate results for faster '
+                  'store, gender and age totals')
         print('  (q) - Quit')
         print()
         ans = input('Enter an option: ').lower()
+        # reports read from the replica unless it is lagging or has not
+        # applied this session's writes yet
+        if router:
+            conn = router.reader(read_your_writes=True)
         if ans == 'a':
             get_age_stats(conn)
         elif ans == 'b':
@@ -1084,6 +862,14 @@ def show_client_options(conn):
             get_store_chain(conn, store_id)
         elif ans == 'f':
             get_specific_inventory_analysis(conn)
+        elif ans == 'g':
+            export_report_interface(conn)
+        elif ans == 'h':
+            get_customer_segments(conn)
+        elif ans == 'i':
+            approximate = not approximate
+            print("Showing " + ("approximate" if approximate else "exact")
+                  + " results.")
         elif ans == 'q':
             quit_ui()
         else:
@@ -1127,5 +913,8 @@ if __name__ == '__main__':
     # You'll need to use cursor = conn.cursor() each time you are
     # about to execute a query with cursor.execute(<sqlquery>)
     conn = get_conn()
+    router = ConnectionRouter.from_env(conn, "client", "client_pw", 
+                                       "retaildb")
     main(conn)
+    router.close()
     conn.close()
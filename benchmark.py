@@ -0,0 +1,423 @@
+"""
+Times report queries against a loaded retaildb. Benchmarks are meant to be
+run on a large dataset made with generate_data.py, e.g.
+    $ python3 benchmark.py age-chain --repeat 5
+
+Run `python3 benchmark.py -h` to list the benchmarks.
+"""
+
+import argparse
+import datetime
+import itertools
+import statistics
+import threading
+import time
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+from provision_users import provision_accounts
+from purchases import insert_purchase
+from outbox_worker import drain_outbox
+from parallel import SHARDED_REPORTS, make_pool, run_sharded_report
+from snapshot import restore_snapshot
+from write_buffer import FLUSH_DELAY_MS, FLUSH_ROWS, PurchaseWriteBuffer
+import reports
+
+# The most-popular-chain-per-age-group query before it was rewritten with
+# RANK(): the grouped join runs twice (once in a correlated subquery) and
+# store is joined on store_id alone.
+LEGACY_POPULAR_CHAIN_PER_AGE_QUERY = """
+    SELECT
+        age_group,
+        store_chain,
+        total_purchases
+    FROM (
+        SELECT
+            c.age_bucket AS age_group,
+            s.store_chain_name AS store_chain,
+            COUNT(*) AS total_purchases
+        FROM customer_visits cv
+        JOIN customer c ON cv.customer_id = c.customer_id
+        JOIN store s ON cv.store_id = s.store_id
+        GROUP BY age_group, s.store_chain_name, s.store_id
+    ) ranked_stores
+    WHERE total_purchases = (
+        SELECT MAX(total_purchases)
+        FROM (
+            SELECT
+                c.age_bucket AS age_group,
+                s.store_chain_name,
+                COUNT(*) AS total_purchases
+            FROM customer_visits cv
+            JOIN customer c ON cv.customer_id = c.customer_id
+            JOIN store s ON cv.store_id = s.store_id
+            GROUP BY age_group, s.store_chain_name, s.store_id
+        ) max_counts
+        WHERE max_counts.age_group = ranked_stores.age_group
+    )
+    ORDER BY age_group;
+"""
+
+# Procedures that recompute every summary table from purchase, run after a
+# benchmark removes the purchases it inserted
+SUMMARY_REBUILD_PROCEDURES = [
+    "sp_refresh_mv_store_sales_full",
+    "sp_reconcile_store_profit",
+    "sp_rebuild_payment_method_usage",
+    "sp_rebuild_gender_category_sales",
+    "sp_rebuild_purchase_sample",
+    "sp_rebuild_store_customer_hll",
+]
+
+
+def rebuild_summaries(conn):
+    """
+    Recomputes every summary table from the purchase table, after applying
+    the purchases waiting in the outbox (rebuilds leave those out).
+    """
+    drain_outbox(conn)
+    cursor = conn.cursor()
+    try:
+        for procedure in SUMMARY_REBUILD_PROCEDURES:
+            cursor.callproc(procedure)
+            for result in cursor.stored_results():
+                result.fetchall()
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def delete_purchases(conn, purchase_ids, batch_size=1000):
+    """
+    Deletes the purchases with the given IDs, e.g. ones a benchmark made.
+    """
+    cursor = conn.cursor()
+    purchase_ids = list(purchase_ids)
+    for start in range(0, len(purchase_ids), batch_size):
+        batch = purchase_ids[start:start + batch_size]
+        cursor.execute("DELETE FROM purchase WHERE purchase_id IN ("
+                       + ", ".join(["%s"] * len(batch)) + ")", batch)
+    conn.commit()
+    cursor.close()
+
+
+def next_purchase_id(conn):
+    """
+    Returns the first unused numeric purchase ID.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(CAST(purchase_id AS UNSIGNED)) FROM purchase;")
+    result = cursor.fetchone()[0]
+    cursor.close()
+    return int(result) + 1 if result is not None else 1
+
+
+def print_latencies(name, latencies, elapsed):
+    """
+    Prints the throughput and latency percentiles of timed operations.
+    """
+    if len(latencies) < 2:
+        print(f"{name:<20} {len(latencies)} operations")
+        return
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{name:<20} {len(latencies):>8} ops  "
+          f"{len(latencies) / elapsed:10.1f} ops/s  "
+          f"p50 {cuts[49] * 1000:8.2f}ms  p95 {cuts[94] * 1000:8.2f}ms  "
+          f"p99 {cuts[98] * 1000:8.2f}ms")
+
+
+def time_query(conn, query, params=(), repeat=3):
+    """
+    Runs a query repeat times, fetching every row, and returns the elapsed
+    seconds of each run.
+    """
+    timings = []
+    for _ in range(repeat):
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+        cursor.close()
+    return timings
+
+
+def print_timings(name, timings):
+    print(f"{name:<40} best {min(timings):8.3f}s   "
+          f"median {statistics.median(timings):8.3f}s")
+
+
+def compare_queries(conn, queries, repeat):
+    """
+    Times each (name, query) pair and prints how much faster the last one
+    is than the first.
+    """
+    medians = []
+    for name, query in queries:
+        timings = time_query(conn, query, repeat=repeat)
+        print_timings(name, timings)
+        medians.append(statistics.median(timings))
+    if medians[-1] > 0:
+        print(f"\nSpeedup: {medians[0] / medians[-1]:.1f}x")
+
+
+def bench_age_chain(conn, args):
+    """
+    Legacy vs. window-function most-popular-chain-per-age-group report.
+    """
+    compare_queries(conn, [
+        ("legacy correlated subquery", LEGACY_POPULAR_CHAIN_PER_AGE_QUERY),
+        ("RANK() over pre-aggregated visits",
+         reports.POPULAR_CHAIN_PER_AGE_QUERY),
+    ], args.repeat)
+
+
+def bench_oversell(conn, args):
+    """
+    Concurrent purchases of one product never sell more than its stock.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT product_id, store_id, store_location, qty "
+                   "FROM inventory LIMIT 1;")
+    product_id, store_id, store_location, original_qty = cursor.fetchone()
+    cursor.execute("SELECT MIN(customer_id) FROM customer;")
+    customer_id = cursor.fetchone()[0]
+    inventory_key = (product_id, store_id, store_location)
+    cursor.execute("UPDATE inventory SET qty = %s WHERE product_id = %s "
+                   "AND store_id = %s AND store_location = %s;",
+                   (args.stock,) + inventory_key)
+    conn.commit()
+
+    purchase_ids = itertools.count(next_purchase_id(conn))
+    sold_ids = []
+    latencies = []
+    out_of_stock = []
+    errors = []
+
+    def buyer():
+        buyer_conn = connect_from_args(args)
+        try:
+            for _ in range(args.purchases // args.threads):
+                purchase_id = str(next(purchase_ids))
+                start = time.perf_counter()
+                try:
+                    insert_purchase(buyer_conn, (
+                        purchase_id, product_id, store_id, customer_id,
+                        store_location, "Cash", 0, datetime.date.today(),
+                        1.00))
+                    latencies.append(time.perf_counter() - start)
+                    sold_ids.append(purchase_id)
+                except mysql.connector.Error as err:
+                    if err.sqlstate == "45000":
+                        out_of_stock.append(purchase_id)
+                    else:
+                        errors.append(err)
+        finally:
+            buyer_conn.close()
+
+    threads = [threading.Thread(target=buyer) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    cursor.execute("SELECT qty FROM inventory WHERE product_id = %s "
+                   "AND store_id = %s AND store_location = %s;", inventory_key)
+    final_qty = cursor.fetchone()[0]
+    attempted = args.purchases // args.threads * args.threads
+    print(f"{args.threads} threads tried {attempted} purchases of a "
+          f"product with {args.stock} in stock")
+    print_latencies("successful purchase", latencies, elapsed)
+    print(f"sold {len(sold_ids)}, out of stock {len(out_of_stock)}, "
+          f"other errors {len(errors)}, stock left {final_qty}")
+    for err in errors[:5]:
+        print(f"  {err}")
+    oversold = final_qty < 0 or len(sold_ids) > args.stock
+    consistent = final_qty == args.stock - len(sold_ids)
+    print("PASS" if not oversold and consistent else "FAIL: oversold")
+
+    # put the database back the way it was
+    delete_purchases(conn, sold_ids)
+    cursor.execute("UPDATE inventory SET qty = %s WHERE product_id = %s "
+                   "AND store_id = %s AND store_location = %s;",
+                   (original_qty,) + inventory_key)
+    conn.commit()
+    cursor.close()
+    rebuild_summaries(conn)
+
+
+def bench_buffered(conn, args):
+    """
+    Purchases per second committed one at a time vs. through the write
+    buffer.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT product_id, store_id, store_location, qty "
+                   "FROM inventory LIMIT 1;")
+    product_id, store_id, store_location, original_qty = cursor.fetchone()
+    cursor.execute("SELECT MIN(customer_id) FROM customer;")
+    customer_id = cursor.fetchone()[0]
+    inventory_key = (product_id, store_id, store_location)
+    # enough stock for every purchase of both runs
+    cursor.execute("UPDATE inventory SET qty = %s WHERE product_id = %s "
+                   "AND store_id = %s AND store_location = %s;",
+                   (2 * args.purchases,) + inventory_key)
+    conn.commit()
+
+    purchase_ids = itertools.count(next_purchase_id(conn))
+    sold_ids = []
+
+    def purchases():
+        for _ in range(args.purchases):
+            purchase_id = str(next(purchase_ids))
+            sold_ids.append(purchase_id)
+            yield (purchase_id, product_id, store_id, customer_id,
+                   store_location, "Cash", 0, datetime.date.today(), 1.00)
+
+    try:
+        start = time.perf_counter()
+        for purchase in purchases():
+            insert_purchase(conn, purchase)
+        one_at_a_time = time.perf_counter() - start
+
+        buffer_conn = connect_from_args(args)
+        try:
+            start = time.perf_counter()
+            with PurchaseWriteBuffer(buffer_conn, args.flush_rows,
+                                     args.flush_ms) as buffer:
+                futures = [buffer.submit(purchase)
+                           for purchase in purchases()]
+            errors = [future.exception() for future in futures
+                      if future.exception()]
+            buffered = time.perf_counter() - start
+        finally:
+            buffer_conn.close()
+
+        print(f"{'insert_purchase per purchase':<40} "
+              f"{args.purchases / one_at_a_time:10.1f} purchases/s")
+        label = f"write buffer, {args.flush_rows} per commit"
+        print(f"{label:<40} {args.purchases / buffered:10.1f} purchases/s")
+        print(f"\nSpeedup: {one_at_a_time / buffered:.1f}x")
+        for err in errors[:5]:
+            print(f"  {err}")
+    finally:
+        # put the database back the way it was
+        delete_purchases(conn, sold_ids)
+        cursor.execute("UPDATE inventory SET qty = %s WHERE product_id = %s "
+                       "AND store_id = %s AND store_location = %s;",
+                       (original_qty,) + inventory_key)
+        conn.commit()
+        cursor.close()
+        rebuild_summaries(conn)
+
+
+def bench_provision(conn, args):
+    """
+    Accounts per second created one CALL sp_add_user at a time vs. in bulk.
+    """
+    def accounts(prefix):
+        return [{"username": f"{prefix}{i:06d}", "password": f"pw_{i}",
+                 "first_name": "Bench", "last_name": f"User{i}",
+                 "is_admin": "1" if i % 10 == 0 else "0",
+                 "is_store_manager": "1" if i % 3 == 0 else "0",
+                 "phone_number": "555-0100", "employee_type": "engineer"}
+                for i in range(args.accounts)]
+
+    cursor = conn.cursor()
+    try:
+        start = time.perf_counter()
+        for account in accounts("bench_call_"):
+            cursor.execute("CALL sp_add_user(%s, %s, %s, %s, %s, %s, %s, %s)",
+                           (account["username"], account["password"],
+                            int(account["is_admin"]), account["first_name"],
+                            account["last_name"],
+                            int(account["is_store_manager"]),
+                            account["phone_number"],
+                            account["employee_type"]))
+            conn.commit()
+        one_at_a_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        provision_accounts(conn, accounts("bench_bulk_"))
+        bulk = time.perf_counter() - start
+
+        print(f"{'CALL sp_add_user per account':<40} "
+              f"{args.accounts / one_at_a_time:10.1f} accounts/s")
+        print(f"{'provision_users batches':<40} "
+              f"{args.accounts / bulk:10.1f} accounts/s")
+        print(f"\nSpeedup: {one_at_a_time / bulk:.1f}x")
+    finally:
+        # client and admin rows are removed by ON DELETE CASCADE
+        cursor.execute("DELETE FROM user_info WHERE username LIKE "
+                       "'bench\\_call\\_%' OR username LIKE "
+                       "'bench\\_bulk\\_%';")
+        conn.commit()
+        cursor.close()
+
+
+def bench_sharded(conn, args):
+    """
+    Per-store reports as one query vs. split into parallel store_id shards.
+    """
+    pool = make_pool(args, args.shards)
+    for name in SHARDED_REPORTS:
+        single = [reports.run_report(conn, name).elapsed
+                  for _ in range(args.repeat)]
+        sharded = [run_sharded_report(pool, name).elapsed
+                   for _ in range(args.repeat)]
+        print_timings(f"{name} single query", single)
+        print_timings(f"{name} {args.shards} shards", sharded)
+        if statistics.median(sharded) > 0:
+            speedup = statistics.median(single) / statistics.median(sharded)
+            print(f"{'':<40} speedup {speedup:.1f}x")
+
+
+# name -> function(conn, args); each function's docstring is its help text
+BENCHMARKS = {
+    "age-chain": bench_age_chain,
+    "buffered": bench_buffered,
+    "oversell": bench_oversell,
+    "provision": bench_provision,
+    "sharded": bench_sharded,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retail reports.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS),
+                        help="; ".join(f"{name}: {fn.__doc__.strip()}"
+                                       for name, fn in BENCHMARKS.items()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--purchases", type=int, default=2000,
+                        help="purchases attempted (oversell, buffered)")
+    parser.add_argument("--stock", type=int, default=500,
+                        help="units in stock at the start (oversell)")
+    parser.add_argument("--accounts", type=int, default=2000,
+                        help="accounts created each way (provision)")
+    parser.add_argument("--flush-rows", type=int, default=FLUSH_ROWS,
+                        help="purchases per commit (buffered)")
+    parser.add_argument("--flush-ms", type=int, default=FLUSH_DELAY_MS,
+                        help="longest wait before a commit (buffered)")
+    parser.add_argument("--shards", type=int, default=8,
+                        help="store_id ranges run at once (sharded)")
+    parser.add_argument("--snapshot", metavar="DIR",
+                        help="restore this snapshot (see snapshot.py) "
+                        "before running")
+    add_connection_args(parser, user="admin", password="admin_pw")
+    args = parser.parse_args()
+    conn = connect_from_args(args, allow_local_infile=bool(args.snapshot))
+    try:
+        if args.snapshot:
+            start = time.perf_counter()
+            restore_snapshot(conn, args.snapshot)
+            print(f"Restored {args.snapshot} in "
+                  f"{time.perf_counter() - start:.1f}s.")
+        BENCHMARKS[args.benchmark](conn, args)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
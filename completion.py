@@ -0,0 +1,189 @@
+"""
+Prefix completion and local validation of the store locations and product
+IDs admins type when entering a purchase. The locations of every store and
+the products stocked at every store location are loaded into sorted lists
+once per session, so completing a prefix or checking a value is a binary
+search in memory instead of a query. Like MySQL's default collation, the
+index ignores case, and hands back each value as it is spelled in the
+database.
+
+Tab completion needs the readline module (part of Python on Linux and
+macOS); without it the prompts work as plain input() and values are still
+checked locally.
+"""
+
+import bisect
+import time
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+# seconds after which the index is reloaded before its next use
+REFRESH_INTERVAL = 300
+# a value that is not in the index reloads it first (in case it was added
+# since), but not more often than every this many seconds
+MISS_REFRESH_INTERVAL = 5
+
+INVENTORY_KEYS_QUERY = """
+    SELECT store_id, store_location, product_id
+    FROM inventory
+    ORDER BY store_id, store_location, product_id;
+"""
+STORE_KEYS_QUERY = """
+    SELECT store_id, store_location FROM store;
+"""
+
+
+class SortedIndex:
+    """
+    A list of strings sorted without case that finds every string with a
+    given prefix, in any case, with two binary searches.
+    """
+
+    def __init__(self, values=()):
+        canonical = {}
+        for value in values:
+            canonical.setdefault(value.casefold(), value)
+        self.keys = sorted(canonical)
+        self.values = [canonical[key] for key in self.keys]
+
+    def canonical(self, value):
+        """
+        Returns value as it is spelled in the index, or None if it is not
+        in the index in any case.
+        """
+        key = value.casefold()
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.values[index]
+        return None
+
+    def __contains__(self, value):
+        return self.canonical(value) is not None
+
+    def __len__(self):
+        return len(self.values)
+
+    def complete(self, prefix):
+        """
+        Returns the values starting with prefix (in any case), in order.
+        """
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self.keys, prefix)
+        # every string with the prefix sorts before prefix + the largest
+        # character
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start)
+        return self.values[start:end]
+
+
+class InventoryIndex:
+    """
+    Store locations per store ID and product IDs per (store ID, store
+    location), loaded from MySQL by load() and reloaded when stale.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.products = {}
+        self.loaded_at = None
+
+    def load(self, conn):
+        locations = {}
+        products = {}
+        cursor = conn.cursor()
+        try:
+            # stores with nothing in stock are still valid locations
+            cursor.execute(STORE_KEYS_QUERY)
+            for store_id, store_location in cursor.fetchall():
+                locations.setdefault(store_id, []).append(store_location)
+            cursor.execute(INVENTORY_KEYS_QUERY)
+            for store_id, store_location, product_id in cursor:
+                products.setdefault((store_id, store_location.casefold()),
+                                    []).append(product_id)
+        finally:
+            cursor.close()
+        self.locations = {store_id: SortedIndex(values)
+                          for store_id, values in locations.items()}
+        self.products = {key: SortedIndex(values)
+                         for key, values in products.items()}
+        self.loaded_at = time.monotonic()
+
+    def age(self):
+        if self.loaded_at is None:
+            return float("inf")
+        return time.monotonic() - self.loaded_at
+
+    def refresh(self, conn, missed=False):
+        """
+        Reloads the index if it was never loaded or is older than
+        REFRESH_INTERVAL, or after a miss (missed=True) if it is older than
+        MISS_REFRESH_INTERVAL. Returns whether it was reloaded.
+        """
+        limit = MISS_REFRESH_INTERVAL if missed else REFRESH_INTERVAL
+        if self.age() < limit:
+            return False
+        self.load(conn)
+        return True
+
+    def store_locations(self, store_id):
+        return self.locations.get(int(store_id), SortedIndex())
+
+    def store_products(self, store_id, store_location):
+        return self.products.get((int(store_id), store_location.casefold()),
+                                 SortedIndex())
+
+    def has_location(self, conn, store_id, store_location):
+        """
+        Returns the store's location named store_location (in any case) as
+        it is spelled in the database, or None if there is none, reloading
+        the index once if it is not found.
+        """
+        location = self.store_locations(store_id).canonical(store_location)
+        if location is None and self.refresh(conn, missed=True):
+            location = self.store_locations(store_id).canonical(
+                store_location)
+        return location
+
+    def has_product(self, conn, store_id, store_location, product_id):
+        """
+        Returns product_id as it is spelled in the store location's 
+        inventory, or None if it is not stocked there, reloading the index
+        once if it is not found.
+        """
+        product = self.store_products(store_id,
+                                      store_location).canonical(product_id)
+        if product is None and self.refresh(conn, missed=True):
+            product = self.store_products(
+                store_id, store_location).canonical(product_id)
+        return product
+
+
+def input_with_completion(prompt, index):
+    """
+    input() where Tab completes the line from a SortedIndex: once to
+    complete a unique match, twice to list all matches.
+    """
+    if readline is None:
+        return input(prompt)
+
+    def complete(text, state):
+        matches = index.complete(text)
+        return matches[state] if state < len(matches) else None
+
+    old_completer = readline.get_completer()
+    old_delims = readline.get_completer_delims()
+    readline.set_completer(complete)
+    # complete the whole line, since locations can contain spaces
+    readline.set_completer_delims("")
+    if "libedit" in (readline.__doc__ or ""):
+        # macOS Python's readline is libedit, which binds keys differently
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+    try:
+        return input(prompt)
+    finally:
+        readline.set_completer(old_completer)
+        readline.set_completer_delims(old_delims)
@@ -0,0 +1,179 @@
+"""
+Streams any report in reports.REPORTS to a CSV or JSONL file, optionally
+gzip-compressed. Rows are read from an unbuffered cursor with fetchmany, so 
+at most one batch of the result is held in memory no matter how many rows 
+the report returns. The reports computed in Python (rfm.RFM_REPORTS) can be
+exported the same way.
+
+Command-line usage:
+    $ python3 export.py store_stats store_stats.csv
+    $ python3 export.py store_profit profit.jsonl.gz
+    $ python3 export.py gender_by_category books.csv --param Books
+"""
+
+import argparse
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import sys
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+from abstracted import print_section_header
+from reports import REPORTS, ADMIN_REPORTS, check_params, open_report
+from rfm import RFM_REPORTS
+
+# Number of rows fetched from the server (and held in memory) at a time
+EXPORT_BATCH_SIZE = 10000
+
+EXPORT_FORMATS = {"csv", "jsonl"}
+
+
+def json_value(value):
+    """
+    Converts values MySQL returns that json cannot encode (DECIMAL, DATE)
+    into strings, keeping DECIMAL values exact.
+    """
+    if isinstance(value, (decimal.Decimal, datetime.date, 
+                          datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
+
+
+def guess_format(path):
+    """
+    Returns (format, compress) for an output path such as "out.csv.gz".
+    """
+    compress = path.endswith(".gz")
+    name = path[:-3] if compress else path
+    fmt = name.rsplit(".", 1)[-1].lower() if "." in name else "csv"
+    if fmt == "json":
+        fmt = "jsonl"
+    if fmt not in EXPORT_FORMATS:
+        fmt = "csv"
+    return fmt, compress
+
+
+def write_rows(cursor, out, fmt, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Writes every row of an executed cursor to an open text file, one batch
+    at a time. Returns the number of rows written.
+    """
+    return write_batches(cursor.column_names, 
+                         iter(lambda: cursor.fetchmany(batch_size), []), 
+                         out, fmt)
+
+
+def write_batches(columns, batches, out, fmt):
+    """
+    Writes lists of rows with the given column names to an open text file.
+    Returns the number of rows written.
+    """
+    total_rows = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    for rows in batches:
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            out.writelines(
+                json.dumps(dict(zip(columns, map(json_value, row)))) + "\n"
+                for row in rows)
+        total_rows += len(rows)
+    return total_rows
+
+
+def export_report(conn, name, path, params=(), fmt=None, compress=None,
+                  batch_size=EXPORT_BATCH_SIZE):
+    """
+    Runs the report called name and streams its rows to path. The format
+    and compression are taken from the file extension unless given.
+    Returns the number of rows written. Raises ValueError if the parameters
+    do not fit the report.
+    """
+    guessed_fmt, guessed_compress = guess_format(path)
+    fmt = fmt or guessed_fmt
+    compress = guessed_compress if compress is None else compress
+    opener = gzip.open if compress else open
+
+    if name in RFM_REPORTS:
+        result = RFM_REPORTS[name][1](conn)
+        with opener(path, "wt", newline="", encoding="utf-8") as out:
+            return write_batches(result.headers, [result.rows], out, fmt)
+
+    # the report's cursor is unbuffered, so the result stays on the server
+    # until it is fetched instead of being read into memory on execute
+    with open_report(conn, name, params) as cursor:
+        with opener(path, "wt", newline="", encoding="utf-8") as out:
+            return write_rows(cursor, out, fmt, batch_size)
+
+
+def export_report_interface(conn, is_admin=False):
+    """
+    Menu page that lets a user pick a report and export it to a file.
+    """
+    titles = {name: report.title for name, report in REPORTS.items()
+              if is_admin or name not in ADMIN_REPORTS}
+    titles.update((name, title) for name, (title, _) in RFM_REPORTS.items())
+    names = list(titles)
+    print_section_header("Export Page")
+    print("Which report would you like to export? ")
+    for i, name in enumerate(names, 1):
+        print(f"  ({i}) - {titles[name]}")
+    ans = input("Enter an option: ").strip()
+    if not ans.isdigit() or not 1 <= int(ans) <= len(names):
+        print("Invalid option. Please try again. ")
+        return
+    name = names[int(ans) - 1]
+    params = [input(f"Enter {param.replace('_', ' ')}: ").strip() 
+              for param in (REPORTS[name].params if name in REPORTS else [])]
+    path = input("Enter output file (.csv, .jsonl, add .gz to compress): ")
+    path = path.strip()
+    if path == "":
+        print("You did not enter a file name. Please try again. ")
+        return
+    try:
+        total_rows = export_report(conn, name, path, params)
+        print(f"Exported {total_rows} rows to {path}.")
+    except ValueError as err:
+        print(f"{err}. Please try again. ")
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+    except OSError as err:
+        sys.stderr.write(f"Could not write {path}: {err}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a retail report "
+                                     "to CSV or JSONL.")
+    parser.add_argument("report", choices=sorted(REPORTS) + sorted(RFM_REPORTS))
+    parser.add_argument("path", help="output file, e.g. out.csv or "
+                        "out.jsonl.gz")
+    parser.add_argument("--param", action="append", default=[],
+                        help="query parameter, repeat for each parameter")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS))
+    parser.add_argument("--gzip", action="store_true", default=None)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    try:
+        if args.report in REPORTS:
+            check_params(args.report, args.param)
+    except ValueError as err:
+        parser.error(str(err))
+    conn = connect_from_args(args)
+    try:
+        total_rows = export_report(conn, args.report, args.path, args.param,
+                                   args.format, args.gzip, args.batch_size)
+        print(f"Exported {total_rows} rows to {args.path}.", file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
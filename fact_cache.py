@@ -0,0 +1,310 @@
+"""
+An on-disk columnar copy of purchase, joined with the customer's age and
+gender and the product's category, that analysis programs read as
+memory-mapped NumPy arrays instead of querying MySQL, e.g.
+    $ python3 fact_cache.py refresh cache/purchases
+
+    >>> from fact_cache import FactCache
+    >>> facts = FactCache("cache/purchases").columns()
+    >>> facts["sale_price_usd"].sum()
+
+Each column is a flat binary file of its NumPy dtype, and manifest.json
+holds the number of rows, the newest purchase_number cached and the
+values behind each categorical column's integer codes. A rebuild writes
+the columns to new files (the manifest's "generation") rather than
+truncating ones readers may have mapped. Readers map the
+files read-only, so any number of processes share one copy of them in the
+operating system's page cache, and only ever see the rows the manifest
+they read counts.
+
+A refresh appends the purchases with a purchase_number above the newest
+one cached, found with idx_purchase_number. If purchases were deleted
+since, or customers' or products' attributes changed, rebuild the cache
+(refresh --rebuild).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# purchases fetched and appended at a time
+FACT_BATCH_SIZE = 100000
+
+# (column, dtype) in the order FACT_QUERY returns them; "category" columns
+# are stored as int32 codes into the manifest's list of their values
+FACT_COLUMNS = [
+    ("purchase_number", "int64"),
+    ("customer_id", "int64"),
+    ("store_id", "int64"),
+    ("store_location", "category"),
+    ("product_id", "category"),
+    ("product_category", "category"),
+    ("gender", "category"),
+    ("age", "int16"),
+    ("age_bucket", "category"),
+    ("payment_method", "category"),
+    ("discount_percent", "int16"),
+    ("txn_date", "datetime64[D]"),
+    ("price_usd", "float64"),
+    ("sale_price_usd", "float64"),
+]
+
+# purchases after a purchase_number, with the attributes analyses group
+# by; dates are sent as days since 1970-01-01 (TO_DAYS of that is 719528)
+FACT_QUERY = """
+    SELECT p.purchase_number,
+        p.customer_id,
+        p.store_id,
+        p.store_location,
+        p.product_id,
+        pr.product_category,
+        c.gender,
+        c.age,
+        c.age_bucket,
+        p.payment_method,
+        p.discount_percent,
+        TO_DAYS(p.txn_date) - 719528,
+        CAST(p.purchased_product_price_usd AS DOUBLE),
+        CAST(CAST(p.purchased_product_price_usd
+                  * (1 - (p.discount_percent / 100.0)) AS DECIMAL(10,2))
+             AS DOUBLE)
+    FROM purchase p
+    JOIN customer c ON p.customer_id = c.customer_id
+    JOIN product pr ON p.product_id = pr.product_id
+    WHERE p.purchase_number > %s
+    ORDER BY p.purchase_number;
+"""
+CACHED_COUNT_QUERY = """
+    SELECT COUNT(*) FROM purchase WHERE purchase_number <= %s;
+"""
+
+
+def storage_dtype(dtype):
+    return np.dtype("int32" if dtype == "category" else dtype)
+
+
+def empty_manifest(generation=0):
+    return {"version": MANIFEST_VERSION, "generation": generation,
+            "rows": 0, "last_purchase_number": 0,
+            "categories": {name: [] for name, dtype in FACT_COLUMNS
+                           if dtype == "category"}}
+
+
+class FactCache:
+    """
+    The fact cache in a directory. columns() reads it; refresh() brings it
+    up to date with MySQL.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def column_path(self, name, manifest):
+        # a rebuild writes a new generation of files, since readers may
+        # still have the old ones mapped
+        return self.path(f"{name}.{manifest['generation']}.bin")
+
+    def read_manifest(self):
+        """
+        Returns the manifest, or an empty one if nothing is cached yet.
+        """
+        try:
+            with open(self.path(MANIFEST_NAME)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return empty_manifest()
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{self.directory} is not a version "
+                             f"{MANIFEST_VERSION} fact cache")
+        return manifest
+
+    def write_manifest(self, manifest):
+        # written to a new file and renamed over the old one, so readers
+        # see either the old or the new manifest in full
+        temp_path = self.path(MANIFEST_NAME + ".tmp")
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temp_path, self.path(MANIFEST_NAME))
+
+    def columns(self, manifest=None):
+        """
+        Returns a dict of column name -> read-only memory-mapped array of
+        the cached rows, with the manifest's "categories" under the key
+        "categories" for decoding the category columns.
+        """
+        manifest = manifest or self.read_manifest()
+        columns = {}
+        for name, dtype in FACT_COLUMNS:
+            if manifest["rows"] == 0:
+                columns[name] = np.empty(0, dtype=storage_dtype(dtype))
+            else:
+                columns[name] = np.memmap(self.column_path(name, manifest),
+                                          dtype=storage_dtype(dtype),
+                                          mode="r",
+                                          shape=(manifest["rows"],))
+        columns["categories"] = manifest["categories"]
+        return columns
+
+    def decode(self, name, codes, manifest=None):
+        """
+        Returns the values of a category column for an array of its codes.
+        """
+        manifest = manifest or self.read_manifest()
+        return np.asarray(manifest["categories"][name], dtype=object)[codes]
+
+    def lock(self):
+        """
+        Opens the lock file that keeps two processes from refreshing the
+        cache at once (held until the returned file is closed).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(self.path(".lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def refresh(self, conn, rebuild=False):
+        """
+        Appends the purchases added since the last refresh, or caches every
+        purchase again if rebuild is set or purchases were deleted since.
+        Returns the number of rows appended.
+        """
+        with self.lock():
+            manifest = self.read_manifest()
+            if not rebuild and manifest["rows"] > 0:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(CACHED_COUNT_QUERY,
+                                   (manifest["last_purchase_number"],))
+                    rebuild = cursor.fetchone()[0] != manifest["rows"]
+                finally:
+                    cursor.close()
+            if not rebuild:
+                return self.append_new(conn, manifest)
+            old_manifest = manifest
+            appended = self.append_new(
+                conn, empty_manifest(old_manifest["generation"] + 1))
+            # processes that mapped the old files keep them until they
+            # unmap them
+            for name, _ in FACT_COLUMNS:
+                try:
+                    os.remove(self.column_path(name, old_manifest))
+                except FileNotFoundError:
+                    pass
+            return appended
+
+    def append_new(self, conn, manifest):
+        """
+        Appends the purchases after manifest's last_purchase_number to the
+        column files and then writes the updated manifest. Returns the
+        number of rows appended.
+        """
+        files = {}
+        for name, dtype in FACT_COLUMNS:
+            path = self.column_path(name, manifest)
+            column_file = open(path, "r+b" if os.path.exists(path) else "wb")
+            # files are longer than the manifest says if an earlier refresh
+            # stopped part way; no reader maps those rows, and they are
+            # written again
+            column_file.truncate(manifest["rows"]
+                                 * storage_dtype(dtype).itemsize)
+            column_file.seek(0, os.SEEK_END)
+            files[name] = column_file
+        codes = {name: {value: code for code, value in enumerate(values)}
+                 for name, values in manifest["categories"].items()}
+        appended = 0
+        cursor = conn.cursor()
+        try:
+            cursor.execute(FACT_QUERY, (manifest["last_purchase_number"],))
+            while True:
+                rows = cursor.fetchmany(FACT_BATCH_SIZE)
+                if not rows:
+                    break
+                for (name, dtype), values in zip(FACT_COLUMNS, zip(*rows)):
+                    if dtype == "category":
+                        array = self.encode(values, codes[name],
+                                            manifest["categories"][name])
+                    else:
+                        array = np.array(values, dtype=dtype)
+                    files[name].write(array.tobytes())
+                appended += len(rows)
+                manifest["last_purchase_number"] = int(rows[-1][0])
+        finally:
+            cursor.close()
+            for column_file in files.values():
+                column_file.flush()
+                os.fsync(column_file.fileno())
+                column_file.close()
+        manifest["rows"] += appended
+        manifest["refreshed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.write_manifest(manifest)
+        return appended
+
+    @staticmethod
+    def encode(values, value_codes, categories):
+        """
+        Returns the int32 codes of a batch of category values, giving new
+        values the next free codes (existing codes never change).
+        """
+        unique, inverse = np.unique(np.asarray(values, dtype=object),
+                                    return_inverse=True)
+        unique_codes = np.empty(len(unique), dtype=np.int32)
+        for index, value in enumerate(unique.tolist()):
+            code = value_codes.get(value)
+            if code is None:
+                code = value_codes[value] = len(categories)
+                categories.append(value)
+            unique_codes[index] = code
+        return unique_codes[inverse]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the "
+                                     "memory-mapped purchase fact cache.")
+    parser.add_argument("action", choices=["refresh", "info"])
+    parser.add_argument("directory")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="cache every purchase again")
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    cache = FactCache(args.directory)
+    try:
+        if args.action == "info":
+            manifest = cache.read_manifest()
+            print(f"{manifest['rows']} purchases cached, up to purchase "
+                  f"{manifest['last_purchase_number']}, refreshed "
+                  f"{manifest.get('refreshed_at', 'never')}.")
+            return
+        conn = connect_from_args(args)
+        start = time.perf_counter()
+        try:
+            appended = cache.refresh(conn, args.rebuild)
+        finally:
+            conn.close()
+    except (OSError, ValueError, mysql.connector.Error) as err:
+        sys.stderr.write(f"Error: {err}\n")
+        sys.exit(1)
+    print(f"Cached {appended} new purchases in "
+          f"{time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Generates a large synthetic retail dataset in the same CSV layout as
+data.csv, for benchmarking the reports on more than the 1000 sample rows.
+
+Every customer, store, product, inventory row, popularity row and customer
+visit keeps the same attributes wherever it appears, so the generated file
+loads through load-data.sql without primary key conflicts. To use it, keep
+a copy of the original data.csv, write the generated rows to data.csv and
+rerun the setup scripts listed in the readme:
+    $ cp data.csv data-sample.csv
+    $ python3 generate_data.py --rows 1000000 -o data.csv
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = [
+    "customer_id", "age", "annual_income_usd", "product_category",
+    "product_price_usd", "purchase_date", "store_id", "store_location",
+    "payment_method", "discount_percent", "product_cost_usd", "foot_traffic",
+    "qty", "competitor_price_usd", "full_name", "gender", "year_opened",
+    "is_favorite", "purchase_id", "product_id", "visit_date",
+    "purchased_product_price_usd", "store_chain_name",
+]
+
+CATEGORIES = np.array(["Clothing", "Groceries", "Health & Beauty",
+                       "Home & Kitchen", "Books", "Electronics"])
+LOCATIONS = np.array(["San Jose", "Los Angeles", "New York", "Chicago",
+                      "Houston", "Phoenix", "Philadelphia", "San Antonio",
+                      "San Diego", "Dallas"])
+PAYMENT_METHODS = np.array(["Credit Card", "Debit Card", "Cash",
+                            "Mobile Payment"])
+GENDERS = np.array(["M", "F", "X"])
+FIRST_NAMES = np.array(["Gabriela", "Doris", "James", "Maria", "Wei", "Omar",
+                        "Priya", "Lucas", "Hannah", "Kenji", "Fatima",
+                        "Diego"])
+LAST_NAMES = np.array(["Fuller", "Nguyen", "Smith", "Garcia", "Chen",
+                       "Khan", "Patel", "Brown", "Kim", "Lopez", "Okafor",
+                       "Rossi"])
+
+# purchase_id is CHAR(7), so there can be at most this many purchases
+MAX_ROWS = 10**7 - 1
+# dates are drawn from this many days after START_DATE
+START_DATE = np.datetime64("2021-01-01")
+DATE_RANGE_DAYS = 4 * 365
+# generated rows are written in chunks of this size
+CHUNK_ROWS = 500000
+
+
+def entity_attributes(rng, num_customers, num_store_ids, num_products):
+    """
+    Draws the fixed attributes of every customer, store and product.
+    """
+    customers = {
+        "age": rng.integers(18, 71, num_customers),
+        "gender": GENDERS[rng.integers(0, 3, num_customers)],
+        "income": rng.integers(15000, 200000, num_customers).astype(float),
+        "name": np.char.add(
+            np.char.add(FIRST_NAMES[rng.integers(0, len(FIRST_NAMES),
+                                                 num_customers)], " "),
+            LAST_NAMES[rng.integers(0, len(LAST_NAMES), num_customers)]),
+    }
+    stores = {
+        "chain": np.char.add("Chain", np.arange(1, num_store_ids + 1)
+                             .astype(str)),
+        # every store chain has between 1 and 5 locations
+        "num_locations": rng.integers(1, 6, num_store_ids),
+        "location_offset": rng.integers(0, len(LOCATIONS), num_store_ids),
+        "year_opened": rng.integers(1980, 2024, num_store_ids),
+    }
+    products = {
+        "category": CATEGORIES[rng.integers(0, len(CATEGORIES),
+                                            num_products)],
+        "price": np.round(rng.uniform(5, 999, num_products), 2),
+    }
+    return customers, stores, products
+
+
+def generate_chunk(rng, first_row, num_rows, customers, stores, products):
+    """
+    Returns a DataFrame of num_rows purchases, numbered from first_row.
+    """
+    num_customers = len(customers["age"])
+    num_store_ids = len(stores["chain"])
+    num_products = len(products["price"])
+
+    cust = rng.integers(0, num_customers, num_rows)
+    store = rng.integers(0, num_store_ids, num_rows)
+    loc_index = rng.integers(0, 5, num_rows) % stores["num_locations"][store]
+    loc = (stores["location_offset"][store] + loc_index) % len(LOCATIONS)
+    prod = rng.integers(0, num_products, num_rows)
+
+    # inventory attributes depend only on (product, store, location)
+    combo = (prod * 7919 + store * 104729 + loc * 31) % 1000
+    price = np.round(products["price"][prod] * (0.9 + combo / 5000), 2)
+    cost = np.round(price * (0.5 + (combo % 40) / 100), 2)
+    competitor = np.round(price * (0.85 + (combo % 30) / 100), 2)
+    qty = 100000 + combo
+
+    purchase_date = START_DATE + rng.integers(0, DATE_RANGE_DAYS, num_rows)
+    visit_date = purchase_date - rng.integers(0, 7, num_rows)
+    # foot traffic depends only on (store, location, visit date)
+    day = (visit_date - START_DATE).astype(int)
+    foot_traffic = 100 + (store * 131 + loc * 17 + day * 7) % 900
+    # whether a store is a favorite depends only on (customer, store, loc)
+    is_favorite = ((cust * 13 + store * 7 + loc) % 5 == 0).astype(int)
+
+    return pd.DataFrame({
+        "customer_id": cust + 1,
+        "age": customers["age"][cust],
+        "annual_income_usd": customers["income"][cust],
+        "product_category": products["category"][prod],
+        "product_price_usd": price,
+        "purchase_date": purchase_date.astype(str),
+        "store_id": store + 1,
+        "store_location": LOCATIONS[loc],
+        "payment_method": PAYMENT_METHODS[rng.integers(0, 4, num_rows)],
+        "discount_percent": rng.integers(0, 31, num_rows),
+        "product_cost_usd": cost,
+        "foot_traffic": foot_traffic,
+        "qty": qty,
+        "competitor_price_usd": competitor,
+        "full_name": customers["name"][cust],
+        "gender": customers["gender"][cust],
+        "year_opened": stores["year_opened"][store],
+        "is_favorite": is_favorite,
+        "purchase_id": np.arange(first_row, first_row + num_rows),
+        "product_id": prod + 1,
+        "visit_date": visit_date.astype(str),
+        "purchased_product_price_usd": price,
+        "store_chain_name": stores["chain"][store],
+    }, columns=CSV_COLUMNS)
+
+
+def generate(path, num_rows, num_customers, num_store_ids, num_products,
+             seed=121):
+    """
+    Writes num_rows generated purchases to path in the data.csv layout.
+    """
+    if num_rows > MAX_ROWS:
+        raise ValueError(f"At most {MAX_ROWS} rows fit in purchase_id.")
+    rng = np.random.default_rng(seed)
+    customers, stores, products = entity_attributes(
+        rng, num_customers, num_store_ids, num_products)
+    with open(path, "w", newline="") as out:
+        out.write(",".join(CSV_COLUMNS) + "\n")
+        for first_row in range(0, num_rows, CHUNK_ROWS):
+            chunk_rows = min(CHUNK_ROWS, num_rows - first_row)
+            chunk = generate_chunk(rng, first_row, chunk_rows, customers,
+                                   stores, products)
+            chunk.to_csv(out, header=False, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large retail "
+                                     "dataset in the data.csv layout.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--store-ids", type=int, default=200)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=121)
+    parser.add_argument("-o", "--output", default="generated-data.csv")
+    args = parser.parse_args()
+    generate(args.output, args.rows, args.customers, args.store_ids,
+             args.products, args.seed)
+    print(f"Wrote {args.rows} rows to {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
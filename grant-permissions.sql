@@ -29,8 +29,13 @@ GRANT EXECUTE ON FUNCTION retaildb.authenticate TO 'client'@'localhost';
 GRANT EXECUTE ON FUNCTION retaildb.store_id_to_store_chain TO 'client'@'localhost';
 GRANT EXECUTE ON FUNCTION retaildb.store_count TO 'client'@'localhost';
 GRANT EXECUTE ON FUNCTION retaildb.store_score TO 'client'@'localhost';
+GRANT EXECUTE ON FUNCTION retaildb.hll_estimate TO 'client'@'localhost';
 
 GRANT SELECT (username, first_name, last_name, is_admin) 
 ON retaildb.user_info TO 'client'@'localhost';
 
 GRANT SELECT ON retaildb.* TO 'client'@'localhost';
+
+-- Lets the client app check how far a read replica is behind (SHOW REPLICA
+-- STATUS) before sending reports to it
+GRANT REPLICATION CLIENT ON *.* TO 'client'@'localhost';
@@ -0,0 +1,333 @@
+"""
+Load-tests retaildb with many concurrent simulated users. Every user is a
+separate process with its own connection that replays a scripted session
+(a login followed by the menu reports a client runs, or the purchases and
+reports an admin enters) until the stage ends. Concurrency is ramped over
+stages, and each stage reports the throughput, latency percentiles and
+error rate of every operation along with the InnoDB row lock waits it
+caused, e.g.
+    $ python3 loadtest.py --clients 10,50,200 --admins 2,5,20 --duration 30
+
+Purchases made during the test are deleted afterwards and the stock they
+took is put back, unless --keep is given.
+
+With --http the simulated clients read the reports from server.py instead
+of querying MySQL themselves (admins still insert purchases directly), and
+--p99-target flags operations whose p99 latency is over the target, e.g.
+    $ python3 server.py &
+    $ python3 loadtest.py --http http://127.0.0.1:8121 --p99-target 250
+"""
+
+import argparse
+import collections
+import multiprocessing
+import random
+import statistics
+import time
+import urllib.request
+import mysql.connector
+from tabulate import tabulate
+from abstracted import add_connection_args, connect_from_args
+from benchmark import delete_purchases, next_purchase_id, rebuild_summaries
+from purchases import insert_purchase
+import reports
+
+# Application accounts from load-passwords.sql that sessions log in as
+CLIENT_LOGIN = ("jsmith", "clientpass")
+ADMIN_LOGIN = ("admin_username_engineer_john", "securepass")
+
+# Scripted sessions: the operations a user runs, in order, before starting
+# over. Report operations are keys of reports.REPORTS.
+CLIENT_SESSION = [
+    "login", "payment_methods", "age_group_sales", "gender_totals",
+    "gender_category_pivot", "store_stats", "store_profit",
+    "popular_chain_per_age", "materialized_store_sales",
+]
+# clients of server.py have no login, only reports
+HTTP_CLIENT_SESSION = [name for name in CLIENT_SESSION if name != "login"]
+ADMIN_SESSION = [
+    "login", "purchase", "purchase", "materialized_store_sales", "purchase",
+    "store_stats", "purchase", "purchase",
+]
+
+# seconds a simulated user pauses between operations, drawn uniformly
+THINK_TIME = (0.0, 0.2)
+# each admin process numbers its purchases from its own block of IDs
+# (purchase_id is CHAR(7), so keep stages * admins * block under 10**7)
+PURCHASE_ID_BLOCK = 100000
+# inventory rows purchases are drawn from
+NUM_PURCHASE_TARGETS = 1000
+
+# InnoDB errors that mean a statement waited on, or deadlocked over, a lock
+LOCK_ERRORS = {1205: "lock wait timeout", 1213: "deadlock"}
+# server counters sampled before and after every stage
+LOCK_STATUS_QUERY = """
+    SHOW GLOBAL STATUS WHERE Variable_name IN
+    ('Innodb_row_lock_waits', 'Innodb_row_lock_time');
+"""
+
+
+def login(conn, state):
+    cursor = conn.cursor()
+    cursor.execute("SELECT authenticate(%s, %s);", state["login"])
+    cursor.fetchall()
+    cursor.close()
+
+
+def purchase(conn, state):
+    """
+    Buys one unit of a random inventory row.
+    """
+    product_id, store_id, store_location, price = random.choice(
+        state["targets"])
+    purchase_id = str(next(state["purchase_ids"]))
+    insert_purchase(conn, (
+        purchase_id, product_id, store_id, random.choice(state["customers"]),
+        store_location, "Cash", random.randint(0, 30),
+        time.strftime("%Y-%m-%d"), price))
+    state["sold"].append((product_id, store_id, store_location, purchase_id))
+
+
+def http_report(base_url, name):
+    """
+    Reads a report from server.py, raising OSError on a failed request.
+    """
+    with urllib.request.urlopen(f"{base_url}/reports/{name}") as response:
+        response.read()
+
+
+def run_operation(conn, name, state):
+    if state["http"] and name != "purchase":
+        http_report(state["http"], name)
+    elif name == "login":
+        login(conn, state)
+    elif name == "purchase":
+        purchase(conn, state)
+    else:
+        reports.run_report(conn, name)
+
+
+def run_session(role, worker, args, deadline, first_purchase_id, targets,
+                results):
+    """
+    Replays the role's scripted session until deadline and puts
+    (role, worker, timings, errors, sold) on the results queue, where
+    timings maps an operation to the seconds each successful run took,
+    errors maps (operation, error) to a count and sold lists the purchases
+    made.
+    """
+    random.seed(worker)
+    timings = collections.defaultdict(list)
+    errors = collections.Counter()
+    state = {
+        "login": ADMIN_LOGIN if role == "admin" else CLIENT_LOGIN,
+        "targets": targets["inventory"],
+        "customers": targets["customers"],
+        "purchase_ids": iter(range(first_purchase_id,
+                                   first_purchase_id + PURCHASE_ID_BLOCK)),
+        "sold": [],
+        "http": args.http.rstrip("/") if args.http and role == "client"
+        else None,
+    }
+    if role == "admin":
+        session = ADMIN_SESSION
+        conn = connect_from_args(args, user=args.admin_user,
+                                 password=args.admin_password)
+    elif state["http"]:
+        session = HTTP_CLIENT_SESSION
+        conn = None
+    else:
+        session = CLIENT_SESSION
+        conn = connect_from_args(args)
+    try:
+        while time.time() < deadline:
+            for name in session:
+                if time.time() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    run_operation(conn, name, state)
+                    timings[name].append(time.perf_counter() - start)
+                except mysql.connector.Error as err:
+                    if err.sqlstate == "45000":
+                        kind = "out of stock"
+                    else:
+                        kind = LOCK_ERRORS.get(err.errno, f"error {err.errno}")
+                    errors[(name, kind)] += 1
+                except OSError as err:
+                    errors[(name, f"HTTP {getattr(err, 'code', err)}")] += 1
+                time.sleep(random.uniform(*THINK_TIME))
+    finally:
+        if conn is not None:
+            conn.close()
+        results.put((role, worker, dict(timings), dict(errors),
+                     state["sold"]))
+
+
+def purchase_targets(conn):
+    """
+    Returns the inventory rows (with their prices) and customers that
+    simulated admins make purchases with.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT product_id, store_id, store_location, "
+                   "product_price_usd FROM inventory WHERE qty > 0 "
+                   "ORDER BY RAND() LIMIT %s;", (NUM_PURCHASE_TARGETS,))
+    inventory = cursor.fetchall()
+    cursor.execute("SELECT customer_id FROM customer LIMIT 1000;")
+    customers = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return {"inventory": inventory, "customers": customers}
+
+
+def lock_status(conn):
+    cursor = conn.cursor()
+    cursor.execute(LOCK_STATUS_QUERY)
+    status = {name: int(value) for name, value in cursor.fetchall()}
+    cursor.close()
+    return status
+
+
+def percentile(cuts, pct):
+    return cuts[pct - 1] * 1000 if cuts else float("nan")
+
+
+def print_stage(clients, admins, elapsed, timings, errors, locks_before,
+                locks_after, p99_target=None):
+    """
+    Prints one row per operation for a finished stage. With a p99_target
+    (in ms), operations whose p99 latency is over it are marked.
+    """
+    print(f"\n{clients} clients, {admins} admins, {elapsed:.1f}s")
+    rows = []
+    for name in sorted(set(timings) | {op for op, _ in errors}):
+        latencies = timings.get(name, [])
+        failed = sum(count for (op, _), count in errors.items() if op == name)
+        total = len(latencies) + failed
+        cuts = statistics.quantiles(latencies, n=100) \
+            if len(latencies) > 1 else []
+        if p99_target is not None and cuts \
+                and percentile(cuts, 99) > p99_target:
+            name += " (over p99 target)"
+        rows.append([name, total, f"{len(latencies) / elapsed:.1f}",
+                     f"{percentile(cuts, 50):.1f}",
+                     f"{percentile(cuts, 95):.1f}",
+                     f"{percentile(cuts, 99):.1f}",
+                     failed, f"{100 * failed / total:.1f}" if total else "-"])
+    print(tabulate(rows, headers=["Operation", "Runs", "OK/s", "p50 ms",
+                                  "p95 ms", "p99 ms", "Errors", "Error %"],
+                   tablefmt="pretty"))
+    for (name, kind), count in sorted(errors.items()):
+        print(f"  {name}: {count} x {kind}")
+    waits = (locks_after["Innodb_row_lock_waits"]
+             - locks_before["Innodb_row_lock_waits"])
+    wait_ms = (locks_after["Innodb_row_lock_time"]
+               - locks_before["Innodb_row_lock_time"])
+    print(f"  InnoDB row lock waits: {waits}, total {wait_ms} ms"
+          + (f", avg {wait_ms / waits:.1f} ms" if waits else ""))
+
+
+def run_stage(conn, args, clients, admins, first_purchase_id, targets):
+    """
+    Runs clients + admins simulated users at once for args.duration seconds,
+    prints their results and returns the purchases they made.
+    """
+    results = multiprocessing.Queue()
+    deadline = time.time() + args.duration
+    processes = []
+    for worker in range(clients + admins):
+        # workers 0 .. admins - 1 are the admins, and only they need IDs
+        role = "admin" if worker < admins else "client"
+        processes.append(multiprocessing.Process(
+            target=run_session,
+            args=(role, worker, args, deadline,
+                  first_purchase_id + worker * PURCHASE_ID_BLOCK, targets,
+                  results)))
+    locks_before = lock_status(conn)
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    timings = collections.defaultdict(list)
+    errors = collections.Counter()
+    sold = []
+    # drain the queue before joining so no worker blocks on a full pipe
+    for _ in processes:
+        _, _, worker_timings, worker_errors, worker_sold = results.get()
+        for name, latencies in worker_timings.items():
+            timings[name].extend(latencies)
+        errors.update(worker_errors)
+        sold.extend(worker_sold)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    print_stage(clients, admins, elapsed, timings, errors, locks_before,
+                lock_status(conn), args.p99_target)
+    return sold
+
+
+def undo_purchases(conn, sold):
+    """
+    Deletes the purchases a load test made and puts their stock back.
+    """
+    restock = collections.Counter((product_id, store_id, store_location)
+                                  for product_id, store_id, store_location, _
+                                  in sold)
+    delete_purchases(conn, [purchase_id for *_, purchase_id in sold])
+    cursor = conn.cursor()
+    cursor.executemany("UPDATE inventory SET qty = qty + %s WHERE "
+                       "product_id = %s AND store_id = %s AND "
+                       "store_location = %s;",
+                       [(count,) + key for key, count in restock.items()])
+    conn.commit()
+    cursor.close()
+    rebuild_summaries(conn)
+
+
+def parse_levels(text):
+    return [int(level) for level in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test retaildb with "
+                                     "concurrent simulated clients and "
+                                     "admins.")
+    parser.add_argument("--clients", type=parse_levels, default=[10, 50, 200],
+                        help="comma-separated client counts, one per stage")
+    parser.add_argument("--admins", type=parse_levels, default=[2, 5, 20],
+                        help="comma-separated admin counts, one per stage")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds per stage")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the purchases made during the test")
+    parser.add_argument("--http", metavar="URL",
+                        help="read client reports from server.py at URL")
+    parser.add_argument("--p99-target", type=float, metavar="MS",
+                        help="mark operations with a slower p99 latency")
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin_pw")
+    add_connection_args(parser)
+    args = parser.parse_args()
+    if len(args.clients) != len(args.admins):
+        parser.error("--clients and --admins need the same number of stages")
+
+    conn = connect_from_args(args, user=args.admin_user,
+                             password=args.admin_password)
+    sold = []
+    try:
+        targets = purchase_targets(conn)
+        first_purchase_id = next_purchase_id(conn)
+        for clients, admins in zip(args.clients, args.admins):
+            sold.extend(run_stage(conn, args, clients, admins,
+                                  first_purchase_id, targets))
+            first_purchase_id += admins * PURCHASE_ID_BLOCK
+    finally:
+        if sold and not args.keep:
+            undo_purchases(conn, sold)
+            print(f"\nRemoved the {len(sold)} purchases made by the test.")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Keeps the summary tables up to date by draining purchase_outbox (see
+sp_drain_outbox in setup-routines.sql) continuously, and prints how far
+behind the summaries are, e.g.
+    $ python3 outbox_worker.py
+    $ python3 outbox_worker.py --once
+
+Inserting a purchase only writes its outbox row (and takes the product out
+of stock); the worker applies up to --batch-size outbox rows at a time to
+every summary in one transaction. Without the worker, the event
+ev_drain_purchase_outbox drains the outbox every 5 seconds.
+
+Every outbox row has a change version (its change_id), and the trigger
+leaves the version of the last purchase a session inserted in
+@retaildb_outbox_version. A report that must include a purchase waits for
+its version with wait_for_version, or passes it to reports.run_report as
+min_version. Change versions are not committed in order, so a change is
+applied once it has left the outbox, not once applied_version (the newest
+change drained) has passed it.
+"""
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+
+# outbox rows applied per transaction
+DRAIN_BATCH_SIZE = 5000
+# seconds the worker sleeps when the outbox is empty
+POLL_INTERVAL = 0.1
+# seconds between printed lag metrics
+STATS_INTERVAL = 10
+# seconds wait_for_version waits before giving up, and between checks
+WAIT_TIMEOUT = 10
+WAIT_POLL_INTERVAL = 0.05
+
+# How far the summaries are behind: outbox rows waiting, the newest change
+# version written and the newest applied, how long the oldest waiting row
+# has waited (None if none are waiting) and when the last drain finished.
+OutboxLag = namedtuple("OutboxLag", ["pending", "newest_version",
+                                     "applied_version", "oldest_seconds",
+                                     "drained_at"])
+
+OUTBOX_LAG_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM purchase_outbox),
+        COALESCE((SELECT MAX(change_id) FROM purchase_outbox),
+                 applied_version),
+        applied_version,
+        TIMESTAMPDIFF(MICROSECOND,
+            (SELECT created_at FROM purchase_outbox
+             ORDER BY change_id LIMIT 1),
+            NOW(3)) / 1000000,
+        drained_at
+    FROM purchase_outbox_state;
+"""
+# whether a change at or below a version is still waiting
+PENDING_VERSION_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM purchase_outbox WHERE change_id <= %s);
+"""
+# version of the last purchase this session inserted (NULL if none)
+SESSION_VERSION_QUERY = """
+    SELECT @retaildb_outbox_version;
+"""
+
+
+def drain_batch(conn, batch_size=DRAIN_BATCH_SIZE):
+    """
+    Applies up to batch_size outbox rows to the summaries. Returns how many
+    were applied (0 if the outbox is empty or another drain is running).
+    """
+    cursor = conn.cursor()
+    try:
+        result = cursor.callproc("sp_drain_outbox", (batch_size, 0))
+        conn.commit()
+        return result[1]
+    finally:
+        cursor.close()
+
+
+def drain_outbox(conn, batch_size=DRAIN_BATCH_SIZE):
+    """
+    Drains the outbox batch by batch until it is empty (or another drain
+    takes over). Returns the number of rows applied.
+    """
+    total = 0
+    while True:
+        applied = drain_batch(conn, batch_size)
+        if not applied:
+            return total
+        total += applied
+
+
+def outbox_lag(conn):
+    """
+    Returns the current OutboxLag.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(OUTBOX_LAG_QUERY)
+        return OutboxLag(*cursor.fetchone())
+    finally:
+        cursor.close()
+
+
+def session_version(conn):
+    """
+    Returns the change version of the last purchase inserted on conn, or
+    None if it has inserted none.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SESSION_VERSION_QUERY)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def wait_for_version(conn, version, timeout=WAIT_TIMEOUT):
+    """
+    Waits until every committed change up to version is in the
+    summaries. Returns True once it is, or False after timeout seconds.
+    Ends conn's open transaction, if any, since its snapshot would never
+    see the change.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if conn.in_transaction:
+            conn.commit()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(PENDING_VERSION_QUERY, (version,))
+            pending = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if not pending:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(WAIT_POLL_INTERVAL)
+
+
+def print_lag(lag, applied, elapsed):
+    oldest = (f"{lag.oldest_seconds:.2f}s" if lag.oldest_seconds is not None
+              else "-")
+    print(f"{time.strftime('%H:%M:%S')}  pending {lag.pending:>8}  "
+          f"oldest {oldest:>8}  version {lag.applied_version} "
+          f"(lag {lag.newest_version - lag.applied_version})  "
+          f"{applied / elapsed:10.1f} rows/s", flush=True)
+
+
+def run_worker(conn, batch_size=DRAIN_BATCH_SIZE, interval=POLL_INTERVAL,
+               stats_interval=STATS_INTERVAL):
+    """
+    Drains the outbox until interrupted, printing lag metrics every
+    stats_interval seconds. Errors (e.g. a deadlock with a purchase) are
+    printed and the batch is tried again.
+    """
+    applied_since = 0
+    stats_at = time.monotonic()
+    while True:
+        try:
+            applied = drain_batch(conn, batch_size)
+        except mysql.connector.Error as err:
+            sys.stderr.write(f"Error: {err}\n")
+            applied = 0
+        applied_since += applied
+        now = time.monotonic()
+        if now - stats_at >= stats_interval:
+            print_lag(outbox_lag(conn), applied_since, now - stats_at)
+            applied_since = 0
+            stats_at = now
+        # a full batch means more are probably waiting
+        if applied < batch_size:
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply new purchases to "
+                                     "the summary tables from the outbox.")
+    parser.add_argument("--batch-size", type=int, default=DRAIN_BATCH_SIZE)
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="seconds to sleep when the outbox is empty")
+    parser.add_argument("--stats-interval", type=float,
+                        default=STATS_INTERVAL,
+                        help="seconds between lag metrics")
+    parser.add_argument("--once", action="store_true",
+                        help="drain the outbox, print the lag and exit")
+    add_connection_args(parser, user="admin", password="admin_pw")
+    args = parser.parse_args()
+
+    conn = connect_from_args(args)
+    try:
+        if args.once:
+            start = time.perf_counter()
+            applied = drain_outbox(conn, args.batch_size)
+            print_lag(outbox_lag(conn), applied,
+                      time.perf_counter() - start)
+        else:
+            run_worker(conn, args.batch_size, args.interval,
+                       args.stats_interval)
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
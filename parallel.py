@@ -0,0 +1,244 @@
+"""
+Runs the per-store reports split into store_id ranges, one query per range
+in parallel on pooled connections, and merges the partial results, e.g.
+    $ python3 parallel.py store_stats --shards 8
+
+A single query runs on one server thread however many cores MySQL has.
+Each shard here reads only its stores' rows (purchase, popularity, store
+and store_profit_summary are all indexed by store_id first), so the server
+works on all shards at once. Shards are weighted by the stores' purchase
+counts in mv_store_sales_stats, so one large chain does not leave the other
+shards waiting on it.
+
+The shards run on threads: the work is in MySQL, and each shard sends back
+only one row per store, so the client does little but wait.
+"""
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import mysql.connector
+from mysql.connector import FieldType, pooling
+from abstracted import add_connection_args, print_pages
+import reports
+from reports import ReportResult
+
+# shards (and pooled connections) used when not given; MySQL connector
+# pools hold at most 32
+DEFAULT_SHARDS = 8
+
+# A report split by store_id. query takes the parameters lo and hi, the
+# first and last store_id of a shard. The first key_width columns identify
+# a row; rows from different shards with the same key (a chain name shared
+# by several store IDs, say) are merged by adding up the other columns, so
+# those must be counts or sums. Rows are sorted by key after merging.
+ShardedReport = namedtuple("ShardedReport", ["query", "key_width"])
+
+SHARDED_STORE_STATS_QUERY = """
+    WITH purchase_summary AS (
+        SELECT store_id,
+            store_location,
+            COUNT(*) AS total_transactions,
+            SUM(purchased_product_price_usd) AS total_revenue
+        FROM purchase
+        WHERE store_id BETWEEN %(lo)s AND %(hi)s
+        GROUP BY store_id, store_location
+    ),
+    popularity_summary AS (
+        SELECT store_id,
+            store_location,
+            AVG(foot_traffic) AS avg_foot_traffic
+        FROM popularity
+        WHERE store_id BETWEEN %(lo)s AND %(hi)s
+        GROUP BY store_id, store_location
+    )
+    SELECT s.store_id,
+        s.store_location,
+        COALESCE(p.total_transactions, 0) AS total_transactions,
+        COALESCE(p.total_revenue, 0)      AS total_revenue,
+        COALESCE(pop.avg_foot_traffic, 0) AS avg_foot_traffic
+    FROM store s
+    LEFT JOIN purchase_summary p
+        ON s.store_id = p.store_id
+        AND s.store_location = p.store_location
+    LEFT JOIN popularity_summary pop
+        ON s.store_id = pop.store_id
+        AND s.store_location = pop.store_location
+    WHERE s.store_id BETWEEN %(lo)s AND %(hi)s;
+"""
+
+SHARDED_STORE_PROFIT_QUERY = """
+    SELECT
+        store_chain_name,
+        store_location,
+        SUM(total_profit) AS total_profit
+    FROM store_profit_summary
+    WHERE store_id BETWEEN %(lo)s AND %(hi)s
+    GROUP BY
+        store_chain_name,
+        store_location;
+"""
+
+SHARDED_STORE_SCORES_QUERY = """
+    SELECT
+        store_id,
+        MIN(store_chain_name) AS store_chain,
+        store_count(store_id) AS num_locations,
+        store_score(store_id) AS store_score
+    FROM store
+    WHERE store_id BETWEEN %(lo)s AND %(hi)s
+    GROUP BY store_id;
+"""
+
+# keyed by the name of the report in reports.REPORTS they compute
+SHARDED_REPORTS = {
+    "store_stats": ShardedReport(SHARDED_STORE_STATS_QUERY, 2),
+    "store_profit": ShardedReport(SHARDED_STORE_PROFIT_QUERY, 2),
+    "store_scores": ShardedReport(SHARDED_STORE_SCORES_QUERY, 1),
+}
+
+# every store ID with its number of purchases, to weight the shards by
+STORE_WEIGHTS_QUERY = """
+    SELECT s.store_id, COALESCE(mv.num_purchases, 0)
+    FROM (SELECT DISTINCT store_id FROM store) s
+    LEFT JOIN mv_store_sales_stats mv ON s.store_id = mv.store_id
+    ORDER BY s.store_id;
+"""
+
+
+def make_pool(args, size=DEFAULT_SHARDS):
+    """
+    Returns a connection pool of size connections for the connection
+    arguments added by abstracted.add_connection_args.
+    """
+    return pooling.MySQLConnectionPool(
+        pool_name="retaildb_parallel", pool_size=size,
+        host=args.host, port=args.port, user=args.user,
+        password=args.password, database=args.database, autocommit=True)
+
+
+def shard_ranges(conn, shards):
+    """
+    Splits the store IDs into at most shards contiguous (lo, hi) ranges
+    with about the same number of purchases each.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STORE_WEIGHTS_QUERY)
+        weights = cursor.fetchall()
+    finally:
+        cursor.close()
+    if not weights:
+        return []
+    # every store counts for at least one purchase, so stores without
+    # sales are still spread out
+    remaining = sum(weight + 1 for _, weight in weights)
+    ranges = []
+    lo = weights[0][0]
+    filled = 0
+    for index, (store_id, weight) in enumerate(weights):
+        filled += weight + 1
+        # the share of what is left, so a shard taken up by one large
+        # store does not leave the other shards short
+        target = remaining / (shards - len(ranges))
+        if (filled >= target and index + 1 < len(weights)
+                and len(ranges) < shards - 1):
+            ranges.append((lo, store_id))
+            lo = weights[index + 1][0]
+            remaining -= filled
+            filled = 0
+    ranges.append((lo, weights[-1][0]))
+    return ranges
+
+
+def run_shard(pool, query, lo, hi):
+    """
+    Runs one shard of a query on a pooled connection and returns (rows,
+    column types).
+    """
+    conn = pool.get_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, {"lo": lo, "hi": hi})
+            rows = cursor.fetchall()
+            column_types = [FieldType.get_info(column[1])
+                            for column in cursor.description]
+        finally:
+            cursor.close()
+    finally:
+        # returns the connection to the pool
+        conn.close()
+    return rows, column_types
+
+
+def merge_rows(shard_rows, key_width):
+    """
+    Merges the rows of every shard, adding up the non-key columns of rows
+    with the same key, sorted by key.
+    """
+    merged = {}
+    for rows in shard_rows:
+        for row in rows:
+            key = row[:key_width]
+            if key in merged:
+                merged[key] = key + tuple(
+                    a + b for a, b in zip(merged[key][key_width:],
+                                          row[key_width:]))
+            else:
+                merged[key] = tuple(row)
+    # NULLs (a store without a chain name) sort last
+    return [merged[key] for key in sorted(
+        merged, key=lambda key: [(value is None, value) for value in key])]
+
+
+def run_sharded_report(pool, name, shards=None):
+    """
+    Runs the report name from SHARDED_REPORTS in up to shards store_id
+    ranges at once (the pool's size by default) and returns the merged
+    result as a ReportResult like reports.run_report.
+    """
+    sharded = SHARDED_REPORTS[name]
+    report = reports.REPORTS[name]
+    shards = min(shards or pool.pool_size, pool.pool_size)
+    start = time.perf_counter()
+    conn = pool.get_connection()
+    try:
+        ranges = shard_ranges(conn, shards)
+    finally:
+        conn.close()
+    if not ranges:
+        return ReportResult(name, report.title, report.headers, [], [],
+                            time.perf_counter() - start)
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        results = list(executor.map(
+            lambda shard: run_shard(pool, sharded.query, *shard), ranges))
+    rows = merge_rows([rows for rows, _ in results], sharded.key_width)
+    return ReportResult(name, report.title, report.headers, rows,
+                        results[0][1], time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a per-store report "
+                                     "in parallel store_id shards.")
+    parser.add_argument("report", choices=sorted(SHARDED_REPORTS))
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS,
+                        help="store_id ranges run at once (at most 32)")
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    try:
+        pool = make_pool(args, args.shards)
+        result = run_sharded_report(pool, args.report)
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+        sys.exit(1)
+    print_pages(result.rows, result.headers, title=result.title + ":")
+    print(f"{len(result.rows)} rows in {result.elapsed:.3f}s "
+          f"({args.shards} shards).")
+
+
+if __name__ == '__main__':
+    main()
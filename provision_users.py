@@ -0,0 +1,218 @@
+"""
+Creates client and admin accounts in bulk from a CSV file with the columns
+    username, password, first_name, last_name, is_admin,
+    is_store_manager, phone_number, employee_type
+(is_store_manager and phone_number are for clients, employee_type is for
+admins). Salts and password hashes are made here, in the same format as
+sp_add_user, and the accounts are inserted with multi-row INSERTs, one
+transaction per batch, instead of one CALL per account. Usernames that
+already exist are skipped like sp_add_user skips them.
+
+Command-line usage (as the admin database user):
+    $ python3 provision_users.py new_managers.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import re
+import secrets
+import sys
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+from abstracted import print_section_header
+
+# accounts inserted per transaction
+PROVISION_BATCH_SIZE = 1000
+
+# Salt characters: printable ASCII without the space (32), since salt is
+# stored in a CHAR column, which drops trailing spaces
+SALT_CHARS = "".join(chr(code) for code in range(33, 127))
+SALT_LENGTH = 8
+
+EMPLOYEE_TYPES = {"researcher", "engineer", "maintenance"}
+CSV_COLUMNS = ["username", "password", "first_name", "last_name", "is_admin",
+               "is_store_manager", "phone_number", "employee_type"]
+
+
+def make_salt(num_chars=SALT_LENGTH):
+    return "".join(secrets.choice(SALT_CHARS) for _ in range(num_chars))
+
+
+def hash_password(salt, password):
+    """
+    Returns the same bytes as UNHEX(SHA2(CONCAT(salt, password), 256)).
+    """
+    return hashlib.sha256((salt + password).encode("utf-8")).digest()
+
+
+def check_account(account):
+    """
+    Returns why an account (a dict with the CSV_COLUMNS keys) cannot be
+    created, or None if it is valid. Uses the same rules as the create
+    account pages.
+    """
+    for key in ("username", "password"):
+        if not re.match(r"^[a-zA-Z0-9_]{1,20}$", account[key]):
+            return (f"The {key} must be 1 to 20 letters, numbers or "
+                    "underscores")
+    if not account["first_name"] or not account["last_name"]:
+        return "First and last name are required"
+    if account["is_admin"] not in ("0", "1"):
+        return "is_admin must be 0 or 1"
+    if account["is_admin"] == "1":
+        if account["employee_type"] not in EMPLOYEE_TYPES:
+            return "employee_type must be researcher, engineer or maintenance"
+    else:
+        if account["is_store_manager"] not in ("0", "1"):
+            return "is_store_manager must be 0 or 1"
+        phone_number = account["phone_number"]
+        if phone_number and (len(phone_number) > 20 or not re.match(
+                r'^[\d\s\-\(\)\+]+$', phone_number)):
+            return "Invalid phone number"
+    return None
+
+
+def read_accounts(path):
+    """
+    Reads accounts from a CSV file. Returns (accounts, rejected) where
+    rejected lists (CSV line, username, reason) for invalid rows.
+    """
+    with open(path, newline="") as accounts_file:
+        rows = list(csv.DictReader(accounts_file))
+    accounts = []
+    rejected = []
+    seen = set()
+    # + 2 for the header row and 1-based line numbers
+    for line, row in enumerate(rows, 2):
+        account = {key: (row.get(key) or "").strip() for key in CSV_COLUMNS}
+        reason = check_account(account)
+        # usernames are compared without case, like user_info's collation
+        if reason is None and account["username"].casefold() in seen:
+            reason = "Username appears earlier in the file"
+        if reason:
+            rejected.append((line, account["username"], reason))
+        else:
+            seen.add(account["username"].casefold())
+            accounts.append(account)
+    return accounts, rejected
+
+
+def insert_batch(cursor, accounts):
+    """
+    Inserts a batch of new accounts (with distinct usernames that are not
+    taken) into user_info and the client or admin table.
+    """
+    user_rows = []
+    for account in accounts:
+        salt = make_salt()
+        user_rows.append((account["username"], account["first_name"],
+                          account["last_name"], salt,
+                          hash_password(salt, account["password"]),
+                          int(account["is_admin"])))
+    # executemany sends each of these as one multi-row INSERT
+    cursor.executemany("INSERT INTO user_info (username, first_name, "
+                       "last_name, salt, password_hash, is_admin) "
+                       "VALUES (%s, %s, %s, %s, %s, %s)", user_rows)
+    client_rows = [(account["username"], int(account["is_store_manager"]),
+                    account["phone_number"] or None)
+                   for account in accounts if account["is_admin"] == "0"]
+    admin_rows = [(account["username"], account["employee_type"])
+                  for account in accounts if account["is_admin"] == "1"]
+    if client_rows:
+        cursor.executemany("INSERT INTO client (username, is_store_manager, "
+                           "phone_number) VALUES (%s, %s, %s)", client_rows)
+    if admin_rows:
+        cursor.executemany("INSERT INTO admin (username, employee_type) "
+                           "VALUES (%s, %s)", admin_rows)
+
+
+def provision_accounts(conn, accounts, batch_size=PROVISION_BATCH_SIZE):
+    """
+    Creates the given (valid) accounts, batch_size per transaction.
+    Returns (created, existing) where existing lists the usernames that
+    were skipped because they are already taken.
+    """
+    created = 0
+    existing = []
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(accounts), batch_size):
+            batch = accounts[start:start + batch_size]
+            # locks the usernames so another session cannot take one
+            # between this check and the insert
+            cursor.execute("SELECT username FROM user_info WHERE username "
+                           "IN (" + ", ".join(["%s"] * len(batch))
+                           + ") FOR UPDATE",
+                           [account["username"] for account in batch])
+            # the IN list matches without case, so "Bob" finds "bob"
+            taken = {username.casefold()
+                     for (username,) in cursor.fetchall()}
+            new_accounts = [account for account in batch
+                            if account["username"].casefold() not in taken]
+            if new_accounts:
+                insert_batch(cursor, new_accounts)
+            conn.commit()
+            created += len(new_accounts)
+            existing.extend(sorted(
+                account["username"] for account in batch
+                if account["username"].casefold() in taken))
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return created, existing
+
+
+def provision_interface(conn):
+    """
+    Admin menu page that creates the accounts listed in a CSV file.
+    """
+    print_section_header("Bulk Account Page")
+    path = input("Enter the accounts file (CSV with columns "
+                 + ", ".join(CSV_COLUMNS) + "): ").strip()
+    try:
+        accounts, rejected = read_accounts(path)
+    except OSError as err:
+        print(f"Could not read {path}: {err}")
+        return
+    try:
+        created, existing = provision_accounts(conn, accounts)
+    except mysql.connector.Error as err:
+        sys.stderr.write(f"Error: {err}\n")
+        return
+    print(f"\nCreated {created} accounts.")
+    if existing:
+        print(f"{len(existing)} usernames were already taken: "
+              + ", ".join(existing[:20])
+              + (" ..." if len(existing) > 20 else ""))
+    for line, username, reason in rejected:
+        print(f"  Line {line} ({username or 'no username'}): {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create retaildb accounts "
+                                     "in bulk from a CSV file.")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int,
+                        default=PROVISION_BATCH_SIZE)
+    add_connection_args(parser, user="admin", password="admin_pw")
+    args = parser.parse_args()
+
+    accounts, rejected = read_accounts(args.path)
+    for line, username, reason in rejected:
+        print(f"Line {line} ({username or 'no username'}): {reason}",
+              file=sys.stderr)
+    conn = connect_from_args(args)
+    try:
+        created, existing = provision_accounts(conn, accounts,
+                                               args.batch_size)
+    finally:
+        conn.close()
+    print(f"Created {created} accounts, skipped {len(existing)} taken "
+          f"usernames and {len(rejected)} invalid rows.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Adding purchases, shared by the admin menu, write_buffer.py, benchmark.py
+and loadtest.py. Nothing here prints or asks for input.
+"""
+
+from abstracted import run_with_retry
+from outbox_worker import SESSION_VERSION_QUERY
+
+INSERT_PURCHASE_QUERY = """
+    INSERT INTO purchase 
+        (purchase_id, product_id, store_id, customer_id, 
+         store_location, payment_method, discount_percent, 
+        txn_date, purchased_product_price_usd)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+"""
+
+
+def insert_purchase(conn, purchase):
+    """
+    Inserts one purchase, given as a tuple in the order of 
+    INSERT_PURCHASE_QUERY, and commits it. The purchase trigger takes the
+    product out of stock with one conditional update, so concurrent 
+    purchases cannot oversell; deadlocks and lock wait timeouts are 
+    retried. Raises mysql.connector.Error with SQLSTATE 45000 if the 
+    product is out of stock. Returns the purchase's change version.
+    """
+    def insert(cursor):
+        cursor.execute(INSERT_PURCHASE_QUERY, tuple(purchase))
+        cursor.execute(SESSION_VERSION_QUERY)
+        return cursor.fetchone()[0]
+
+    return run_with_retry(conn, insert)
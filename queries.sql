@@ -75,16 +75,50 @@ SELECT store_id, total_sales,
         min_price, max_price
 FROM mv_store_sales_stats;
 
+-- Refreshes the materialized view, either by applying the sales waiting 
+-- in the purchase outbox (to every summary) or by rebuilding it, and shows 
+-- the last refresh
+CALL sp_drain_outbox(5000, @applied_rows);
+CALL sp_refresh_mv_store_sales_full();
+SELECT refresh_type, 
+    finished_at, 
+    TIMESTAMPDIFF(MICROSECOND, started_at, finished_at) / 1000000 AS seconds,
+    rows_applied
+FROM mv_refresh_log
+WHERE view_name = 'mv_store_sales_stats'
+ORDER BY refresh_id DESC
+LIMIT 1;
+
+-- How far the summaries are behind the purchases: sales waiting in the 
+-- outbox, how long the oldest has waited and the last change applied
+SELECT COUNT(o.change_id) AS pending,
+    TIMESTAMPDIFF(MICROSECOND, MIN(o.created_at), NOW(3)) / 1000000 
+        AS oldest_seconds,
+    s.applied_version,
+    s.drained_at
+FROM purchase_outbox_state s
+LEFT JOIN purchase_outbox o ON TRUE
+GROUP BY s.applied_version, s.drained_at;
+
 -- Client queries: 
 
--- Gets usage counts of each payment method at each store
-SELECT p.store_id, 
-    p.store_location, 
-    p.payment_method, 
-    COUNT(*) AS usage_count
-FROM purchase p
-GROUP BY p.store_id, p.store_location, p.payment_method
-ORDER BY p.store_id, p.store_location, usage_count DESC;
+-- Gets the most used payment method at each store, from the 
+-- counters kept by the purchase outbox drain
+SELECT store_id, 
+    store_location, 
+    payment_method, 
+    usage_count
+FROM (
+    SELECT store_id, 
+        store_location, 
+        payment_method, 
+        usage_count,
+        RANK() OVER (PARTITION BY store_id, store_location 
+                     ORDER BY usage_count DESC) AS method_rank
+    FROM payment_method_usage
+) ranked_methods
+WHERE method_rank = 1
+ORDER BY store_id, store_location;
 
 -- Retrieves total number of purchases made by age group 
 SELECT
@@ -140,15 +174,30 @@ LEFT JOIN popularity_summary pop
 -- product category. In the application, the client would specify the 
 -- product category through input, but for running purposes here we set 
 -- an arbitrary product category to be Health & Beauty. 
-SELECT c.gender, 
-            COUNT(*) AS purchase_count
-        FROM customer c
-        JOIN purchase p 
-            ON c.customer_id = p.customer_id
-        JOIN product pr 
-            ON p.product_id = pr.product_id
-        WHERE pr.product_category = 'Health & Beauty'
-        GROUP BY c.gender;
+SELECT gender, 
+    purchase_count
+FROM gender_category_sales
+WHERE product_category = 'Health & Beauty'
+ORDER BY gender;
+
+-- Retrieves the purchase count and amount spent by each gender for every 
+-- product category at once
+SELECT product_category,
+    SUM(CASE WHEN gender = 'F' THEN purchase_count ELSE 0 END) 
+        AS female_purchases,
+    SUM(CASE WHEN gender = 'M' THEN purchase_count ELSE 0 END) 
+        AS male_purchases,
+    SUM(CASE WHEN gender = 'X' THEN purchase_count ELSE 0 END) 
+        AS nonbinary_purchases,
+    SUM(CASE WHEN gender = 'F' THEN total_spent ELSE 0 END) 
+        AS female_spent,
+    SUM(CASE WHEN gender = 'M' THEN total_spent ELSE 0 END) 
+        AS male_spent,
+    SUM(CASE WHEN gender = 'X' THEN total_spent ELSE 0 END) 
+        AS nonbinary_spent
+FROM gender_category_sales
+GROUP BY product_category
+ORDER BY product_category;
 
 -- Retrieves the youngest and oldest buyer age group for each product category
 SELECT product_category, 
@@ -174,55 +223,37 @@ ORDER BY age_range;
 
 -- For each age group, this query retrieves the most popular store chain and 
 -- number of customer visits 
-SELECT 
-    age_group, 
-    store_chain, 
-    total_purchases
-FROM (
+WITH visit_counts AS (
+    -- one pass over the visits, counted per age group and store
     SELECT 
-        CASE 
-            WHEN c.age BETWEEN 18 AND 25 THEN '18-25'
-            WHEN c.age BETWEEN 26 AND 35 THEN '26-35'
-            WHEN c.age BETWEEN 36 AND 50 THEN '36-50'
-            WHEN c.age BETWEEN 40 AND 49 THEN '40-49'
-            WHEN c.age BETWEEN 50 AND 59 THEN '50-59'
-            WHEN c.age BETWEEN 60 AND 69 THEN '60-69'
-            WHEN c.age BETWEEN 70 AND 79 THEN '70-79'
-            WHEN c.age BETWEEN 80 AND 89 THEN '80-89'
-            ELSE '90+'
-        END AS age_group,
-        s.store_chain_name AS store_chain,
+        c.age_bucket AS age_group,
+        cv.store_id,
         COUNT(*) AS total_purchases
     FROM customer_visits cv
     JOIN customer c ON cv.customer_id = c.customer_id
-    JOIN store s ON cv.store_id = s.store_id
-    GROUP BY age_group, s.store_chain_name, s.store_id
-) ranked_stores
-WHERE total_purchases = (
-    SELECT MAX(total_purchases)
-    FROM (
-        SELECT 
-            CASE 
-                WHEN c.age BETWEEN 18 AND 25 THEN '18-25'
-                WHEN c.age BETWEEN 26 AND 35 THEN '26-35'
-                WHEN c.age BETWEEN 36 AND 50 THEN '36-50'
-                WHEN c.age BETWEEN 40 AND 49 THEN '40-49'
-                WHEN c.age BETWEEN 50 AND 59 THEN '50-59'
-                WHEN c.age BETWEEN 60 AND 69 THEN '60-69'
-                WHEN c.age BETWEEN 70 AND 79 THEN '70-79'
-                WHEN c.age BETWEEN 80 AND 89 THEN '80-89'
-                ELSE '90+'
-            END AS age_group,
-            s.store_chain_name,
-            COUNT(*) AS total_purchases
-        FROM customer_visits cv
-        JOIN customer c ON cv.customer_id = c.customer_id
-        JOIN store s ON cv.store_id = s.store_id
-        GROUP BY age_group, s.store_chain_name, s.store_id
-    ) max_counts
-    WHERE max_counts.age_group = ranked_stores.age_group
+    GROUP BY c.age_bucket, cv.store_id
+),
+ranked_stores AS (
+    -- rank stores within each age group, ties share a rank
+    SELECT 
+        age_group,
+        store_id,
+        total_purchases,
+        RANK() OVER (PARTITION BY age_group 
+                     ORDER BY total_purchases DESC) AS visit_rank
+    FROM visit_counts
+),
+store_chains AS (
+    SELECT DISTINCT store_id, store_chain_name FROM store
 )
-ORDER BY age_group;
+SELECT 
+    r.age_group, 
+    sc.store_chain_name AS store_chain, 
+    r.total_purchases
+FROM ranked_stores r
+JOIN store_chains sc ON r.store_id = sc.store_id
+WHERE r.visit_rank = 1
+ORDER BY r.age_group, store_chain;
 
 
 -- Retrieves the 10 most expensive items stored in inventory at each 
@@ -251,6 +282,9 @@ FROM mv_store_sales_stats;
 -- for each purchased product at that store chain and location for each store, subtracted from the cost
 -- it took to make the product. In short, we get the store locations and total profit for each store based on
 -- all the products sold at the store. This query is equivalent to RA expression 4) in part G.
+-- The application reads the same totals from store_profit_summary, which 
+-- the purchase outbox drain and inventory trigger keep up to date and 
+-- sp_reconcile_store_profit recomputes with this query.
 SELECT
     s.store_chain_name,
     i.store_location,
@@ -267,6 +301,55 @@ GROUP BY
     s.store_chain_name,
     i.store_location;
 
+-- Total profit for each store chain location, from the maintained summary
+SELECT
+    store_chain_name,
+    store_location,
+    SUM(total_profit) AS total_profit
+FROM store_profit_summary
+GROUP BY
+    store_chain_name,
+    store_location;
+
+-- Recomputes the store profit summary and reports how many store 
+-- locations had drifted
+CALL sp_reconcile_store_profit();
+
+
+-- Approximate total sales per age group from the purchase sample, with
+-- the estimated variance of each total (see sampling.py)
+SELECT age_bucket,
+    SUM(weight * sale_price) AS total_sales,
+    SUM((weight * weight - weight) * sale_price * sale_price) 
+        AS total_sales_variance
+FROM purchase_sample
+GROUP BY age_bucket
+ORDER BY total_sales DESC;
+
+-- Estimated distinct customers per store chain, merging the HyperLogLog 
+-- sketches of its stores register by register
+SELECT store_chain_name,
+    hll_estimate(COUNT(*), SUM(POW(2, -rho))) AS distinct_customers
+FROM (
+    SELECT s.store_chain_name, h.reg_idx, MAX(h.rho) AS rho
+    FROM store_customer_hll h
+    JOIN store s 
+        ON h.store_id = s.store_id 
+        AND h.store_location = s.store_location
+    GROUP BY s.store_chain_name, h.reg_idx
+) merged
+GROUP BY store_chain_name;
+
+-- First page of the in-stock products at one store location, in the 
+-- order of idx_inventory_store_product; the next page adds 
+-- AND (i.store_id, i.store_location, i.product_id) > (<last row's values>)
+SELECT i.product_id, p.product_category, i.store_id, i.store_location, 
+    i.qty, i.product_price_usd
+FROM inventory i
+JOIN product p ON i.product_id = p.product_id
+WHERE i.store_id = 15 AND i.store_location = 'Philadelphia' AND i.qty > 0
+ORDER BY i.store_id, i.store_location, i.product_id
+LIMIT 20;
 
 -- The following queries require user input. We could theoretically input 
 -- arbitrary values, but this will result in users being created before 
@@ -0,0 +1,697 @@
+"""
+The retail reports as a library, shared by the client and admin menus,
+export.py, benchmark.py and loadtest.py. Nothing here prints or asks for
+input, so reports can be run from any program with a connection.
+
+Each entry of REPORTS describes one report: a title, the column headers
+shown in the terminal, the query itself, and the names of the parameters
+the query takes (in order). run_report runs one and returns its rows with
+this metadata as a ReportResult; open_report hands back the executed cursor
+instead, for results too large to hold in memory. Reports read from the
+summary tables can first wait for a change version (min_version) to be
+applied, see outbox_worker.py. Every report also has a
+function of its own below (payment_methods(conn), gender_by_category(conn,
+product_category), ...) that checks its parameters.
+"""
+
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from mysql.connector import FieldType
+import outbox_worker
+
+Report = namedtuple("Report", ["title", "headers", "query", "params"])
+
+# The result of running a report. rows is a list of tuples in the order of
+# headers, column_types holds the MySQL type name of each column (e.g.
+# "NEWDECIMAL") and elapsed is how many seconds the query took.
+ReportResult = namedtuple("ReportResult", ["name", "title", "headers", "rows",
+                                           "column_types", "elapsed"])
+
+PRODUCT_CATEGORIES = ("Clothing", "Groceries", "Health & Beauty",
+                      "Home & Kitchen", "Books", "Electronics")
+
+# most used payment method (or methods, if tied) at each store location,
+# read from the payment_method_usage counters
+PAYMENT_METHOD_QUERY = """
+    SELECT store_id, 
+        store_location, 
+        payment_method, 
+        usage_count
+    FROM (
+        SELECT store_id, 
+            store_location, 
+            payment_method, 
+            usage_count,
+            RANK() OVER (PARTITION BY store_id, store_location 
+                         ORDER BY usage_count DESC) AS method_rank
+        FROM payment_method_usage
+    ) ranked_methods
+    WHERE method_rank = 1
+    ORDER BY store_id, store_location;
+"""
+
+# total sales per age group
+AGE_GROUP_SALES_QUERY = """
+    SELECT
+        age_range,
+        SUM(total_sales) AS total_sales
+    FROM sales_summary_by_age_group
+    GROUP BY age_range
+    ORDER BY total_sales DESC;
+"""
+
+# youngest and oldest buyer age group per product category
+MIN_MAX_AGE_QUERY = """
+    SELECT product_category, 
+           MIN(age_range) AS youngest_buyers,
+           MAX(age_range) AS oldest_buyers
+    FROM sales_summary_by_age_group
+    GROUP BY product_category;
+"""
+
+# spending on necessities vs. non-necessities per age group
+WANTS_VERSUS_NEEDS_QUERY = """
+    SELECT age_range, 
+         ROUND(CAST(SUM(CASE WHEN 
+                product_category IN ('Groceries', 'Health & Beauty') 
+                THEN total_sales ELSE 0 END) AS DECIMAL(10,2)), 2)
+            AS necessities,
+         ROUND(CAST(SUM(CASE WHEN 
+                product_category NOT IN ('Groceries', 'Health & Beauty') 
+                THEN total_sales ELSE 0 END) AS DECIMAL(10,2)), 2)
+            AS non_necessities
+    FROM sales_summary_by_age_group
+    GROUP BY age_range
+    ORDER BY age_range;
+"""
+
+# most visited store chain per age group
+# Age groups come from customer.age_bucket, shared by every age report.
+# Visits are counted once per (age group, store) and the top stores picked 
+# with RANK(), instead of grouping the visits a second time in a correlated 
+# subquery. Every visit references an existing store location, so store is 
+# only needed to look up the chain name.
+POPULAR_CHAIN_PER_AGE_QUERY = """
+    WITH visit_counts AS (
+        -- one pass over the visits, counted per age group and store
+        SELECT 
+            c.age_bucket AS age_group,
+            cv.store_id,
+            COUNT(*) AS total_purchases
+        FROM customer_visits cv
+        JOIN customer c ON cv.customer_id = c.customer_id
+        GROUP BY c.age_bucket, cv.store_id
+    ),
+    ranked_stores AS (
+        -- rank stores within each age group, ties share a rank
+        SELECT 
+            age_group,
+            store_id,
+            total_purchases,
+            RANK() OVER (PARTITION BY age_group 
+                         ORDER BY total_purchases DESC) AS visit_rank
+        FROM visit_counts
+    ),
+    store_chains AS (
+        SELECT DISTINCT store_id, store_chain_name FROM store
+    )
+    SELECT 
+        r.age_group, 
+        sc.store_chain_name AS store_chain, 
+        r.total_purchases
+    FROM ranked_stores r
+    JOIN store_chains sc ON r.store_id = sc.store_id
+    WHERE r.visit_rank = 1
+    ORDER BY r.age_group, store_chain;
+"""
+
+# total purchases and average purchase price per gender
+GENDER_TOTALS_QUERY = """
+    SELECT c.gender, 
+            COUNT(p.purchase_id) AS total_purchases,
+            ROUND(AVG(p.purchased_product_price_usd), 2) 
+            AS avg_spent_per_transaction
+    FROM customer c
+    JOIN purchase p 
+        ON c.customer_id = p.customer_id
+    GROUP BY c.gender;
+"""
+
+# purchase count per gender for one product category, read from the 
+# gender_category_sales summary maintained by the purchase outbox drain
+GENDER_BY_CATEGORY_QUERY = """
+    SELECT gender, 
+        purchase_count
+    FROM gender_category_sales
+    WHERE product_category = %s
+    ORDER BY gender;
+"""
+
+# purchase counts and spending for every product category and gender in 
+# one pass over the gender_category_sales summary
+GENDER_CATEGORY_PIVOT_QUERY = """
+    SELECT product_category,
+        SUM(CASE WHEN gender = 'F' THEN purchase_count ELSE 0 END) 
+            AS female_purchases,
+        SUM(CASE WHEN gender = 'M' THEN purchase_count ELSE 0 END) 
+            AS male_purchases,
+        SUM(CASE WHEN gender = 'X' THEN purchase_count ELSE 0 END) 
+            AS nonbinary_purchases,
+        SUM(CASE WHEN gender = 'F' THEN total_spent ELSE 0 END) 
+            AS female_spent,
+        SUM(CASE WHEN gender = 'M' THEN total_spent ELSE 0 END) 
+            AS male_spent,
+        SUM(CASE WHEN gender = 'X' THEN total_spent ELSE 0 END) 
+            AS nonbinary_spent
+    FROM gender_category_sales
+    GROUP BY product_category
+    ORDER BY product_category;
+"""
+
+# transactions, revenue and average foot traffic per store location
+STORE_STATS_QUERY = """
+    WITH purchase_summary AS (
+        SELECT store_id,
+            store_location,
+            COUNT(*) AS total_transactions,
+            SUM(purchased_product_price_usd) AS total_revenue
+        FROM purchase
+        GROUP BY store_id, store_location
+    ),
+    -- 2) Average foot traffic per store.
+    popularity_summary AS (
+        SELECT store_id,
+            store_location,
+            AVG(foot_traffic) AS avg_foot_traffic
+        FROM popularity
+        GROUP BY store_id, store_location
+    )
+    SELECT s.store_id, 
+        s.store_location,
+        COALESCE(p.total_transactions, 0) AS total_transactions,
+        COALESCE(p.total_revenue, 0)      AS total_revenue,
+        COALESCE(pop.avg_foot_traffic, 0) AS avg_foot_traffic
+    FROM store s
+    LEFT JOIN purchase_summary p 
+        ON s.store_id = p.store_id 
+        AND s.store_location = p.store_location
+    LEFT JOIN popularity_summary pop
+        ON s.store_id = pop.store_id
+        AND s.store_location = pop.store_location;
+"""
+
+# total profit per store chain and location, read from store_profit_summary
+# (maintained by the purchase outbox drain and the inventory trigger in
+# setup-routines.sql)
+STORE_PROFIT_QUERY = """
+    SELECT
+        store_chain_name,
+        store_location,
+        SUM(total_profit) AS total_profit
+    FROM store_profit_summary
+    GROUP BY
+        store_chain_name,
+        store_location;
+"""
+
+# number of locations and store score (see store_score in 
+# setup-routines.sql) of every store chain
+STORE_SCORES_QUERY = """
+    SELECT
+        store_id,
+        MIN(store_chain_name) AS store_chain,
+        store_count(store_id) AS num_locations,
+        store_score(store_id) AS store_score
+    FROM store
+    GROUP BY store_id
+    ORDER BY store_id;
+"""
+
+# Distinct customers (visiting or buying) per store location, chain and 
+# city, estimated from the HyperLogLog sketches in store_customer_hll. 
+# Chains and cities merge their stores' sketches register by register 
+# first, so a customer of several of their stores is counted once. The 
+# +/- column is the 95% margin of error, 1.96 standard errors of 
+# 1.04 / SQRT(1024) each.
+DISTINCT_CUSTOMERS_STORE_QUERY = """
+    SELECT store_id,
+        store_location,
+        hll_estimate(COUNT(*), SUM(POW(2, -rho))) AS customers,
+        ROUND(hll_estimate(COUNT(*), SUM(POW(2, -rho))) 
+              * 1.96 * 1.04 / 32) AS margin
+    FROM store_customer_hll
+    GROUP BY store_id, store_location
+    ORDER BY store_id, store_location;
+"""
+
+DISTINCT_CUSTOMERS_CHAIN_QUERY = """
+    WITH merged AS (
+        SELECT s.store_chain_name,
+            h.reg_idx,
+            MAX(h.rho) AS rho
+        FROM store_customer_hll h
+        JOIN store s 
+            ON h.store_id = s.store_id 
+            AND h.store_location = s.store_location
+        GROUP BY s.store_chain_name, h.reg_idx
+    )
+    SELECT store_chain_name,
+        hll_estimate(COUNT(*), SUM(POW(2, -rho))) AS customers,
+        ROUND(hll_estimate(COUNT(*), SUM(POW(2, -rho))) 
+              * 1.96 * 1.04 / 32) AS margin
+    FROM merged
+    GROUP BY store_chain_name
+    ORDER BY customers DESC;
+"""
+
+DISTINCT_CUSTOMERS_LOCATION_QUERY = """
+    WITH merged AS (
+        SELECT store_location,
+            reg_idx,
+            MAX(rho) AS rho
+        FROM store_customer_hll
+        GROUP BY store_location, reg_idx
+    )
+    SELECT store_location,
+        hll_estimate(COUNT(*), SUM(POW(2, -rho))) AS customers,
+        ROUND(hll_estimate(COUNT(*), SUM(POW(2, -rho))) 
+              * 1.96 * 1.04 / 32) AS margin
+    FROM merged
+    GROUP BY store_location
+    ORDER BY customers DESC;
+"""
+
+# 10 most expensive products in inventory
+TOP_INVENTORY_PRICE_QUERY = """
+    SELECT 
+        inventory.product_id, 
+        store.store_chain_name,
+        inventory.store_location, 
+        inventory.product_price_usd
+    FROM inventory JOIN store 
+    ON inventory.store_id = store.store_id 
+    AND inventory.store_location = store.store_location
+    ORDER BY inventory.product_price_usd DESC
+    LIMIT 10;
+"""
+
+# materialized store sales statistics
+MATERIALIZED_STORE_SALES_QUERY = """
+    SELECT store_id, total_sales, 
+    num_purchases, 
+    avg_discount, 
+    min_price, max_price
+    FROM mv_store_sales_stats;
+"""
+
+# most recent refresh of a materialized view
+LAST_REFRESH_QUERY = """
+    SELECT refresh_type, 
+        finished_at, 
+        TIMESTAMPDIFF(MICROSECOND, started_at, finished_at) / 1000000 
+        AS seconds,
+        rows_applied
+    FROM mv_refresh_log
+    WHERE view_name = %s
+    ORDER BY refresh_id DESC
+    LIMIT 1;
+"""
+
+# product, store and location combinations an admin can purchase: the 
+# inventory rows with stock left (each combination has one row)
+POSSIBLE_PURCHASES_QUERY = """
+    SELECT product_id, store_id, store_location 
+    FROM inventory
+    WHERE qty > 0
+    ORDER BY store_id, store_location, product_id;
+"""
+
+# rows per page of the inventory browser
+INVENTORY_PAGE_SIZE = 20
+
+# One page of the inventory browser; inventory_page fills in the filters.
+# Rows come in the order of idx_inventory_store_product, and each page 
+# starts after the last row of the one before (keyset paging), so a page 
+# is an index range read however far into the inventory it is.
+INVENTORY_PAGE_QUERY = """
+    SELECT i.product_id,
+        p.product_category,
+        i.store_id,
+        i.store_location,
+        i.qty,
+        i.product_price_usd
+    FROM inventory i
+    JOIN product p ON i.product_id = p.product_id
+    WHERE {filters}
+    ORDER BY i.store_id, i.store_location, i.product_id
+    LIMIT %s;
+"""
+INVENTORY_PAGE_HEADERS = ["Product ID", "Product Category", "Store ID",
+                          "Store Location", "Quantity", "Price ($)"]
+
+REPORTS = {
+    "payment_methods": Report(
+        "Most Popular Payment Methods Per Store",
+        ["Store ID", "Store Location", "Payment Method", "Usage Count"],
+        PAYMENT_METHOD_QUERY, []),
+    "age_group_sales": Report(
+        "Total Sales by Age Group",
+        ["Age Group", "Total Sales ($)"],
+        AGE_GROUP_SALES_QUERY, []),
+    "min_max_age": Report(
+        "Youngest and Oldest Buyers per Product Category",
+        ["Product Category", "Youngest Buyers", "Oldest Buyers"],
+        MIN_MAX_AGE_QUERY, []),
+    "wants_versus_needs": Report(
+        "Necessities vs. Non Necessities by Age Group",
+        ["Age Range", "Spent on Necessities ($)", 
+         "Spent on Non Necessities ($)"],
+        WANTS_VERSUS_NEEDS_QUERY, []),
+    "popular_chain_per_age": Report(
+        "Most Popular Store Chain per Age Group",
+        ["Age Group", "Store Chain", "Visit Count"],
+        POPULAR_CHAIN_PER_AGE_QUERY, []),
+    "gender_totals": Report(
+        "Retail Statistics by Gender",
+        ["Gender", "Total Purchases", "Avg Spent Per Transaction ($)"],
+        GENDER_TOTALS_QUERY, []),
+    "gender_by_category": Report(
+        "Product Purchases by Gender",
+        ["Gender", "Purchase Count"],
+        GENDER_BY_CATEGORY_QUERY, ["product_category"]),
+    "gender_category_pivot": Report(
+        "Purchases and Spending by Gender and Product Category",
+        ["Product Category", "Female Purchases", "Male Purchases", 
+         "Nonbinary Purchases", "Female Spent ($)", "Male Spent ($)", 
+         "Nonbinary Spent ($)"],
+        GENDER_CATEGORY_PIVOT_QUERY, []),
+    "store_stats": Report(
+        "Retail Statistics by Store",
+        ["Store ID", "Store Location", "Total Purchases", 
+         "Total Revenue ($)", "Avg Foot Traffic"],
+        STORE_STATS_QUERY, []),
+    "store_profit": Report(
+        "Store Profit Statistics",
+        ["Store Chain", "Store Location", "Total Profit"],
+        STORE_PROFIT_QUERY, []),
+    "store_scores": Report(
+        "Store Scores",
+        ["Store ID", "Store Chain", "Locations", "Store Score"],
+        STORE_SCORES_QUERY, []),
+    "distinct_customers_store": Report(
+        "Distinct Customers per Store (estimated)",
+        ["Store ID", "Store Location", "Distinct Customers", "+/-"],
+        DISTINCT_CUSTOMERS_STORE_QUERY, []),
+    "distinct_customers_chain": Report(
+        "Distinct Customers per Store Chain (estimated)",
+        ["Store Chain", "Distinct Customers", "+/-"],
+        DISTINCT_CUSTOMERS_CHAIN_QUERY, []),
+    "distinct_customers_location": Report(
+        "Distinct Customers per Location (estimated)",
+        ["Store Location", "Distinct Customers", "+/-"],
+        DISTINCT_CUSTOMERS_LOCATION_QUERY, []),
+    "top_inventory_price": Report(
+        "Most Expensive Items",
+        ["Product ID", "Store Chain", "Location", "Product Price"],
+        TOP_INVENTORY_PRICE_QUERY, []),
+    "materialized_store_sales": Report(
+        "Store Sales Statistics",
+        ["Store ID", "Total Sales ($)", "Num Purchases", 
+         "Avg Discount (%)", "Min Price ($)", "Max Price ($)"],
+        MATERIALIZED_STORE_SALES_QUERY, []),
+    "possible_purchases": Report(
+        "Possible Purchases",
+        ["Product ID", "Store ID", "Store Location"],
+        POSSIBLE_PURCHASES_QUERY, []),
+}
+
+# Reports that only make sense for admins (they are not exported from the 
+# client menu)
+ADMIN_REPORTS = {"possible_purchases"}
+
+
+def check_params(name, params):
+    """
+    Returns the parameters of a report as a tuple, raising ValueError if
+    there are the wrong number of them or one is not a valid value.
+    """
+    params = tuple(params)
+    expected = REPORTS[name].params
+    if len(params) != len(expected):
+        raise ValueError(f"{name} takes parameters {expected}, "
+                         f"got {len(params)}")
+    for param, value in zip(expected, params):
+        if param == "product_category" and value not in PRODUCT_CATEGORIES:
+            raise ValueError(f"Unknown product category {value!r}")
+    return params
+
+
+@contextmanager
+def open_report(conn, name, params=(), min_version=None,
+                timeout=outbox_worker.WAIT_TIMEOUT):
+    """
+    Runs a report and yields its cursor before any rows are fetched, so the
+    caller can stream them with fetchmany. The cursor is closed afterwards.
+    If min_version is given, first waits until the summaries include that
+    change, raising TimeoutError after timeout seconds.
+    """
+    params = check_params(name, params)
+    if (min_version is not None
+            and not outbox_worker.wait_for_version(conn, min_version,
+                                                   timeout)):
+        raise TimeoutError(f"Change {min_version} was not applied within "
+                           f"{timeout}s")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(REPORTS[name].query, params)
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def run_report(conn, name, params=(), min_version=None,
+               timeout=outbox_worker.WAIT_TIMEOUT):
+    """
+    Runs a report and returns every row of it as a ReportResult. See
+    open_report for min_version.
+    """
+    report = REPORTS[name]
+    start = time.perf_counter()
+    with open_report(conn, name, params, min_version, timeout) as cursor:
+        rows = cursor.fetchall()
+        column_types = [FieldType.get_info(column[1])
+                        for column in cursor.description]
+    return ReportResult(name, report.title, report.headers, rows,
+                        column_types, time.perf_counter() - start)
+
+
+def to_columns(result):
+    """
+    Returns the rows of a ReportResult as a dict of header -> list of values.
+    """
+    columns = list(zip(*result.rows)) or [()] * len(result.headers)
+    return {header: list(values)
+            for header, values in zip(result.headers, columns)}
+
+
+def payment_methods(conn):
+    """
+    Most used payment method(s) at each store location.
+    """
+    return run_report(conn, "payment_methods")
+
+
+def age_group_sales(conn):
+    """
+    Total amount spent by each age group.
+    """
+    return run_report(conn, "age_group_sales")
+
+
+def min_max_age(conn):
+    """
+    Youngest and oldest age group buying each product category.
+    """
+    return run_report(conn, "min_max_age")
+
+
+def wants_versus_needs(conn):
+    """
+    Spending on necessities and non necessities by age group.
+    """
+    return run_report(conn, "wants_versus_needs")
+
+
+def popular_chain_per_age(conn):
+    """
+    Most visited store chain of every age group.
+    """
+    return run_report(conn, "popular_chain_per_age")
+
+
+def gender_totals(conn):
+    """
+    Purchase count and average amount spent by each gender.
+    """
+    return run_report(conn, "gender_totals")
+
+
+def gender_by_category(conn, product_category):
+    """
+    Purchase count of each gender in one product category, which must be
+    one of PRODUCT_CATEGORIES.
+    """
+    return run_report(conn, "gender_by_category", (product_category,))
+
+
+def gender_category_pivot(conn):
+    """
+    Purchases and spending of every gender in every product category.
+    """
+    return run_report(conn, "gender_category_pivot")
+
+
+def store_stats(conn):
+    """
+    Purchases, revenue and average foot traffic of every store location.
+    """
+    return run_report(conn, "store_stats")
+
+
+def store_profit(conn):
+    """
+    Total profit of every store chain and location.
+    """
+    return run_report(conn, "store_profit")
+
+
+def store_scores(conn):
+    """
+    Number of locations and store score of every store chain.
+    """
+    return run_report(conn, "store_scores")
+
+
+def distinct_customers_store(conn):
+    """
+    Estimated number of distinct customers of every store location.
+    """
+    return run_report(conn, "distinct_customers_store")
+
+
+def distinct_customers_chain(conn):
+    """
+    Estimated number of distinct customers of every store chain.
+    """
+    return run_report(conn, "distinct_customers_chain")
+
+
+def distinct_customers_location(conn):
+    """
+    Estimated number of distinct customers of the stores in every city.
+    """
+    return run_report(conn, "distinct_customers_location")
+
+
+def top_inventory_price(conn):
+    """
+    The 10 most expensive products in inventory.
+    """
+    return run_report(conn, "top_inventory_price")
+
+
+def materialized_store_sales(conn, min_version=None):
+    """
+    Sales statistics of every store from mv_store_sales_stats, once it
+    includes change min_version if given.
+    """
+    return run_report(conn, "materialized_store_sales",
+                      min_version=min_version)
+
+
+def possible_purchases(conn):
+    """
+    Product, store and location combinations that can be purchased.
+    """
+    return run_report(conn, "possible_purchases")
+
+
+def inventory_page(conn, after=None, store_id=None, store_location=None,
+                   product_category=None, in_stock=True,
+                   page_size=INVENTORY_PAGE_SIZE):
+    """
+    Returns up to page_size inventory rows (in INVENTORY_PAGE_HEADERS 
+    order) matching the filters that are not None, only those with stock 
+    left if in_stock. after is the (store_id, store_location, product_id)
+    of the last row of the previous page, or None for the first page.
+    Raises ValueError for an unknown product category.
+    """
+    filters = []
+    params = []
+    if store_id is not None:
+        filters.append("i.store_id = %s")
+        params.append(int(store_id))
+    if store_location is not None:
+        filters.append("i.store_location = %s")
+        params.append(store_location)
+    if product_category is not None:
+        if product_category not in PRODUCT_CATEGORIES:
+            raise ValueError(f"Unknown product category {product_category!r}")
+        filters.append("p.product_category = %s")
+        params.append(product_category)
+    if in_stock:
+        filters.append("i.qty > 0")
+    if after is not None:
+        filters.append("(i.store_id, i.store_location, i.product_id) "
+                       "> (%s, %s, %s)")
+        params.extend(after)
+    query = INVENTORY_PAGE_QUERY.format(
+        filters=" AND ".join(filters) if filters else "TRUE")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params + [page_size])
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def store_exists(conn, store_id):
+    """
+    Returns whether any store location has the given (integer) store ID.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM store WHERE store_id = %s;",
+                       (int(store_id),))
+        return cursor.fetchone()[0] > 0
+    finally:
+        cursor.close()
+
+
+def store_chain(conn, store_id):
+    """
+    Returns the name of the store chain with the given store ID, or None.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT store_id_to_store_chain(%s);", (int(store_id),))
+        result = cursor.fetchone()
+        return result[0] if result else None
+    finally:
+        cursor.close()
+
+
+def store_summary(conn, store_id):
+    """
+    Returns (number of locations, store score) of the store chain with the
+    given store ID. The score relates its transactions to its foot traffic.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT store_count(%s), store_score(%s);",
+                       (int(store_id), int(store_id)))
+        num_open_stores, score = cursor.fetchone()
+        return num_open_stores or 0, score or 0
+    finally:
+        cursor.close()
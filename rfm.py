@@ -0,0 +1,189 @@
+"""
+Recency / frequency / monetary (RFM) segmentation of customers. One query
+streams every customer's last purchase date, number of purchases and net
+spend (the get_sale_price formula, price after discount), and the scoring
+is done on whole columns at once with NumPy and pandas:
+
+- recency is the days between a customer's last purchase and the latest
+  purchase in the data, frequency their number of purchases and monetary
+  their total net spend;
+- each is scored 1 to RFM_QUANTILES by percentile rank (5 is best: most
+  recent, most frequent, biggest spender), ties getting the same score;
+- customers are put in a segment by their recency and frequency scores.
+
+The reports here return reports.ReportResult like the ones in reports.py,
+and are exported by export.py under the names in RFM_REPORTS.
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from reports import ReportResult
+
+# customers fetched from the server at a time
+RFM_BATCH_SIZE = 50000
+RFM_QUANTILES = 5
+
+# One row per customer. Aggregating in MySQL means only one row per
+# customer (not per purchase) crosses the connection; purchase has an
+# index on customer_id from its foreign key. Dates are sent as day numbers
+# and spend as DOUBLE so they load straight into NumPy arrays.
+RFM_FACTS_QUERY = """
+    SELECT
+        customer_id,
+        TO_DAYS(MAX(txn_date)) AS last_purchase_day,
+        COUNT(*) AS frequency,
+        CAST(SUM(purchased_product_price_usd
+                 * (1 - (discount_percent / 100.0))) AS DOUBLE) AS monetary
+    FROM purchase
+    GROUP BY customer_id;
+"""
+
+# (segment, condition on the recency score r and frequency score f), first
+# match wins; everyone else "Needs Attention"
+SEGMENT_RULES = [
+    ("Champions", lambda r, f: (r >= 4) & (f >= 4)),
+    ("Loyal Customers", lambda r, f: (r >= 3) & (f >= 4)),
+    ("New Customers", lambda r, f: (r >= 5) & (f <= 1)),
+    ("Potential Loyalists", lambda r, f: (r >= 4) & (f >= 2)),
+    ("At Risk", lambda r, f: (r <= 2) & (f >= 3)),
+    ("Hibernating", lambda r, f: (r <= 2) & (f <= 2)),
+]
+DEFAULT_SEGMENT = "Needs Attention"
+
+# reports computed here rather than by a single query: name -> (title,
+# function(conn) returning a ReportResult)
+RFM_REPORTS = {
+    "rfm_customers": ("Customer RFM Scores", lambda conn: customer_rfm(conn)),
+    "rfm_segments": ("Customer RFM Segments", lambda conn: rfm_segments(conn)),
+}
+
+CUSTOMER_HEADERS = ["Customer ID", "Recency (days)", "Frequency",
+                    "Monetary ($)", "R", "F", "M", "RFM Score", "Segment"]
+SEGMENT_HEADERS = ["Segment", "Customers", "Avg Recency (days)",
+                   "Avg Frequency", "Avg Monetary ($)", "Total Monetary ($)",
+                   "Share of Spend (%)"]
+
+
+def fetch_rfm_facts(conn, batch_size=RFM_BATCH_SIZE):
+    """
+    Runs RFM_FACTS_QUERY and returns its columns as a DataFrame, fetching
+    batch_size rows at a time.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(RFM_FACTS_QUERY)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        cursor.close()
+    facts = np.concatenate(chunks) if chunks else np.empty((0, 4))
+    return pd.DataFrame({
+        "customer_id": facts[:, 0].astype(np.int64),
+        "last_purchase_day": facts[:, 1].astype(np.int64),
+        "frequency": facts[:, 2].astype(np.int64),
+        "monetary": facts[:, 3],
+    })
+
+
+def quantile_scores(values, quantiles=RFM_QUANTILES):
+    """
+    Scores values 1 to quantiles by percentile rank, higher values scoring
+    higher. Equal values get equal scores.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+    # the average rank of each distinct value is the middle of the run of
+    # positions its copies take up in sorted order
+    if np.issubdtype(values.dtype, np.integer) \
+            and values.max() - values.min() <= len(values):
+        # day numbers and purchase counts span a small range, so counting
+        # every value avoids sorting
+        inverse = values - values.min()
+        counts = np.bincount(inverse)
+    else:
+        _, inverse, counts = np.unique(values, return_inverse=True,
+                                       return_counts=True)
+    average_rank = np.cumsum(counts) - (counts - 1) / 2
+    pct = average_rank[inverse] / len(values)
+    return np.clip(np.ceil(pct * quantiles), 1, quantiles).astype(np.int64)
+
+
+def score_rfm(facts, quantiles=RFM_QUANTILES):
+    """
+    Adds recency, R, F, M, rfm_score and segment columns to a DataFrame
+    from fetch_rfm_facts and returns it.
+    """
+    facts = facts.copy()
+    as_of = facts["last_purchase_day"].max() if len(facts) else 0
+    facts["recency"] = as_of - facts["last_purchase_day"]
+    # fewer days since the last purchase is better
+    facts["r"] = quantile_scores(-facts["recency"], quantiles)
+    facts["f"] = quantile_scores(facts["frequency"], quantiles)
+    facts["m"] = quantile_scores(facts["monetary"], quantiles)
+    # the three scores as digits, e.g. 543 for R=5, F=4, M=3
+    facts["rfm_score"] = 100 * facts["r"] + 10 * facts["f"] + facts["m"]
+    r = facts["r"].to_numpy()
+    f = facts["f"].to_numpy()
+    # segment numbers, turned into a categorical column of names rather
+    # than one Python string per customer
+    names = [name for name, _ in SEGMENT_RULES] + [DEFAULT_SEGMENT]
+    codes = np.select([rule(r, f) for _, rule in SEGMENT_RULES],
+                      range(len(SEGMENT_RULES)), default=len(SEGMENT_RULES))
+    facts["segment"] = pd.Categorical.from_codes(codes, names)
+    return facts
+
+
+def customer_rfm(conn, quantiles=RFM_QUANTILES):
+    """
+    RFM scores and segment of every customer, best customers first.
+    """
+    start = time.perf_counter()
+    scored = score_rfm(fetch_rfm_facts(conn), quantiles)
+    scored = scored.sort_values(["r", "f", "m", "monetary"], ascending=False)
+    rows = list(zip(scored["customer_id"].tolist(), scored["recency"].tolist(),
+                    scored["frequency"].tolist(),
+                    scored["monetary"].round(2).tolist(),
+                    scored["r"].tolist(), scored["f"].tolist(),
+                    scored["m"].tolist(), scored["rfm_score"].tolist(),
+                    scored["segment"].tolist()))
+    return ReportResult("rfm_customers", RFM_REPORTS["rfm_customers"][0],
+                        CUSTOMER_HEADERS, rows,
+                        ["LONG", "LONG", "LONG", "DOUBLE", "TINY", "TINY",
+                         "TINY", "LONG", "VAR_STRING"],
+                        time.perf_counter() - start)
+
+
+def rfm_segments(conn, quantiles=RFM_QUANTILES):
+    """
+    Number of customers and their average recency, frequency and spend in
+    each RFM segment, biggest share of spend first.
+    """
+    start = time.perf_counter()
+    scored = score_rfm(fetch_rfm_facts(conn), quantiles)
+    segments = scored.groupby("segment", observed=True).agg(
+        customers=("customer_id", "size"),
+        recency=("recency", "mean"),
+        frequency=("frequency", "mean"),
+        avg_monetary=("monetary", "mean"),
+        total_monetary=("monetary", "sum"),
+    ).sort_values("total_monetary", ascending=False)
+    total_spend = segments["total_monetary"].sum()
+    segments["share"] = (100 * segments["total_monetary"] / total_spend
+                         if total_spend else 0.0)
+    rows = [(segment, int(row.customers), round(float(row.recency), 1),
+             round(float(row.frequency), 2),
+             round(float(row.avg_monetary), 2),
+             round(float(row.total_monetary), 2),
+             round(float(row.share), 1))
+            for segment, row in segments.iterrows()]
+    return ReportResult("rfm_segments", RFM_REPORTS["rfm_segments"][0],
+                        SEGMENT_HEADERS, rows,
+                        ["VAR_STRING", "LONG", "DOUBLE", "DOUBLE", "DOUBLE",
+                         "DOUBLE", "DOUBLE"],
+                        time.perf_counter() - start)
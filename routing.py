@@ -0,0 +1,214 @@
+"""
+Routes queries between the primary MySQL server and an optional read
+replica. Writes, and reads that must see them, go to the primary; client
+reports go to the replica whenever it is reachable and not too far behind,
+and fall back to the primary otherwise.
+
+The replica is configured with environment variables (nothing is routed to
+a replica unless RETAILDB_REPLICA_HOST is set):
+    RETAILDB_REPLICA_HOST      host of the replica
+    RETAILDB_REPLICA_PORT      its port (default 3306)
+    RETAILDB_MAX_REPLICA_LAG   seconds the replica may be behind (default 5)
+
+Read-your-writes uses GTIDs, so the primary and replica need gtid_mode=ON;
+without it, reads after a write simply go to the primary. The database
+user needs the REPLICATION CLIENT privilege on the replica to check its lag
+(see grant-permissions.sql). To see how the current session would route:
+    $ RETAILDB_REPLICA_PORT=3307 RETAILDB_REPLICA_HOST=127.0.0.1 \\
+        python3 routing.py
+"""
+
+import argparse
+import os
+import sys
+import time
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+
+DEFAULT_MAX_REPLICA_LAG = 5
+# seconds a replica lag reading is reused before asking the replica again
+LAG_CHECK_INTERVAL = 1
+# seconds to wait before trying to reconnect to an unreachable replica
+RECONNECT_INTERVAL = 10
+# seconds a read-your-writes read waits for the replica to apply our writes
+# before going to the primary instead
+GTID_WAIT_TIMEOUT = 0.5
+
+
+class ConnectionRouter:
+    """
+    Hands out the connection a query should use: writer() always returns
+    the primary, and reader() returns the replica when it is healthy.
+    """
+
+    def __init__(self, primary, replica_config=None,
+                 max_lag=DEFAULT_MAX_REPLICA_LAG):
+        self.primary = primary
+        self.replica_config = replica_config
+        self.max_lag = max_lag
+        self.replica = None
+        self.next_connect_at = 0
+        self.lag = None
+        self.lag_checked_at = 0
+        # GTID set of the primary after this session's last write, "" if
+        # the primary does not use GTIDs, or None before any write
+        self.last_write_gtids = None
+
+    @classmethod
+    def from_env(cls, primary, user, password, database):
+        """
+        Returns a router for an open primary connection, with the replica
+        given by the RETAILDB_REPLICA_* environment variables (if any).
+        """
+        host = os.environ.get("RETAILDB_REPLICA_HOST")
+        if not host:
+            return cls(primary)
+        replica_config = {
+            "host": host,
+            "port": os.environ.get("RETAILDB_REPLICA_PORT", "3306"),
+            "user": user,
+            "password": password,
+            "database": database,
+            # every report sees the replica's latest data
+            "autocommit": True,
+        }
+        max_lag = float(os.environ.get("RETAILDB_MAX_REPLICA_LAG",
+                                       DEFAULT_MAX_REPLICA_LAG))
+        return cls(primary, replica_config, max_lag)
+
+    def writer(self):
+        return self.primary
+
+    def note_write(self):
+        """
+        Records that this session committed a write on the primary, so
+        read_your_writes readers wait until the replica has applied it.
+        """
+        cursor = self.primary.cursor()
+        try:
+            cursor.execute("SELECT @@GLOBAL.gtid_executed;")
+            self.last_write_gtids = cursor.fetchone()[0] or ""
+        finally:
+            cursor.close()
+
+    def replica_connection(self):
+        """
+        Returns an open replica connection, or None if there is no replica
+        or it cannot be reached.
+        """
+        if self.replica_config is None:
+            return None
+        if self.replica is not None and self.replica.is_connected():
+            return self.replica
+        if time.monotonic() < self.next_connect_at:
+            return None
+        try:
+            self.replica = mysql.connector.connect(**self.replica_config)
+            self.lag_checked_at = 0
+            return self.replica
+        except mysql.connector.Error as err:
+            sys.stderr.write(f"Replica unavailable, using primary: {err}\n")
+            self.replica = None
+            self.next_connect_at = time.monotonic() + RECONNECT_INTERVAL
+            return None
+
+    def replica_lag(self, replica):
+        """
+        Returns how many seconds the replica is behind the primary, or None
+        if it is not replicating. Readings are reused for
+        LAG_CHECK_INTERVAL seconds.
+        """
+        if time.monotonic() - self.lag_checked_at < LAG_CHECK_INTERVAL:
+            return self.lag
+        cursor = replica.cursor(dictionary=True)
+        try:
+            cursor.execute("SHOW REPLICA STATUS;")
+            status = cursor.fetchone()
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        if status is None or status["Replica_SQL_Running"] != "Yes":
+            self.lag = None
+        else:
+            self.lag = status["Seconds_Behind_Source"]
+        self.lag_checked_at = time.monotonic()
+        return self.lag
+
+    def caught_up(self, replica):
+        """
+        Returns whether the replica has applied this session's last write,
+        waiting up to GTID_WAIT_TIMEOUT seconds for it.
+        """
+        if self.last_write_gtids is None:
+            return True
+        if self.last_write_gtids == "":
+            return False
+        cursor = replica.cursor()
+        try:
+            cursor.execute("SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s);",
+                           (self.last_write_gtids, GTID_WAIT_TIMEOUT))
+            return cursor.fetchone()[0] == 0
+        finally:
+            cursor.close()
+
+    def reader(self, read_your_writes=False):
+        """
+        Returns the connection to run a read on: the replica if it is
+        reachable, at most max_lag seconds behind and (for read_your_writes)
+        has applied this session's writes, and the primary otherwise.
+        """
+        replica = self.replica_connection()
+        if replica is None:
+            return self.primary
+        try:
+            lag = self.replica_lag(replica)
+            if lag is None or lag > self.max_lag:
+                return self.primary
+            if read_your_writes and not self.caught_up(replica):
+                return self.primary
+            return replica
+        except mysql.connector.Error as err:
+            sys.stderr.write(f"Replica check failed, using primary: {err}\n")
+            self.close()
+            self.next_connect_at = time.monotonic() + RECONNECT_INTERVAL
+            return self.primary
+
+    def describe(self, conn):
+        return "replica" if conn is self.replica and conn is not None \
+            else "primary"
+
+    def close(self):
+        if self.replica is not None:
+            try:
+                self.replica.close()
+            except mysql.connector.Error:
+                pass
+            self.replica = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show where reads are "
+                                     "routed with the current replica "
+                                     "settings.")
+    add_connection_args(parser)
+    args = parser.parse_args()
+    primary = connect_from_args(args)
+    router = ConnectionRouter.from_env(primary, args.user, args.password,
+                                       args.database)
+    try:
+        if router.replica_config is None:
+            print("No replica configured (set RETAILDB_REPLICA_HOST).")
+        reader = router.reader()
+        print(f"Reports are routed to the {router.describe(reader)}.")
+        if router.replica is not None:
+            lag = router.replica_lag(router.replica)
+            print("Replica lag: " + ("not replicating" if lag is None
+                                     else f"{lag}s")
+                  + f" (limit {router.max_lag:g}s)")
+    finally:
+        router.close()
+        primary.close()
+
+
+if __name__ == '__main__':
+    main()
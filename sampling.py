@@ -0,0 +1,228 @@
+"""
+Approximate versions of the slow full-scan reports, answered from
+purchase_sample (see setup-routines.sql) instead of purchase. The sample is
+a Bernoulli sample of purchase kept up to date by sp_drain_outbox:
+each purchase is kept with its store location's sampling rate and carries
+a weight of 1 / that rate, the number of purchases it stands for.
+
+Counts and sums are Horvitz-Thompson estimates (the weighted sums over the
+sample), with variance estimated by
+    sum over the sample of (weight^2 - weight) * value^2,
+and averages are ratios of two such sums. Each estimate is shown with its
+margin of error at 95% confidence, CONFIDENCE_Z standard errors, so the
+exact value is within estimate +/- margin for about 19 in 20 reports.
+Stores with fewer than min_store_sample purchases are sampled in full, so
+their figures are exact (margin 0).
+
+The reports here are keyed by the name of the exact report in
+reports.REPORTS they approximate and return reports.ReportResult.
+"""
+
+import math
+import time
+from collections import namedtuple
+from mysql.connector import FieldType
+from reports import ReportResult
+
+# standard errors in the 95% margin of error
+CONFIDENCE_Z = 1.96
+
+# An approximate report. The query returns, for each header without a
+# "+/-" partner, one column, and for each estimate (a header followed by a
+# "+/-" header) two columns: the estimate and its estimated variance.
+SampledReport = namedtuple("SampledReport", ["title", "headers", "query"])
+
+# transactions and revenue per store from the sample, with the average
+# foot traffic read from popularity in full like in STORE_STATS_QUERY
+SAMPLED_STORE_STATS_QUERY = """
+    WITH sample_summary AS (
+        SELECT store_id,
+            store_location,
+            SUM(weight) AS total_transactions,
+            SUM(weight * weight - weight) AS transactions_var,
+            SUM(weight * price) AS total_revenue,
+            SUM((weight * weight - weight) * price * price) AS revenue_var
+        FROM purchase_sample
+        GROUP BY store_id, store_location
+    ),
+    popularity_summary AS (
+        SELECT store_id,
+            store_location,
+            AVG(foot_traffic) AS avg_foot_traffic
+        FROM popularity
+        GROUP BY store_id, store_location
+    )
+    SELECT s.store_id,
+        s.store_location,
+        COALESCE(p.total_transactions, 0),
+        COALESCE(p.transactions_var, 0),
+        COALESCE(p.total_revenue, 0),
+        COALESCE(p.revenue_var, 0),
+        COALESCE(pop.avg_foot_traffic, 0)
+    FROM store s
+    LEFT JOIN sample_summary p
+        ON s.store_id = p.store_id
+        AND s.store_location = p.store_location
+    LEFT JOIN popularity_summary pop
+        ON s.store_id = pop.store_id
+        AND s.store_location = pop.store_location;
+"""
+
+# purchases and average price per gender; the variance of the average
+# (a ratio estimate) uses each sampled price's deviation from it
+SAMPLED_GENDER_TOTALS_QUERY = """
+    WITH gender_summary AS (
+        SELECT gender,
+            SUM(weight) AS total_purchases,
+            SUM(weight * weight - weight) AS purchases_var,
+            SUM(weight * price) / SUM(weight) AS avg_price
+        FROM purchase_sample
+        GROUP BY gender
+    )
+    SELECT g.gender,
+        g.total_purchases,
+        g.purchases_var,
+        g.avg_price,
+        SUM((s.weight * s.weight - s.weight)
+            * (s.price - g.avg_price) * (s.price - g.avg_price))
+            / (g.total_purchases * g.total_purchases)
+    FROM purchase_sample s
+    JOIN gender_summary g ON s.gender = g.gender
+    GROUP BY g.gender, g.total_purchases, g.purchases_var, g.avg_price
+    ORDER BY g.gender;
+"""
+
+# total sales (after discounts) per age group
+SAMPLED_AGE_GROUP_SALES_QUERY = """
+    SELECT age_bucket,
+        SUM(weight * sale_price) AS total_sales,
+        SUM((weight * weight - weight) * sale_price * sale_price)
+    FROM purchase_sample
+    GROUP BY age_bucket
+    ORDER BY total_sales DESC;
+"""
+
+# spending on necessities vs. non-necessities per age group
+SAMPLED_WANTS_VERSUS_NEEDS_QUERY = """
+    SELECT age_bucket,
+        SUM(CASE WHEN product_category IN ('Groceries', 'Health & Beauty')
+            THEN weight * sale_price ELSE 0 END),
+        SUM(CASE WHEN product_category IN ('Groceries', 'Health & Beauty')
+            THEN (weight * weight - weight) * sale_price * sale_price
+            ELSE 0 END),
+        SUM(CASE WHEN product_category NOT IN ('Groceries', 'Health & Beauty')
+            THEN weight * sale_price ELSE 0 END),
+        SUM(CASE WHEN product_category NOT IN ('Groceries', 'Health & Beauty')
+            THEN (weight * weight - weight) * sale_price * sale_price
+            ELSE 0 END)
+    FROM purchase_sample
+    GROUP BY age_bucket
+    ORDER BY age_bucket;
+"""
+
+SAMPLED_REPORTS = {
+    "store_stats": SampledReport(
+        "Retail Statistics by Store (approximate)",
+        ["Store ID", "Store Location", "Total Purchases", "+/-",
+         "Total Revenue ($)", "+/-", "Avg Foot Traffic"],
+        SAMPLED_STORE_STATS_QUERY),
+    "gender_totals": SampledReport(
+        "Retail Statistics by Gender (approximate)",
+        ["Gender", "Total Purchases", "+/-",
+         "Avg Spent Per Transaction ($)", "+/-"],
+        SAMPLED_GENDER_TOTALS_QUERY),
+    "age_group_sales": SampledReport(
+        "Total Sales by Age Group (approximate)",
+        ["Age Group", "Total Sales ($)", "+/-"],
+        SAMPLED_AGE_GROUP_SALES_QUERY),
+    "wants_versus_needs": SampledReport(
+        "Necessities vs. Non Necessities by Age Group (approximate)",
+        ["Age Range", "Spent on Necessities ($)", "+/-",
+         "Spent on Non Necessities ($)", "+/-"],
+        SAMPLED_WANTS_VERSUS_NEEDS_QUERY),
+}
+
+SAMPLE_INFO_QUERY = """
+    SELECT (SELECT COUNT(*) FROM purchase_sample),
+        sample_rate,
+        min_store_sample
+    FROM purchase_sample_config;
+"""
+
+
+def margin_of_error(variance):
+    """
+    Half-width of the 95% confidence interval for an estimate with the
+    given estimated variance.
+    """
+    return CONFIDENCE_Z * math.sqrt(max(float(variance or 0), 0.0))
+
+
+def is_estimate(headers, index):
+    """
+    Returns whether headers[index] is an estimate, i.e. followed by its
+    "+/-" margin.
+    """
+    return index + 1 < len(headers) and headers[index + 1] == "+/-"
+
+
+def to_estimates(row, headers):
+    """
+    Turns a row of a sampled query into a row for headers, replacing each
+    (estimate, variance) pair with the rounded estimate and its margin.
+    """
+    values = iter(row)
+    result = []
+    for index, header in enumerate(headers):
+        if header == "+/-":
+            result.append(round(margin_of_error(next(values)), 2))
+        elif is_estimate(headers, index):
+            result.append(round(float(next(values)), 2))
+        else:
+            result.append(next(values))
+    return tuple(result)
+
+
+def run_sampled_report(conn, name):
+    """
+    Runs the approximate version of the report name and returns it as a
+    ReportResult.
+    """
+    report = SAMPLED_REPORTS[name]
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(report.query)
+        rows = [to_estimates(row, report.headers)
+                for row in cursor.fetchall()]
+        query_types = iter([FieldType.get_info(column[1])
+                            for column in cursor.description])
+    finally:
+        cursor.close()
+    # estimates and margins are computed here; the other columns keep the
+    # type the query returned them with
+    column_types = []
+    for index, header in enumerate(report.headers):
+        if header == "+/-":
+            column_types.append("DOUBLE")
+        elif is_estimate(report.headers, index):
+            # skip the estimate and its variance
+            next(query_types)
+            next(query_types)
+            column_types.append("DOUBLE")
+        else:
+            column_types.append(next(query_types))
+    return ReportResult(name, report.title, report.headers, rows,
+                        column_types, time.perf_counter() - start)
+
+
+def sample_info(conn):
+    """
+    Returns (sampled purchases, sample_rate, min_store_sample).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SAMPLE_INFO_QUERY)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
@@ -0,0 +1,328 @@
+"""
+Serves the client reports as JSON over HTTP on localhost, so dashboards can
+read them without running the terminal app, e.g.
+    $ python3 server.py --listen-port 8121
+    $ curl localhost:8121/reports
+    $ curl localhost:8121/reports/store_stats
+    $ curl "localhost:8121/reports/gender_by_category?product_category=Books"
+    $ curl localhost:8121/stores/3
+
+Every request runs on its own thread with a connection borrowed from a
+pool. Report responses are cached for a few seconds, since the summaries
+behind them are themselves refreshed every few seconds; results too large
+to cache are streamed to the client one batch of rows at a time.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import mysql.connector
+from mysql.connector import pooling
+from abstracted import add_connection_args
+from export import json_value
+import reports
+
+# connections shared by the request threads; MySQL connector pools hold at
+# most 32
+POOL_SIZE = 16
+# seconds a request waits for a free connection before getting a 503
+POOL_TIMEOUT = 5
+# seconds a report response is served from the cache
+CACHE_TTL = 5
+# responses larger than this many bytes are streamed and not cached
+CACHE_MAX_BYTES = 1 << 20
+# responses cached at most; the ones closest to expiring are dropped first
+CACHE_MAX_ENTRIES = 256
+# rows fetched from MySQL and sent to the client at a time
+STREAM_BATCH_SIZE = 1000
+
+# reports the server exposes (the admin-only ones are left out)
+SERVED_REPORTS = [name for name in reports.REPORTS
+                  if name not in reports.ADMIN_REPORTS]
+
+
+class ReportCache:
+    """
+    Encoded report responses keyed by (report name, parameters), each kept
+    for ttl seconds. Only one thread runs a missing report at a time; the
+    others wait for it and then read its cached response. Expired responses
+    and the locks of keys no thread is running are dropped on every put.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = {}
+        self.key_locks = {}
+        # keys whose responses were too large to cache, which are not
+        # worth making other requests wait for
+        self.uncacheable = set()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+        return entry[1] if entry else None
+
+    def put(self, key, body):
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, body)
+            for old_key in [old_key for old_key, (expires, _)
+                            in self.entries.items() if expires <= now]:
+                del self.entries[old_key]
+            if len(self.entries) > self.max_entries:
+                by_expiry = sorted(self.entries,
+                                   key=lambda old_key:
+                                   self.entries[old_key][0])
+                for old_key in by_expiry[:len(self.entries)
+                                         - self.max_entries]:
+                    del self.entries[old_key]
+            # a thread holding a dropped lock just finishes on its own
+            for old_key in [old_key for old_key, key_lock
+                            in self.key_locks.items()
+                            if old_key not in self.entries
+                            and not key_lock.locked()]:
+                del self.key_locks[old_key]
+
+    def mark_uncacheable(self, key):
+        with self.lock:
+            if len(self.uncacheable) >= self.max_entries:
+                self.uncacheable.clear()
+            self.uncacheable.add(key)
+            self.key_locks.pop(key, None)
+
+    def key_lock(self, key):
+        """
+        Returns the lock a thread holds while running the report for key,
+        or None if the report is not cached.
+        """
+        with self.lock:
+            if self.ttl <= 0 or key in self.uncacheable:
+                return None
+            return self.key_locks.setdefault(key, threading.Lock())
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool, cache):
+        super().__init__(address, ReportHandler)
+        self.pool = pool
+        self.pool_slots = threading.BoundedSemaphore(pool.pool_size)
+        self.cache = cache
+
+    def get_connection(self):
+        """
+        Borrows a pooled connection, waiting up to POOL_TIMEOUT seconds for
+        one to be returned if all are in use. Returns None on timeout.
+        """
+        if not self.pool_slots.acquire(timeout=POOL_TIMEOUT):
+            return None
+        try:
+            return self.pool.get_connection()
+        except mysql.connector.Error:
+            self.pool_slots.release()
+            raise
+
+    def release_connection(self, conn):
+        conn.close()
+        self.pool_slots.release()
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 for keep-alive and chunked responses
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, value, headers=()):
+        body = json.dumps(value, default=json_value).encode()
+        self.send_body(status, body, headers)
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+        try:
+            if parts == ["health"]:
+                self.send_json(200, {"status": "ok"})
+            elif parts == ["reports"]:
+                self.send_json(200, [
+                    {"name": name, "title": reports.REPORTS[name].title,
+                     "params": reports.REPORTS[name].params}
+                    for name in SERVED_REPORTS])
+            elif len(parts) == 2 and parts[0] == "reports":
+                self.serve_report(parts[1], query)
+            elif len(parts) == 2 and parts[0] == "stores":
+                self.serve_store(parts[1])
+            else:
+                self.send_json(404, {"error": "Not found"})
+        except ValueError as err:
+            self.send_json(400, {"error": str(err)})
+        except mysql.connector.Error as err:
+            sys.stderr.write(f"Error: {err}\n")
+            self.send_json(500, {"error": "Database error"})
+
+    def serve_store(self, store_id):
+        if not store_id.isdigit():
+            raise ValueError("Store ID must be a number")
+        conn = self.server.get_connection()
+        if conn is None:
+            self.send_json(503, {"error": "Server busy"})
+            return
+        try:
+            if not reports.store_exists(conn, store_id):
+                self.send_json(404, {"error": f"No store {store_id}"})
+                return
+            num_open_stores, score = reports.store_summary(conn, store_id)
+            self.send_json(200, {
+                "store_id": int(store_id),
+                "store_chain": reports.store_chain(conn, store_id),
+                "num_open_stores": num_open_stores, "store_score": score})
+        finally:
+            self.server.release_connection(conn)
+
+    def serve_report(self, name, query):
+        if name not in SERVED_REPORTS:
+            self.send_json(404, {"error": f"No report {name}"})
+            return
+        params = reports.check_params(
+            name, [query.get(param, [""])[0]
+                   for param in reports.REPORTS[name].params])
+        key = (name, params)
+        cache = self.server.cache
+        body = cache.get(key)
+        if body is None:
+            key_lock = cache.key_lock(key)
+            if key_lock is None:
+                self.stream_report(name, params, key)
+                return
+            with key_lock:
+                # another thread may have run the report while we waited
+                body = cache.get(key)
+                if body is None:
+                    self.stream_report(name, params, key)
+                    return
+        self.send_body(200, body, [("X-Cache", "hit")])
+
+    def stream_report(self, name, params, key):
+        """
+        Runs a report and sends it as a chunked JSON object:
+        {"name", "title", "headers", "rows": [[...], ...]}. The response is
+        cached as well if it turns out small enough.
+        """
+        report = reports.REPORTS[name]
+        conn = self.server.get_connection()
+        if conn is None:
+            self.send_json(503, {"error": "Server busy"})
+            return
+        cache = self.server.cache
+        # the encoded response so far, kept while it is small enough to cache
+        kept = []
+        kept_bytes = 0
+        started = False
+        try:
+            with reports.open_report(conn, name, params) as cursor:
+                rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("X-Cache", "miss")
+                self.end_headers()
+                started = True
+                data = (json.dumps({"name": name, "title": report.title,
+                                    "headers": report.headers})[:-1]
+                        + ', "rows": [').encode()
+                separator = b""
+                while True:
+                    if rows:
+                        data += separator + b", ".join(
+                            json.dumps(row, default=json_value).encode()
+                            for row in rows)
+                        separator = b", "
+                    else:
+                        data += b"]}"
+                    self.write_chunk(data)
+                    if kept is not None:
+                        kept.append(data)
+                        kept_bytes += len(data)
+                        if kept_bytes > cache.max_bytes:
+                            kept = None
+                            cache.mark_uncacheable(key)
+                    if not rows:
+                        break
+                    data = b""
+                    rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                self.write_chunk(b"")
+        except mysql.connector.Error as err:
+            if not started:
+                raise
+            # the status line is already sent, so drop the connection
+            # before the final chunk to tell the client the body is cut off
+            sys.stderr.write(f"Error: {err}\n")
+            self.close_connection = True
+            return
+        finally:
+            self.server.release_connection(conn)
+        if kept is not None:
+            cache.put(key, b"".join(kept))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the retail reports "
+                                     "as JSON over HTTP.")
+    parser.add_argument("--listen", default="127.0.0.1",
+                        help="address to listen on")
+    parser.add_argument("--listen-port", type=int, default=8121)
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE)
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                        help="seconds to cache report responses "
+                        "(0 disables caching)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log every request")
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    pool = pooling.MySQLConnectionPool(
+        pool_name="retaildb_server", pool_size=args.pool_size,
+        host=args.host, port=args.port, user=args.user,
+        password=args.password, database=args.database, autocommit=True)
+    server = ReportServer((args.listen, args.listen_port), pool,
+                          ReportCache(ttl=args.cache_ttl))
+    server.verbose = args.verbose
+    print(f"Serving reports on http://{args.listen}:{args.listen_port}/",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,19 +14,20 @@ DELIMITER !
 CREATE FUNCTION make_salt(num_chars INT)
 RETURNS VARCHAR(20) DETERMINISTIC
 BEGIN
-    DECLARE salt VARCHAR(20) DEFAULT '';
-
-    -- Don't want to generate more than 20 characters of salt.
-    SET num_chars = LEAST(20, num_chars);
-
-    -- Generate the salt:  Characters used are ASCII code 32 (space)
-    -- through 126 ('z').
-    WHILE num_chars > 0 DO
-        SET salt = CONCAT(salt, CHAR(32 + FLOOR(RAND() * 95)));
-        SET num_chars = num_chars - 1;
-    END WHILE;
-
-    RETURN salt;
+    -- Generate the salt in one statement, one random character per 
+    -- position (at most 20, the longest salt we want), instead of 
+    -- concatenating characters in a loop. Characters used are ASCII code
+    -- 33 ('!') through 126 ('~'); a space is left out because the salt is
+    -- stored in a CHAR column, which drops trailing spaces. With no 
+    -- positions GROUP_CONCAT is NULL, so that returns '' like the loop did.
+    RETURN (
+        SELECT COALESCE(GROUP_CONCAT(CHAR(33 + FLOOR(RAND() * 94) USING ascii) 
+                                     SEPARATOR ''), '')
+        FROM JSON_TABLE('[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 
+                          15, 16, 17, 18, 19, 20]', 
+                        '$[*]' COLUMNS (position INT PATH '$')) positions
+        WHERE position <= num_chars
+    );
 END !
 DELIMITER ;
 
@@ -143,18 +144,19 @@ BEGIN
   DECLARE salted_password BINARY(64);
   DECLARE user_count INT;
   DECLARE admin_status TINYINT;
+  DECLARE password_entry BINARY(64);
 
-  -- find salt of the specified user 
-  SELECT salt, is_admin INTO salt_entry, admin_status
+  -- find salt and hash of the specified user (by primary key)
+  SELECT salt, password_hash, is_admin 
+  INTO salt_entry, password_entry, admin_status
   FROM user_info 
   WHERE user_info.username = username; 
 
-  -- count the number of users where a generated hash from the inputted 
-  -- password is equal to the users actual hash
+  -- the password is right if it hashes to the user's own hash; comparing
+  -- against every user's hash would scan the whole table on each login
   SELECT UNHEX(SHA2(CONCAT(salt_entry, new_password), 256)) INTO salted_password;
-  SELECT COUNT(*) INTO user_count 
-  FROM user_info 
-  WHERE user_info.password_hash = salted_password;
+  SET user_count = (salt_entry IS NOT NULL 
+                    AND salted_password = password_entry);
 
   -- return whether or not a matching user was found
   IF user_count = 1 THEN
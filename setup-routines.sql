@@ -5,12 +5,48 @@ DROP FUNCTION IF EXISTS get_sale_price;
 DROP FUNCTION IF EXISTS store_count; 
 DROP FUNCTION IF EXISTS store_score; 
 DROP TABLE IF EXISTS mv_store_sales_stats;
-DROP PROCEDURE IF EXISTS sp_store_stat_new_sale;
+DROP TABLE IF EXISTS mv_store_sales_stats_shadow;
+DROP TABLE IF EXISTS mv_store_sales_stats_old;
+DROP EVENT IF EXISTS ev_drain_purchase_outbox;
+DROP TABLE IF EXISTS purchase_outbox;
+DROP TABLE IF EXISTS purchase_outbox_state;
+DROP PROCEDURE IF EXISTS sp_drain_outbox;
+DROP TABLE IF EXISTS mv_refresh_log;
+DROP PROCEDURE IF EXISTS sp_refresh_mv_store_sales_full;
 DROP TRIGGER IF EXISTS trg_store_sale_insert; 
 DROP PROCEDURE IF EXISTS update_inventory;
+DROP PROCEDURE IF EXISTS sp_apply_restock_batch;
+DROP PROCEDURE IF EXISTS sp_batch_restock;
+DROP TRIGGER IF EXISTS trg_inventory_cost_update;
+DROP TABLE IF EXISTS store_profit_summary;
+DROP PROCEDURE IF EXISTS sp_reconcile_store_profit;
+DROP TABLE IF EXISTS payment_method_usage;
+DROP PROCEDURE IF EXISTS sp_rebuild_payment_method_usage;
+DROP TABLE IF EXISTS gender_category_sales;
+DROP PROCEDURE IF EXISTS sp_rebuild_gender_category_sales;
+DROP TABLE IF EXISTS purchase_sample_config;
+DROP TABLE IF EXISTS purchase_sample_strata;
+DROP TABLE IF EXISTS purchase_sample;
+DROP FUNCTION IF EXISTS purchase_sample_rate;
+DROP PROCEDURE IF EXISTS sp_rebuild_purchase_sample;
+DROP TABLE IF EXISTS store_customer_hll;
+DROP FUNCTION IF EXISTS hll_register_index;
+DROP FUNCTION IF EXISTS hll_rho;
+DROP FUNCTION IF EXISTS hll_estimate;
+DROP PROCEDURE IF EXISTS sp_hll_add;
+DROP PROCEDURE IF EXISTS sp_rebuild_store_customer_hll;
+DROP TRIGGER IF EXISTS trg_customer_visit_insert;
 DROP VIEW IF EXISTS sales_summary_by_age_group;
 DROP FUNCTION IF EXISTS store_id_to_store_chain; 
 
+-- clean up after an upgrade: these were replaced by purchase_outbox and 
+-- sp_drain_outbox and are no longer created
+DROP EVENT IF EXISTS ev_refresh_mv_store_sales;
+DROP TABLE IF EXISTS store_sales_changelog;
+DROP PROCEDURE IF EXISTS sp_refresh_mv_store_sales_incremental;
+DROP PROCEDURE IF EXISTS sp_store_profit_new_sale;
+DROP PROCEDURE IF EXISTS sp_store_stat_new_sale;
+
 -- Returns a VARCHAR email address for an administrator and a client 
 -- It adds a fixed domain @retail_stats.com 
 -- to the username
@@ -116,19 +152,8 @@ CREATE VIEW sales_summary_by_age_group AS
 SELECT
     -- product category
     product.product_category,
-    -- sort customer age into specific group
-    CASE
-    WHEN customer.age BETWEEN 0 AND 9 THEN '0-9'
-    WHEN customer.age BETWEEN 10 AND 20 THEN '10-20'
-    WHEN customer.age BETWEEN 20 AND 29 THEN '20-29'
-    WHEN customer.age BETWEEN 30 AND 39 THEN '30-39'
-    WHEN customer.age BETWEEN 40 AND 49 THEN '40-49'
-    WHEN customer.age BETWEEN 50 AND 59 THEN '50-59'
-    WHEN customer.age BETWEEN 60 AND 69 THEN '60-69'
-    WHEN customer.age BETWEEN 70 AND 79 THEN '70-79'
-    WHEN customer.age BETWEEN 80 AND 89 THEN '80-89'
-    ELSE '90+'
-    END AS age_range,
+    -- customer age group (see customer.age_bucket in setup.sql)
+    customer.age_bucket AS age_range,
     
     -- Calculate total sales by summing the sale price for each purchase
     SUM(
@@ -138,7 +163,7 @@ SELECT
 FROM purchase 
 JOIN product ON purchase.product_id = product.product_id
 JOIN customer ON purchase.customer_id = customer.customer_id
-GROUP BY product.product_category, age_range
+GROUP BY product.product_category, customer.age_bucket
 ORDER BY product.product_category, age_range;
 
 -- Calculates a store score which examines foot_traffic in relation 
@@ -214,95 +239,637 @@ CREATE TABLE mv_store_sales_stats (
     store_id        INT,
     total_sales     NUMERIC(15, 2) NOT NULL,
     num_purchases   INT NOT NULL,
-    avg_discount    NUMERIC(5, 2) NOT NULL,
+    -- exact running sum of discount percents; the average is derived from
+    -- it when read, so it does not drift from rounding on every update
+    sum_discount    BIGINT NOT NULL,
+    avg_discount    NUMERIC(5, 2) AS (sum_discount / num_purchases),
     min_price       NUMERIC(12, 2) NOT NULL,
     max_price       NUMERIC(12, 2) NOT NULL,
     PRIMARY KEY(store_id)
 );
 
+-- Outbox of purchases not yet applied to the summary tables 
+-- (mv_store_sales_stats, store_profit_summary, payment_method_usage, 
+-- gender_category_sales, purchase_sample and store_customer_hll).
+-- trg_store_sale_insert writes one row per purchase instead of updating
+-- every summary itself, and sp_drain_outbox applies and removes them in 
+-- batches. change_id is the purchase's change version: once 
+-- purchase_outbox_state.applied_version reaches it, every summary 
+-- includes the purchase.
+CREATE TABLE purchase_outbox (
+    change_id         BIGINT AUTO_INCREMENT,
+    purchase_id       CHAR(7) NOT NULL,
+    store_id          INT NOT NULL,
+    store_location    VARCHAR(255) NOT NULL,
+    customer_id       INT NOT NULL,
+    product_id        CHAR(7) NOT NULL,
+    payment_method    VARCHAR(255) NOT NULL,
+    discount_percent  INT NOT NULL,
+    -- price before the discount
+    price             NUMERIC(6, 2) NOT NULL,
+    created_at        TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+    PRIMARY KEY(change_id),
+    -- summary rebuilds leave out the purchases still in the outbox
+    INDEX idx_purchase_outbox_purchase(purchase_id)
+);
+
+-- the newest change version applied to the summaries and when, one row
+CREATE TABLE purchase_outbox_state (
+    state_id          TINYINT DEFAULT 1,
+    applied_version   BIGINT NOT NULL,
+    drained_at        TIMESTAMP(3) NULL,
+    PRIMARY KEY(state_id),
+    CHECK(state_id = 1)
+);
+
+INSERT INTO purchase_outbox_state (applied_version) VALUES (0);
+
+-- one row per refresh of a materialized view, for checking how fresh 
+-- the view is and how long refreshes take
+CREATE TABLE mv_refresh_log (
+    refresh_id      INT AUTO_INCREMENT,
+    view_name       VARCHAR(64) NOT NULL,
+    -- 'full' or 'incremental'
+    refresh_type    VARCHAR(11) NOT NULL,
+    started_at      TIMESTAMP(3) NOT NULL,
+    finished_at     TIMESTAMP(3) NOT NULL,
+    -- outbox rows applied (incremental) or view rows built (full)
+    rows_applied    INT NOT NULL,
+    PRIMARY KEY(refresh_id)
+);
+
+-- Rebuilds mv_store_sales_stats from the purchase table into a shadow 
+-- table and swaps it in with an atomic RENAME TABLE, so readers keep 
+-- reading the old statistics until the new ones are complete.
+-- Purchases still in purchase_outbox are left out; sp_drain_outbox adds
+-- them afterwards, as it does for every summary rebuilt below.
+DELIMITER !
+CREATE PROCEDURE sp_refresh_mv_store_sales_full()
+BEGIN
+    DECLARE started TIMESTAMP(3) DEFAULT NOW(3);
+    DECLARE built_rows INT;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    -- no outbox drain or other summary rebuild can run at the same time
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    DROP TABLE IF EXISTS mv_store_sales_stats_shadow;
+    CREATE TABLE mv_store_sales_stats_shadow LIKE mv_store_sales_stats;
+
+    START TRANSACTION;
+    -- INSERT ... SELECT reads purchase and purchase_outbox with shared 
+    -- locks, so no purchase can commit until this transaction ends and 
+    -- every purchase is either in the rebuild or left in the outbox
+    INSERT INTO mv_store_sales_stats_shadow 
+    (store_id, total_sales, num_purchases, sum_discount, min_price, max_price)
+    SELECT 
+        store_id, 
+        SUM(sale_price) AS total_sales,
+        COUNT(*) AS num_purchases,
+        SUM(discount_percent) AS sum_discount,
+        MIN(sale_price) AS min_price,
+        MAX(sale_price) AS max_price
+    FROM (
+        -- same sale price as get_sale_price, without a lookup per row
+        SELECT 
+            store_id, 
+            discount_percent,
+            CAST(purchased_product_price_usd 
+            * (1 - (discount_percent / 100.0)) AS DECIMAL(10,2)) 
+            AS sale_price
+        FROM purchase p
+        WHERE NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                          WHERE o.purchase_id = p.purchase_id)
+    ) sales
+    GROUP BY store_id;
+    SET built_rows = ROW_COUNT();
+    COMMIT;
+
+    -- atomic swap; readers wait only for this rename, not the rebuild
+    DROP TABLE IF EXISTS mv_store_sales_stats_old;
+    RENAME TABLE mv_store_sales_stats TO mv_store_sales_stats_old,
+        mv_store_sales_stats_shadow TO mv_store_sales_stats;
+    DROP TABLE mv_store_sales_stats_old;
+
+    INSERT INTO mv_refresh_log 
+    (view_name, refresh_type, started_at, finished_at, rows_applied)
+    VALUES ('mv_store_sales_stats', 'full', started, NOW(3), built_rows);
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
+DELIMITER ;
+
 -- populate the materialized view 
-INSERT INTO mv_store_sales_stats 
-(store_id, total_sales, num_purchases, avg_discount, min_price, max_price)
--- use the get_sale_price function to apply discount to the original price
-SELECT 
-    store_id, 
-    SUM(get_sale_price(purchase_id, product_id, store_id, customer_id)) 
-    AS total_sales,
-    COUNT(*) AS num_purchases,
-    CAST(AVG(discount_percent) 
-    AS DECIMAL(5,2)) AS avg_discount,
-    MIN(get_sale_price(purchase_id, product_id, store_id, customer_id)) 
-    AS min_price,
-    MAX(get_sale_price(purchase_id, product_id, store_id, customer_id)) 
-    AS max_price
-FROM purchase
-GROUP BY store_id;
-
--- A procedure to execute when inserting new purchase to the 
--- to the store stats materialized view (mv_store_sales_stats).
--- If a store chain is already in view, its average discount is 
--- recompted with the additional purchase, the number of 
--- purchases increases by 1, and the sales prices are 
--- adjusted accordingly
+CALL sp_refresh_mv_store_sales_full();
+
+-- profit of every store location, kept up to date as purchases are 
+-- drained from the outbox and product costs change, so the store profit
+-- report reads one row per
+-- store location instead of joining inventory, purchase and store.
+-- total_profit is the sum of purchased_product_price_usd - product_cost_usd
+-- over the purchases that have an inventory row
+CREATE TABLE store_profit_summary (
+    store_id          INT,
+    store_location    VARCHAR(255),
+    store_chain_name  VARCHAR(50),
+    total_profit      NUMERIC(15, 2) NOT NULL,
+    PRIMARY KEY(store_id, store_location)
+);
+
+-- Recomputes the store profit summary from purchase and inventory in one
+-- transaction. Returns the number of store locations whose profit had 
+-- drifted from the recomputed value (0 if the summary was correct).
+DELIMITER !
+CREATE PROCEDURE sp_reconcile_store_profit()
+BEGIN
+    DECLARE changed_rows INT;
+    DECLARE stale_rows INT;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    START TRANSACTION;
+    -- CREATE TEMPORARY TABLE ... SELECT reads purchase and inventory with
+    -- shared locks, so no sale or cost change can slip in between the 
+    -- recomputation and the replacement below. Purchases still in the 
+    -- outbox are not in the summary yet, so they are left out here too.
+    DROP TEMPORARY TABLE IF EXISTS expected_store_profit;
+    CREATE TEMPORARY TABLE expected_store_profit AS
+    SELECT
+        i.store_id,
+        i.store_location,
+        s.store_chain_name,
+        SUM(p.purchased_product_price_usd - i.product_cost_usd) 
+        AS total_profit
+    FROM inventory i
+    JOIN purchase p
+        ON i.product_id = p.product_id
+        AND i.store_id = p.store_id
+        AND i.store_location = p.store_location
+    JOIN store s
+        ON i.store_id = s.store_id
+        AND i.store_location = s.store_location
+    WHERE NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                      WHERE o.purchase_id = p.purchase_id)
+    GROUP BY i.store_id, i.store_location, s.store_chain_name;
+
+    -- locations whose profit is missing or wrong, plus locations in the
+    -- summary that should not be there at all (a temporary table can only
+    -- be read once per statement, so these are counted separately)
+    SELECT COUNT(*) INTO changed_rows
+    FROM expected_store_profit e
+    LEFT JOIN store_profit_summary sps
+        ON e.store_id = sps.store_id
+        AND e.store_location = sps.store_location
+    WHERE NOT (sps.total_profit <=> e.total_profit)
+    OR NOT (sps.store_chain_name <=> e.store_chain_name);
+
+    SELECT COUNT(*) INTO stale_rows
+    FROM store_profit_summary sps
+    WHERE NOT EXISTS (SELECT 1 FROM expected_store_profit e
+                      WHERE e.store_id = sps.store_id
+                      AND e.store_location = sps.store_location);
+
+    SELECT changed_rows + stale_rows AS drifted_store_locations;
+
+    DELETE FROM store_profit_summary;
+    INSERT INTO store_profit_summary 
+    (store_id, store_location, store_chain_name, total_profit)
+    SELECT store_id, store_location, store_chain_name, total_profit
+    FROM expected_store_profit;
+    COMMIT;
+
+    DROP TEMPORARY TABLE expected_store_profit;
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
+DELIMITER ;
+
+-- populate the store profit summary
+CALL sp_reconcile_store_profit();
+
+-- number of purchases made with each payment method at each store 
+-- location, counted as purchases are drained from the outbox so the 
+-- payment method report does not group the whole purchase table
+CREATE TABLE payment_method_usage (
+    store_id          INT,
+    store_location    VARCHAR(255),
+    payment_method    VARCHAR(255),
+    usage_count       INT NOT NULL,
+    PRIMARY KEY(store_id, store_location, payment_method),
+    -- finds the most used methods of a store location without sorting
+    INDEX idx_payment_method_usage_count(store_id, store_location, usage_count)
+);
+
+-- Recounts payment_method_usage from the purchase table in one 
+-- transaction, e.g. after purchases were loaded without the trigger
+DELIMITER !
+CREATE PROCEDURE sp_rebuild_payment_method_usage()
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    START TRANSACTION;
+    DELETE FROM payment_method_usage;
+    -- INSERT ... SELECT reads purchase with shared locks, so purchases 
+    -- made during the rebuild wait for it instead of being lost
+    INSERT INTO payment_method_usage 
+    (store_id, store_location, payment_method, usage_count)
+    SELECT store_id, store_location, payment_method, COUNT(*)
+    FROM purchase p
+    WHERE NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                      WHERE o.purchase_id = p.purchase_id)
+    GROUP BY store_id, store_location, payment_method;
+    COMMIT;
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
+DELIMITER ;
+
+-- populate the payment method counters
+CALL sp_rebuild_payment_method_usage();
+
+-- purchase count and spending (after discounts) for every gender and 
+-- product category, kept up to date by sp_drain_outbox so the 
+-- gender reports read it instead of joining customer, purchase and product
+CREATE TABLE gender_category_sales (
+    product_category  VARCHAR(255),
+    gender            CHAR(1),
+    purchase_count    INT NOT NULL,
+    total_spent       NUMERIC(15, 2) NOT NULL,
+    PRIMARY KEY(product_category, gender)
+);
+
+-- Recomputes gender_category_sales from purchase, customer and product in
+-- one transaction, e.g. after a customer's gender or a product's category
+-- is corrected
+DELIMITER !
+CREATE PROCEDURE sp_rebuild_gender_category_sales()
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    START TRANSACTION;
+    DELETE FROM gender_category_sales;
+    -- INSERT ... SELECT reads purchase with shared locks, so purchases 
+    -- made during the rebuild wait for it instead of being lost
+    INSERT INTO gender_category_sales 
+    (product_category, gender, purchase_count, total_spent)
+    SELECT 
+        pr.product_category, 
+        c.gender, 
+        COUNT(*),
+        -- each sale is rounded like get_sale_price, as in sp_drain_outbox
+        SUM(CAST(p.purchased_product_price_usd 
+            * (1 - (p.discount_percent / 100.0)) AS DECIMAL(10,2)))
+    FROM purchase p
+    JOIN customer c ON p.customer_id = c.customer_id
+    JOIN product pr ON p.product_id = pr.product_id
+    WHERE NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                      WHERE o.purchase_id = p.purchase_id)
+    GROUP BY pr.product_category, c.gender;
+    COMMIT;
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
+DELIMITER ;
+
+-- populate the gender and product category sales
+CALL sp_rebuild_gender_category_sales();
+
+-- Settings of the purchase sample the approximate reports read (see
+-- sampling.py), one row. Every purchase is kept in purchase_sample with 
+-- probability sample_rate; with min_store_sample > 0 the sample is 
+-- stratified by store, and a store location with few purchases is 
+-- sampled at a higher rate so that about min_store_sample of its 
+-- purchases are kept. Call sp_rebuild_purchase_sample after changing them.
+CREATE TABLE purchase_sample_config (
+    config_id         TINYINT DEFAULT 1,
+    sample_rate       DOUBLE NOT NULL,
+    min_store_sample  INT NOT NULL,
+    PRIMARY KEY(config_id),
+    CHECK(config_id = 1),
+    CHECK(sample_rate > 0 AND sample_rate <= 1),
+    CHECK(min_store_sample >= 0)
+);
+
+INSERT INTO purchase_sample_config (sample_rate, min_store_sample)
+VALUES (0.01, 200);
+
+-- sampling rate of each store location, set by sp_rebuild_purchase_sample;
+-- stores opened since then are sampled at the configured sample_rate
+CREATE TABLE purchase_sample_strata (
+    store_id          INT,
+    store_location    VARCHAR(255),
+    -- purchases at the store location when the sample was rebuilt
+    population        INT NOT NULL,
+    sample_rate       DOUBLE NOT NULL,
+    PRIMARY KEY(store_id, store_location)
+);
+
+-- Bernoulli sample of purchase with the customer and product columns the 
+-- approximate reports group by, so they read neither purchase nor the 
+-- tables it references. Kept up to date by sp_drain_outbox.
+CREATE TABLE purchase_sample (
+    purchase_id       CHAR(7),
+    store_id          INT NOT NULL,
+    store_location    VARCHAR(255) NOT NULL,
+    gender            CHAR(1) NOT NULL,
+    age_bucket        VARCHAR(5) NOT NULL,
+    product_category  VARCHAR(255) NOT NULL,
+    -- price before and after the discount, as in get_sale_price
+    price             NUMERIC(6, 2) NOT NULL,
+    sale_price        NUMERIC(10, 2) NOT NULL,
+    -- 1 / the rate the purchase was sampled at, i.e. how many purchases
+    -- it stands for
+    weight            DOUBLE NOT NULL,
+    PRIMARY KEY(purchase_id)
+);
+
+-- Rate a purchase at a store location is sampled at
+DELIMITER !
+CREATE FUNCTION purchase_sample_rate(
+    store_id INT, 
+    store_location VARCHAR(255)
+) RETURNS DOUBLE READS SQL DATA
+BEGIN
+    DECLARE rate DOUBLE;
+
+    SELECT s.sample_rate INTO rate FROM purchase_sample_strata s
+    WHERE s.store_id = store_id AND s.store_location = store_location;
+    IF rate IS NULL THEN
+        SELECT sample_rate INTO rate FROM purchase_sample_config;
+    END IF;
+    RETURN rate;
+END !
+DELIMITER ;
+
+-- Draws a new sample of purchase with the rates in purchase_sample_config,
+-- e.g. after changing them or after purchases are deleted
+DELIMITER !
+CREATE PROCEDURE sp_rebuild_purchase_sample()
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    START TRANSACTION;
+    DELETE FROM purchase_sample_strata;
+    INSERT INTO purchase_sample_strata 
+    (store_id, store_location, population, sample_rate)
+    SELECT 
+        p.store_id, 
+        p.store_location, 
+        COUNT(*),
+        -- never below the uniform rate, never above 1
+        LEAST(1, GREATEST(cfg.sample_rate, 
+                          cfg.min_store_sample / COUNT(*)))
+    FROM purchase p
+    CROSS JOIN purchase_sample_config cfg
+    GROUP BY p.store_id, p.store_location, 
+        cfg.sample_rate, cfg.min_store_sample;
+
+    DELETE FROM purchase_sample;
+    -- INSERT ... SELECT reads purchase with shared locks, so purchases 
+    -- made during the rebuild wait for it instead of being left out (or 
+    -- are left to sp_drain_outbox, with the new rates)
+    INSERT INTO purchase_sample 
+    (purchase_id, store_id, store_location, gender, age_bucket, 
+     product_category, price, sale_price, weight)
+    SELECT 
+        p.purchase_id, 
+        p.store_id, 
+        p.store_location, 
+        c.gender, 
+        c.age_bucket,
+        pr.product_category,
+        p.purchased_product_price_usd,
+        CAST(p.purchased_product_price_usd 
+            * (1 - (p.discount_percent / 100.0)) AS DECIMAL(10,2)),
+        1 / s.sample_rate
+    FROM purchase p
+    JOIN purchase_sample_strata s 
+        ON p.store_id = s.store_id 
+        AND p.store_location = s.store_location
+    JOIN customer c ON p.customer_id = c.customer_id
+    JOIN product pr ON p.product_id = pr.product_id
+    WHERE RAND() < s.sample_rate
+    AND NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                    WHERE o.purchase_id = p.purchase_id);
+    COMMIT;
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
+DELIMITER ;
+
+-- draw the first sample
+CALL sp_rebuild_purchase_sample();
+
+-- HyperLogLog sketches of the distinct customers seen at each store 
+-- location, in visits or purchases. A customer ID is hashed to 64 bits; 
+-- the top 10 bits pick one of the 1024 registers of the store's sketch, 
+-- and the register keeps the largest rho (position of the first 1 bit in 
+-- the other 54 bits) of any customer hashed to it. Sketches merge by 
+-- taking the largest rho of each register, so chain and city totals come
+-- from the store sketches without counting customers twice. Estimates 
+-- are within about 3.3% (one standard error, 1.04 / SQRT(1024)).
+CREATE TABLE store_customer_hll (
+    store_id          INT,
+    store_location    VARCHAR(255),
+    -- register number, 0 to 1023; registers still 0 have no row
+    reg_idx           SMALLINT,
+    rho               TINYINT NOT NULL,
+    PRIMARY KEY(store_id, store_location, reg_idx)
+);
+
+-- The register of a customer ID: the top 10 bits of its hash
+DELIMITER !
+CREATE FUNCTION hll_register_index(
+    customer_id INT
+) RETURNS INT DETERMINISTIC
+BEGIN
+    RETURN CAST(CONV(LEFT(SHA2(customer_id, 256), 16), 16, 10) AS UNSIGNED)
+        >> 54;
+END !
+DELIMITER ;
+
+-- Position of the first 1 bit in the low 54 bits of a customer ID's hash,
+-- counting from 1 (55 if they are all 0)
 DELIMITER !
-CREATE PROCEDURE sp_store_stat_new_sale(
-    new_store_id    INT,
-    -- price before discount
-    new_price       NUMERIC(12, 2),
-    new_discount    NUMERIC(5, 2)
+CREATE FUNCTION hll_rho(
+    customer_id INT
+) RETURNS INT DETERMINISTIC
+BEGIN
+    DECLARE low_bits BIGINT UNSIGNED;
+
+    SET low_bits = CAST(CONV(LEFT(SHA2(customer_id, 256), 16), 16, 10) 
+        AS UNSIGNED) & 18014398509481983; -- 2^54 - 1
+    IF low_bits = 0 THEN
+        RETURN 55;
+    END IF;
+    -- BIN() has no leading zeros, so 54 - its length zeros come first
+    RETURN 55 - LENGTH(BIN(low_bits));
+END !
+DELIMITER ;
+
+-- Estimated number of distinct customers in a (merged) sketch, given how 
+-- many of its registers are set and SUM(POW(2, -rho)) over them. Small 
+-- counts, which leave many registers empty, use linear counting instead.
+DELIMITER !
+CREATE FUNCTION hll_estimate(
+    filled INT,
+    inverse_sum DOUBLE
+) RETURNS BIGINT DETERMINISTIC
+BEGIN
+    -- number of registers, and the bias correction for that many
+    DECLARE m INT DEFAULT 1024;
+    DECLARE alpha DOUBLE DEFAULT 0.7213 / (1 + 1.079 / 1024);
+    DECLARE raw_estimate DOUBLE;
+
+    IF filled IS NULL OR filled = 0 THEN
+        RETURN 0;
+    END IF;
+    -- each empty register adds POW(2, -0)
+    SET raw_estimate = alpha * m * m / (inverse_sum + (m - filled));
+    IF raw_estimate <= 2.5 * m AND filled < m THEN
+        RETURN ROUND(m * LN(m / (m - filled)));
+    END IF;
+    RETURN ROUND(raw_estimate);
+END !
+DELIMITER ;
+
+-- Adds a customer to a store location's sketch. The register is only 
+-- written when its rho grows, which stops happening once most of the 
+-- store's customers have been seen, so repeat customers take no locks.
+DELIMITER !
+CREATE PROCEDURE sp_hll_add(
+    store_id INT, 
+    store_location VARCHAR(255),
+    customer_id INT
 )
 BEGIN
-    DECLARE actual_sale_price NUMERIC(12, 2);
-    
-    -- calculates actual sale price after applying the discount
-    SET actual_sale_price = new_price * (1 - (new_discount / 100));
-
-    -- if store chain not already in view; add row
-    INSERT INTO mv_store_sales_stats 
-    (store_id, total_sales, num_purchases, avg_discount, min_price, max_price)
-    VALUES 
-        (new_store_id, actual_sale_price, 1, new_discount, actual_sale_price, actual_sale_price)
-     -- if store chain in view; update row accordingly
-    ON DUPLICATE KEY UPDATE 
-        avg_discount = CAST(((avg_discount * num_purchases + new_discount) / (num_purchases + 1)) AS DECIMAL(5,2)),
-        num_purchases = num_purchases + 1,
-        total_sales = total_sales + actual_sale_price,
-        min_price = LEAST(min_price, actual_sale_price),
-        max_price = GREATEST(max_price, actual_sale_price);
+    DECLARE new_idx INT DEFAULT hll_register_index(customer_id);
+    DECLARE new_rho INT DEFAULT hll_rho(customer_id);
+    DECLARE current_rho INT;
+
+    SELECT h.rho INTO current_rho FROM store_customer_hll h
+    WHERE h.store_id = store_id 
+    AND h.store_location = store_location
+    AND h.reg_idx = new_idx;
+
+    IF current_rho IS NULL OR current_rho < new_rho THEN
+        INSERT INTO store_customer_hll 
+        (store_id, store_location, reg_idx, rho)
+        VALUES (store_id, store_location, new_idx, new_rho)
+        ON DUPLICATE KEY UPDATE rho = GREATEST(rho, VALUES(rho));
+    END IF;
 END !
+DELIMITER ;
 
+-- Rebuilds every store's sketch from customer_visits and purchase, e.g.
+-- after visits or purchases are deleted (sketches cannot remove customers)
+DELIMITER !
+CREATE PROCEDURE sp_rebuild_store_customer_hll()
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    IF GET_LOCK('purchase_outbox_drain', 10) = 0 THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'The summary tables are already being updated';
+    END IF;
+
+    START TRANSACTION;
+    DELETE FROM store_customer_hll;
+    INSERT INTO store_customer_hll (store_id, store_location, reg_idx, rho)
+    SELECT 
+        store_id, 
+        store_location, 
+        hll_register_index(customer_id), 
+        MAX(hll_rho(customer_id))
+    FROM (
+        SELECT customer_id, store_id, store_location FROM customer_visits
+        UNION
+        SELECT customer_id, store_id, store_location FROM purchase p
+        WHERE NOT EXISTS (SELECT 1 FROM purchase_outbox o 
+                          WHERE o.purchase_id = p.purchase_id)
+    ) seen
+    GROUP BY store_id, store_location, hll_register_index(customer_id);
+    COMMIT;
+    DO RELEASE_LOCK('purchase_outbox_drain');
+END !
 DELIMITER ;
 
--- test PROCEDURE sp_store_stat_new_sale to see if store_chain 1 
--- sales statistics update accordingly
-CALL sp_store_stat_new_sale(1, 5.00, 0.00);
+-- build the sketches of the loaded visits and purchases
+CALL sp_rebuild_store_customer_hll();
 
 -- A procedure to execute when updating the store inventory 
 -- Inputs: specific product quantity being change and the quantity change
 -- at a store at a specific location
 DELIMITER !
-CREATE PROCEDURE update_inventory(product_id INT, qty_change INT, 
+CREATE PROCEDURE update_inventory(product_id CHAR(7), qty_change INT, 
 store_id INT, store_location VARCHAR(255))
 BEGIN
-    DECLARE curr_qty INT;
-
-    SELECT qty INTO curr_qty
-    FROM inventory
+    -- check and change the quantity in one conditional update, so two 
+    -- concurrent purchases cannot both see the same stock: the second 
+    -- waits for the first's row lock and then re-checks the condition
+    UPDATE inventory
+    SET qty = qty + qty_change
     WHERE inventory.product_id = product_id
     AND inventory.store_id = store_id
-    AND inventory.store_location = store_location;
+    AND inventory.store_location = store_location
+    AND qty + qty_change >= 0;
 
     -- do not update inventory if inventory becomes negative
-    IF (curr_qty + qty_change) < 0 THEN
-        SIGNAL SQLSTATE '45000' 
-        SET MESSAGE_TEXT = 'Cannot update inventory';
-    ELSE
-        -- update inventory table to reflect quantity change
-        UPDATE inventory
-        SET qty = curr_qty + qty_change
+    IF ROW_COUNT() = 0 AND qty_change < 0 AND EXISTS (
+        SELECT 1 FROM inventory
         WHERE inventory.product_id = product_id
         AND inventory.store_id = store_id
-        AND inventory.store_location = store_location;
+        AND inventory.store_location = store_location
+    ) THEN
+        SIGNAL SQLSTATE '45000' 
+        SET MESSAGE_TEXT = 'Cannot update inventory';
     END IF;
 END !
 DELIMITER ;
@@ -312,26 +879,436 @@ DELIMITER ;
 CALL update_inventory(1, 20, 15, 'Philadelphia');
 CALL update_inventory(1, -15, 15, 'Philadelphia');
 
--- Handles new rows added to purchase table, updates stats accordingly
--- in the materialized view and the inventory table
+-- Applies a batch of inventory quantity changes staged in the temporary 
+-- table restock_batch (see sp_batch_restock for its columns), with one 
+-- set-based UPDATE. Lines naming a product that is not in the store's
+-- inventory are rejected, as are all lines of an inventory row whose 
+-- quantity would become negative after the batch. Rejected lines are 
+-- left untouched and returned as a result set with the reason.
+DELIMITER !
+CREATE PROCEDURE sp_apply_restock_batch(
+    OUT applied_lines INT, 
+    OUT rejected_lines INT
+)
+BEGIN
+    DECLARE locked_rows INT;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    UPDATE restock_batch
+    SET error = 'Missing product ID, store ID, store location or quantity'
+    WHERE product_id IS NULL OR store_id IS NULL 
+    OR store_location IS NULL OR qty_change IS NULL;
+
+    UPDATE restock_batch b
+    LEFT JOIN inventory i
+        ON b.product_id = i.product_id
+        AND b.store_id = i.store_id
+        AND b.store_location = i.store_location
+    SET b.error = 'Product is not sold at this store location'
+    WHERE b.error IS NULL AND i.product_id IS NULL;
+
+    -- net change per inventory row, since a batch may touch a row twice
+    -- (MySQL cannot open a temporary table twice in one query, hence the
+    -- second table)
+    DROP TEMPORARY TABLE IF EXISTS restock_net;
+    CREATE TEMPORARY TABLE restock_net (
+        product_id      CHAR(7),
+        store_id        INT,
+        store_location  VARCHAR(255),
+        net_change      INT NOT NULL,
+        new_qty         INT,
+        PRIMARY KEY(product_id, store_id, store_location)
+    );
+    INSERT INTO restock_net (product_id, store_id, store_location, net_change)
+    SELECT product_id, store_id, store_location, SUM(qty_change)
+    FROM restock_batch
+    WHERE error IS NULL
+    GROUP BY product_id, store_id, store_location;
+
+    -- lock the inventory rows, then compute their quantities after the batch
+    SELECT COUNT(*) INTO locked_rows
+    FROM inventory i
+    JOIN restock_net n
+        ON i.product_id = n.product_id
+        AND i.store_id = n.store_id
+        AND i.store_location = n.store_location
+    FOR UPDATE OF i;
+
+    UPDATE restock_net n
+    JOIN inventory i
+        ON i.product_id = n.product_id
+        AND i.store_id = n.store_id
+        AND i.store_location = n.store_location
+    SET n.new_qty = i.qty + n.net_change;
+
+    UPDATE restock_batch b
+    JOIN restock_net n
+        ON b.product_id = n.product_id
+        AND b.store_id = n.store_id
+        AND b.store_location = n.store_location
+    SET b.error = CONCAT('Quantity would become ', n.new_qty)
+    WHERE b.error IS NULL AND n.new_qty < 0;
+
+    -- apply every accepted change at once
+    UPDATE inventory i
+    JOIN restock_net n
+        ON i.product_id = n.product_id
+        AND i.store_id = n.store_id
+        AND i.store_location = n.store_location
+    SET i.qty = n.new_qty
+    WHERE n.new_qty >= 0;
+    COMMIT;
+
+    SELECT COUNT(*) INTO rejected_lines 
+    FROM restock_batch WHERE error IS NOT NULL;
+    SELECT COUNT(*) - rejected_lines INTO applied_lines FROM restock_batch;
+
+    -- per line error report
+    SELECT line_no, product_id, store_id, store_location, qty_change, error
+    FROM restock_batch
+    WHERE error IS NOT NULL
+    ORDER BY line_no;
+
+    DROP TEMPORARY TABLE restock_net;
+END !
+DELIMITER ;
+
+-- Applies a batch of inventory quantity changes given as a JSON array of
+-- objects with product_id, store_id, store_location and qty_change, e.g.
+-- '[{"product_id": "1", "store_id": 15, "store_location": "Philadelphia",
+--    "qty_change": 20}]'. Lines are numbered from 1 in the error report.
+-- See sp_apply_restock_batch for how lines are accepted or rejected.
+DELIMITER !
+CREATE PROCEDURE sp_batch_restock(
+    changes JSON,
+    OUT applied_lines INT, 
+    OUT rejected_lines INT
+)
+BEGIN
+    DROP TEMPORARY TABLE IF EXISTS restock_batch;
+    CREATE TEMPORARY TABLE restock_batch (
+        line_no         INT,
+        product_id      CHAR(7),
+        store_id        INT,
+        store_location  VARCHAR(255),
+        qty_change      INT,
+        -- why the line was rejected, NULL if it was applied
+        error           VARCHAR(255),
+        PRIMARY KEY(line_no)
+    );
+    INSERT INTO restock_batch 
+    (line_no, product_id, store_id, store_location, qty_change)
+    SELECT line_no, product_id, store_id, store_location, qty_change
+    FROM JSON_TABLE(changes, '$[*]' COLUMNS (
+        line_no         FOR ORDINALITY,
+        product_id      CHAR(7) PATH '$.product_id',
+        store_id        INT PATH '$.store_id',
+        store_location  VARCHAR(255) PATH '$.store_location',
+        qty_change      INT PATH '$.qty_change'
+    )) AS jt;
+
+    CALL sp_apply_restock_batch(applied_lines, rejected_lines);
+    DROP TEMPORARY TABLE restock_batch;
+END !
+DELIMITER ;
+
+-- test procedure: the first two lines (net change 0) are applied, the 
+-- third is rejected since the product is not sold at that store
+-- expected output: 2 applied lines, 1 rejected line
+CALL sp_batch_restock('[
+    {"product_id": "1", "store_id": 15, "store_location": "Philadelphia",
+     "qty_change": 5},
+    {"product_id": "1", "store_id": 15, "store_location": "Philadelphia",
+     "qty_change": -5},
+    {"product_id": "9999999", "store_id": 15, 
+     "store_location": "Philadelphia", "qty_change": 10}
+]', @applied_lines, @rejected_lines);
+SELECT @applied_lines, @rejected_lines;
+
+-- Applies up to batch_size purchases from purchase_outbox, oldest first, 
+-- to every summary table in one transaction, then removes them and 
+-- records the newest one applied so far in purchase_outbox_state. Sets 
+-- applied_rows to the number applied: 0 if the outbox is empty or another
+-- drain or summary rebuild is running (that one applies them instead).
+DELIMITER !
+CREATE PROCEDURE sp_drain_outbox(
+    IN batch_size INT,
+    OUT applied_rows INT
+)
+BEGIN
+    DECLARE started TIMESTAMP(3) DEFAULT NOW(3);
+    DECLARE last_change_id BIGINT;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DROP TEMPORARY TABLE IF EXISTS drain_batch;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+        RESIGNAL;
+    END;
+
+    SET applied_rows = 0;
+    IF GET_LOCK('purchase_outbox_drain', 0) = 1 THEN
+        -- reads inventory, customer and product without shared locks, so 
+        -- the drain does not hold up purchases taking stock. The caller's
+        -- open transaction (which START TRANSACTION would commit anyway)
+        -- has to end before the isolation level can be set.
+        COMMIT;
+        DROP TEMPORARY TABLE IF EXISTS drain_batch;
+        CREATE TEMPORARY TABLE drain_batch (change_id BIGINT PRIMARY KEY);
+        SET TRANSACTION ISOLATION LEVEL READ COMMITTED;
+        START TRANSACTION;
+        -- The batch is exactly the rows locked here. Read committed takes
+        -- no gap locks, so a purchase with a lower change_id may commit 
+        -- while the batch is applied; every statement below joins 
+        -- drain_batch rather than reading a change_id range, so such a 
+        -- purchase is left whole in the outbox for the next batch. That
+        -- is also why applied_version is only a lag figure and waiting 
+        -- for a change checks the outbox itself (see 
+        -- outbox_worker.wait_for_version).
+        INSERT INTO drain_batch
+        SELECT change_id FROM purchase_outbox
+        ORDER BY change_id
+        LIMIT batch_size
+        FOR UPDATE;
+        SELECT MAX(change_id), COUNT(*) INTO last_change_id, applied_rows
+        FROM drain_batch;
+
+        IF last_change_id IS NOT NULL THEN
+            INSERT INTO mv_store_sales_stats 
+            (store_id, total_sales, num_purchases, sum_discount, 
+             min_price, max_price)
+            SELECT * FROM (
+                SELECT 
+                    store_id, 
+                    SUM(sale_price) AS new_sales,
+                    COUNT(*) AS new_purchases,
+                    SUM(discount_percent) AS new_discount,
+                    MIN(sale_price) AS new_min,
+                    MAX(sale_price) AS new_max
+                FROM (
+                    -- same sale price as get_sale_price
+                    SELECT 
+                        store_id, 
+                        discount_percent,
+                        CAST(price * (1 - (discount_percent / 100.0)) 
+                            AS DECIMAL(10,2)) AS sale_price
+                    FROM purchase_outbox o
+                    JOIN drain_batch b ON o.change_id = b.change_id
+                ) sales
+                GROUP BY store_id
+            ) changes
+            ON DUPLICATE KEY UPDATE 
+                total_sales = total_sales + changes.new_sales,
+                num_purchases = num_purchases + changes.new_purchases,
+                sum_discount = sum_discount + changes.new_discount,
+                min_price = LEAST(min_price, changes.new_min),
+                max_price = GREATEST(max_price, changes.new_max);
+
+            -- profit at the product's cost now; trg_inventory_cost_update
+            -- only adjusts the purchases already applied
+            INSERT INTO store_profit_summary 
+            (store_id, store_location, store_chain_name, total_profit)
+            SELECT * FROM (
+                SELECT 
+                    i.store_id, 
+                    i.store_location, 
+                    s.store_chain_name, 
+                    SUM(o.price - i.product_cost_usd) AS new_profit
+                FROM purchase_outbox o
+                JOIN drain_batch b ON o.change_id = b.change_id
+                JOIN inventory i
+                    ON o.product_id = i.product_id
+                    AND o.store_id = i.store_id
+                    AND o.store_location = i.store_location
+                JOIN store s
+                    ON i.store_id = s.store_id
+                    AND i.store_location = s.store_location
+                GROUP BY i.store_id, i.store_location, s.store_chain_name
+            ) sales
+            ON DUPLICATE KEY UPDATE 
+                total_profit = total_profit + sales.new_profit;
+
+            INSERT INTO payment_method_usage 
+            (store_id, store_location, payment_method, usage_count)
+            SELECT * FROM (
+                SELECT store_id, store_location, payment_method, 
+                    COUNT(*) AS new_uses
+                FROM purchase_outbox o
+                JOIN drain_batch b ON o.change_id = b.change_id
+                GROUP BY store_id, store_location, payment_method
+            ) uses
+            ON DUPLICATE KEY UPDATE usage_count = usage_count + uses.new_uses;
+
+            INSERT INTO gender_category_sales 
+            (product_category, gender, purchase_count, total_spent)
+            SELECT * FROM (
+                SELECT 
+                    pr.product_category, 
+                    c.gender, 
+                    COUNT(*) AS new_purchases,
+                    SUM(CAST(o.price * (1 - (o.discount_percent / 100.0)) 
+                        AS DECIMAL(10,2))) AS new_spent
+                FROM purchase_outbox o
+                JOIN drain_batch b ON o.change_id = b.change_id
+                JOIN customer c ON o.customer_id = c.customer_id
+                JOIN product pr ON o.product_id = pr.product_id
+                GROUP BY pr.product_category, c.gender
+            ) sales
+            ON DUPLICATE KEY UPDATE 
+                purchase_count = purchase_count + sales.new_purchases,
+                total_spent = total_spent + sales.new_spent;
+
+            -- keep each purchase in the sample with its store's rate
+            INSERT INTO purchase_sample 
+            (purchase_id, store_id, store_location, gender, age_bucket, 
+             product_category, price, sale_price, weight)
+            SELECT 
+                o.purchase_id, 
+                o.store_id, 
+                o.store_location, 
+                c.gender, 
+                c.age_bucket,
+                pr.product_category,
+                o.price,
+                CAST(o.price * (1 - (o.discount_percent / 100.0)) 
+                    AS DECIMAL(10,2)),
+                1 / o.sample_rate
+            FROM (
+                SELECT purchase_id, store_id, store_location, customer_id, 
+                    product_id, price, discount_percent,
+                    purchase_sample_rate(store_id, store_location) 
+                    AS sample_rate
+                FROM purchase_outbox o
+                JOIN drain_batch b ON o.change_id = b.change_id
+            ) o
+            JOIN customer c ON o.customer_id = c.customer_id
+            JOIN product pr ON o.product_id = pr.product_id
+            WHERE RAND() < o.sample_rate;
+
+            -- the largest rho of the batch's customers in each register
+            INSERT INTO store_customer_hll 
+            (store_id, store_location, reg_idx, rho)
+            SELECT * FROM (
+                SELECT 
+                    store_id, 
+                    store_location, 
+                    hll_register_index(customer_id) AS new_idx,
+                    MAX(hll_rho(customer_id)) AS new_rho
+                FROM purchase_outbox o
+                JOIN drain_batch b ON o.change_id = b.change_id
+                GROUP BY store_id, store_location, new_idx
+            ) seen
+            ON DUPLICATE KEY UPDATE rho = GREATEST(rho, seen.new_rho);
+
+            DELETE o FROM purchase_outbox o
+            JOIN drain_batch b ON o.change_id = b.change_id;
+            UPDATE purchase_outbox_state 
+            SET applied_version = GREATEST(applied_version, last_change_id),
+                drained_at = NOW(3);
+        END IF;
+        COMMIT;
+        DROP TEMPORARY TABLE drain_batch;
+
+        IF applied_rows > 0 THEN
+            INSERT INTO mv_refresh_log 
+            (view_name, refresh_type, started_at, finished_at, rows_applied)
+            VALUES ('purchase_outbox', 'incremental', started, NOW(3),
+                    applied_rows);
+        END IF;
+        DO RELEASE_LOCK('purchase_outbox_drain');
+    END IF;
+END !
+DELIMITER ;
+
+-- drain the outbox every few seconds even when outbox_worker.py (which
+-- drains it continuously) is not running; requires the event scheduler, 
+-- which is on by default
+CREATE EVENT ev_drain_purchase_outbox
+ON SCHEDULE EVERY 5 SECOND
+DO CALL sp_drain_outbox(10000, @applied_rows);
+
+-- Handles new rows added to purchase table: takes the product out of 
+-- stock and records the purchase in the outbox for the summary tables
 DELIMITER !
 CREATE TRIGGER trg_store_sale_insert
 AFTER INSERT ON purchase
 FOR EACH ROW
 BEGIN
-    -- Example of calling helper procedure, 
-    -- passing in the new row's information
-    CALL sp_store_stat_new_sale(
-    NEW.store_id,  
-    -- original price before discount
-    NEW.purchased_product_price_usd, 
-    -- discount percent
-    NEW.discount_percent
-    );
+    -- skipped while snapshot.py restores a snapshot, since the snapshot
+    -- already has the summary tables and inventory this row is part of
+    IF @retaildb_bulk_load IS NULL THEN
+        -- the summaries are updated from the outbox by sp_drain_outbox, 
+        -- so an insert writes one row here instead of one to each summary
+        INSERT INTO purchase_outbox 
+        (purchase_id, store_id, store_location, customer_id, product_id, 
+         payment_method, discount_percent, price)
+        VALUES (
+        NEW.purchase_id, NEW.store_id, NEW.store_location, NEW.customer_id,
+        NEW.product_id, NEW.payment_method, NEW.discount_percent, 
+        NEW.purchased_product_price_usd
+        );
+        -- the purchase's change version, for the session to wait on (see
+        -- outbox_worker.wait_for_version); triggers restore LAST_INSERT_ID
+        -- when they end, but not user variables
+        SET @retaildb_outbox_version = LAST_INSERT_ID();
+
+        -- stays in the insert, since it is what stops a purchase of a 
+        -- product that is out of stock
+        CALL update_inventory(
+        NEW.product_id, -1, NEW.store_id, NEW.store_location 
+        ); 
+    END IF;
+END !
+
+DELIMITER ;
 
-    CALL update_inventory(
-    NEW.product_id, -1, NEW.store_id, NEW.store_location 
-    ); 
+-- Keeps the store profit summary correct when the cost of a product 
+-- changes: every past sale of the product at that store location
+-- now makes (new cost - old cost) less profit
+DELIMITER !
+CREATE TRIGGER trg_inventory_cost_update
+AFTER UPDATE ON inventory
+FOR EACH ROW
+BEGIN
+    -- skipped during snapshot.py bulk loads, which restore 
+    -- store_profit_summary as it was
+    IF @retaildb_bulk_load IS NULL THEN
+        IF NEW.product_cost_usd <> OLD.product_cost_usd THEN
+            -- purchases still in the outbox get the new cost when drained
+            UPDATE store_profit_summary
+            SET total_profit = total_profit 
+                - (NEW.product_cost_usd - OLD.product_cost_usd) * (
+                    SELECT COUNT(*) FROM purchase
+                    WHERE purchase.product_id = NEW.product_id
+                    AND purchase.store_id = NEW.store_id
+                    AND purchase.store_location = NEW.store_location
+                    AND NOT EXISTS (
+                        SELECT 1 FROM purchase_outbox o 
+                        WHERE o.purchase_id = purchase.purchase_id))
+            WHERE store_profit_summary.store_id = NEW.store_id
+            AND store_profit_summary.store_location = NEW.store_location;
+        END IF;
+    END IF;
+END !
+
+DELIMITER ;
+
+-- Adds a visiting customer to the store's distinct customer sketch
+DELIMITER !
+CREATE TRIGGER trg_customer_visit_insert
+AFTER INSERT ON customer_visits
+FOR EACH ROW
+BEGIN
+    -- skipped while snapshot.py restores a snapshot, whose 
+    -- store_customer_hll already counts the visit
+    IF @retaildb_bulk_load IS NULL THEN
+        CALL sp_hll_add(NEW.store_id, NEW.store_location, NEW.customer_id);
+    END IF;
 END !
 
 DELIMITER ;
@@ -22,7 +22,27 @@ CREATE TABLE customer (
     annual_income_usd  NUMERIC(8, 2) NOT NULL,
     -- first and last name of client 
     full_name          VARCHAR(255) NOT NULL, 
+    -- age group of the customer, stored so that reports can group by it 
+    -- (and use its index) instead of bucketing every row at query time.
+    -- This is the one definition of the age groups used by every age 
+    -- report; to change the groups, change this expression, e.g. with
+    -- ALTER TABLE customer MODIFY age_bucket VARCHAR(5) AS (...) STORED;
+    age_bucket         VARCHAR(5) AS (
+        CASE
+        WHEN age < 10 THEN '0-9'
+        WHEN age < 20 THEN '10-19'
+        WHEN age < 30 THEN '20-29'
+        WHEN age < 40 THEN '30-39'
+        WHEN age < 50 THEN '40-49'
+        WHEN age < 60 THEN '50-59'
+        WHEN age < 70 THEN '60-69'
+        WHEN age < 80 THEN '70-79'
+        WHEN age < 90 THEN '80-89'
+        ELSE '90+'
+        END
+    ) STORED,
     PRIMARY KEY(customer_id),
+    INDEX idx_customer_age_bucket(age_bucket),
     CHECK(gender IN ('M', 'F', 'X')), 
     CHECK(age >= 0 AND age < 100)
 );
@@ -115,7 +135,12 @@ CREATE TABLE purchase (
     store_location   VARCHAR(255),
     -- price of the purchased product before the discount
     purchased_product_price_usd NUMERIC(6, 2) NOT NULL, 
+    -- purchase_id as a number (IDs are numbers, but CHAR sorts '10' before
+    -- '9'), indexed so the purchases after a given ID can be found 
+    -- without a full scan, e.g. by fact_cache.py
+    purchase_number   INT UNSIGNED AS (CAST(purchase_id AS UNSIGNED)) VIRTUAL,
     PRIMARY KEY(purchase_id), 
+    INDEX idx_purchase_number(purchase_number),
     FOREIGN KEY(product_id) 
     REFERENCES product(product_id)
     ON UPDATE CASCADE ON DELETE CASCADE,
@@ -147,5 +172,15 @@ CREATE TABLE customer_visits (
 -- create index on the product_price_usd of inventory table
 CREATE INDEX idx_store_inventory_price ON inventory(product_price_usd);
 
+-- create index for browsing a store's inventory in order, one page after 
+-- another (the primary key starts with product_id instead)
+CREATE INDEX idx_inventory_store_product 
+ON inventory(store_id, store_location, product_id);
+
+-- create index for finding the purchases of a product at a store location,
+-- e.g. when the cost of the product changes there
+CREATE INDEX idx_purchase_product_store 
+ON purchase(product_id, store_id, store_location);
+
 
 SET FOREIGN_KEY_CHECKS = 1;
@@ -0,0 +1,388 @@
+"""
+Saves every table of retaildb to a directory of NumPy column files and
+loads them back, to reset a database for benchmarks much faster than
+running the setup scripts again, e.g.
+    $ python3 snapshot.py dump snapshots/10m
+    $ python3 benchmark.py age-chain --snapshot snapshots/10m
+    $ python3 snapshot.py restore snapshots/10m
+
+A snapshot directory holds manifest.json, which lists the tables, their
+row counts and columns, and one .npy file per column under a directory per
+table (plus a .null.npy mask for columns with NULLs). The files can be
+opened without MySQL, e.g. np.load("snapshots/10m/purchase/txn_date.npy",
+mmap_mode="r"). Columns are stored as:
+- integers as int64 and floating point numbers as float64;
+- DECIMAL(p, s) as int64 counts of 10^-s (cents for prices), so they stay
+  exact;
+- dates as datetime64[D] and datetimes and timestamps as datetime64[us];
+- strings as fixed-width UTF-8 bytes.
+Generated columns (customer.age_bucket) are left out and recomputed by
+MySQL.
+
+Restoring empties each table and bulk loads it with LOAD DATA LOCAL INFILE
+with foreign key checks off, so the server needs local_infile=1 (see
+load-data.sql). The summary tables are restored from the snapshot as well,
+so the triggers are skipped during the load by setting @retaildb_bulk_load.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import mysql.connector
+from abstracted import add_connection_args, connect_from_args
+
+# rows fetched from MySQL, and written to the load file, at a time
+SNAPSHOT_BATCH_SIZE = 100000
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# scratch tables of the setup scripts and the materialized view refresh
+SKIPPED_TABLES = {"staging_data", "mv_store_sales_stats_shadow",
+                  "mv_store_sales_stats_old"}
+
+# TO_DAYS('1970-01-01'), to turn MySQL day numbers into datetime64 days
+UNIX_EPOCH_DAYS = 719528
+
+# MySQL DATA_TYPE -> how the column is stored
+COLUMN_KINDS = {
+    "tinyint": "int", "smallint": "int", "mediumint": "int", "int": "int",
+    "bigint": "int", "year": "int", "bit": "int",
+    "float": "float", "double": "float",
+    "decimal": "decimal",
+    "date": "date",
+    "datetime": "datetime", "timestamp": "datetime",
+    "char": "text", "varchar": "text", "tinytext": "text", "text": "text",
+    "mediumtext": "text", "longtext": "text", "enum": "text", "set": "text",
+    "json": "text",
+    "binary": "binary", "varbinary": "binary", "tinyblob": "binary",
+    "blob": "binary", "mediumblob": "binary", "longblob": "binary",
+}
+
+TABLES_QUERY = """
+    SELECT TABLE_NAME
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+    ORDER BY TABLE_NAME;
+"""
+COLUMNS_QUERY = """
+    SELECT COLUMN_NAME, DATA_TYPE, NUMERIC_SCALE, EXTRA
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ORDER BY ORDINAL_POSITION;
+"""
+
+
+def table_columns(conn, table):
+    """
+    Returns the stored (not generated) columns of a table as manifest
+    entries: dicts with name, kind and, for decimals, scale.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(COLUMNS_QUERY, (table,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    columns = []
+    for name, data_type, scale, extra in rows:
+        if "GENERATED" in (extra or "").upper():
+            continue
+        kind = COLUMN_KINDS.get(data_type.lower())
+        if kind is None:
+            raise ValueError(f"{table}.{name} has unsupported type "
+                             f"{data_type}")
+        column = {"name": name, "kind": kind}
+        if kind == "decimal":
+            column["scale"] = int(scale or 0)
+        columns.append(column)
+    return columns
+
+
+def select_expression(column):
+    """
+    The SELECT expression that reads a column in the form it is stored in.
+    """
+    name = f"`{column['name']}`"
+    if column["kind"] == "decimal":
+        return f"CAST({name} * {10 ** column['scale']} AS SIGNED)"
+    if column["kind"] == "date":
+        return f"TO_DAYS({name}) - {UNIX_EPOCH_DAYS}"
+    if column["kind"] == "datetime":
+        return f"TIMESTAMPDIFF(MICROSECOND, '1970-01-01', {name})"
+    return name
+
+
+def load_expression(column, variable):
+    """
+    The LOAD DATA SET expression that turns a field of the load file, read
+    into variable, back into the column's value.
+    """
+    # fields are read as strings, which arithmetic would turn into DOUBLE
+    number = f"CAST({variable} AS SIGNED)"
+    if column["kind"] == "decimal":
+        # an exact DECIMAL product, e.g. 1999 * 0.01 for cents
+        unit = "1" if column["scale"] == 0 \
+            else "0." + "0" * (column["scale"] - 1) + "1"
+        return f"{number} * {unit}"
+    if column["kind"] == "date":
+        return f"FROM_DAYS({number} + {UNIX_EPOCH_DAYS})"
+    if column["kind"] == "datetime":
+        return f"TIMESTAMPADD(MICROSECOND, {number}, '1970-01-01')"
+    if column["kind"] == "text":
+        return f"CONVERT(UNHEX({variable}) USING utf8mb4)"
+    if column["kind"] == "binary":
+        return f"UNHEX({variable})"
+    return variable
+
+
+def to_array(values, kind):
+    """
+    Returns (array, null mask or None) for one column of a batch of rows.
+    """
+    nulls = np.fromiter((value is None for value in values), dtype=bool,
+                        count=len(values))
+    if not nulls.any():
+        nulls = None
+    if kind == "float":
+        fill = 0.0
+    elif kind in ("text", "binary"):
+        fill = "" if kind == "text" else b""
+    else:
+        fill = 0
+    if nulls is not None:
+        values = [fill if value is None else value for value in values]
+    if kind == "float":
+        return np.array(values, dtype=np.float64), nulls
+    if kind == "text":
+        return np.char.encode(np.array(values, dtype=str), "utf-8"), nulls
+    if kind == "binary":
+        return np.array([bytes(value) for value in values],
+                        dtype=bytes), nulls
+    array = np.array(values, dtype=np.int64)
+    if kind == "date":
+        array = array.astype("datetime64[D]")
+    elif kind == "datetime":
+        array = array.astype("datetime64[us]")
+    return array, nulls
+
+
+def dump_table(conn, table, directory):
+    """
+    Saves a table's columns under directory/table and returns its manifest
+    entry.
+    """
+    columns = table_columns(conn, table)
+    chunks = [[] for _ in columns]
+    null_chunks = [[] for _ in columns]
+    num_rows = 0
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT "
+                       + ", ".join(select_expression(column)
+                                   for column in columns)
+                       + f" FROM `{table}`;")
+        while True:
+            rows = cursor.fetchmany(SNAPSHOT_BATCH_SIZE)
+            if not rows:
+                break
+            for index, values in enumerate(zip(*rows)):
+                array, nulls = to_array(values, columns[index]["kind"])
+                chunks[index].append(array)
+                null_chunks[index].append(
+                    nulls if nulls is not None
+                    else np.zeros(len(rows), dtype=bool))
+                if nulls is not None:
+                    columns[index]["nulls"] = True
+            num_rows += len(rows)
+    finally:
+        cursor.close()
+
+    table_dir = os.path.join(directory, table)
+    os.makedirs(table_dir, exist_ok=True)
+    for column, column_chunks, column_nulls in zip(columns, chunks,
+                                                   null_chunks):
+        if column_chunks:
+            array = np.concatenate(column_chunks)
+        else:
+            array = to_array([], column["kind"])[0]
+        np.save(os.path.join(table_dir, column["name"] + ".npy"), array)
+        if column.get("nulls"):
+            np.save(os.path.join(table_dir, column["name"] + ".null.npy"),
+                    np.concatenate(column_nulls))
+    return {"name": table, "rows": num_rows, "columns": columns}
+
+
+def dump_snapshot(conn, directory):
+    """
+    Saves every table of the connection's database to directory. The
+    tables are read in one consistent snapshot transaction. Returns the
+    manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if conn.in_transaction:
+        conn.rollback()
+    conn.start_transaction(consistent_snapshot=True, readonly=True)
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(TABLES_QUERY)
+            tables = [table for (table,) in cursor.fetchall()
+                      if table not in SKIPPED_TABLES]
+        finally:
+            cursor.close()
+        manifest = {"version": MANIFEST_VERSION,
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "tables": [dump_table(conn, table, directory)
+                               for table in tables]}
+    finally:
+        conn.rollback()
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{directory} is not a version {MANIFEST_VERSION} "
+                         "snapshot")
+    return manifest
+
+
+def field_strings(array, kind, nulls):
+    """
+    Returns a column's values as strings for the LOAD DATA file, with \\N
+    for NULL. Strings are hex encoded so they need no escaping.
+    """
+    if kind in ("text", "binary"):
+        # tolist() drops the padding of fixed-width bytes
+        fields = [value.hex() for value in array.tolist()]
+    elif kind == "float":
+        # repr() keeps every digit of a float64
+        fields = [repr(value) for value in array.tolist()]
+    else:
+        if kind in ("date", "datetime"):
+            array = array.astype(np.int64)
+        fields = array.astype(str).tolist()
+    if nulls is not None:
+        fields = [r"\N" if null else field
+                  for field, null in zip(fields, nulls.tolist())]
+    return fields
+
+
+def write_load_file(table_dir, table, load_file):
+    """
+    Writes a table's rows to an open text file in LOAD DATA's default
+    format (tab-separated fields, one row per line).
+    """
+    columns = table["columns"]
+    arrays = [np.load(os.path.join(table_dir, column["name"] + ".npy"),
+                      mmap_mode="r") for column in columns]
+    masks = [np.load(os.path.join(table_dir, column["name"] + ".null.npy"),
+                     mmap_mode="r") if column.get("nulls") else None
+             for column in columns]
+    for start in range(0, table["rows"], SNAPSHOT_BATCH_SIZE):
+        end = start + SNAPSHOT_BATCH_SIZE
+        fields = [field_strings(array[start:end], column["kind"],
+                                None if mask is None else mask[start:end])
+                  for column, array, mask in zip(columns, arrays, masks)]
+        load_file.write("".join("\t".join(row) + "\n"
+                                for row in zip(*fields)))
+
+
+def restore_table(cursor, directory, table):
+    """
+    Replaces the rows of one table with the snapshot's.
+    """
+    cursor.execute(f"TRUNCATE TABLE `{table['name']}`;")
+    if table["rows"] == 0:
+        return
+    columns = table["columns"]
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="ascii",
+                                     delete=False) as load_file:
+        write_load_file(os.path.join(directory, table["name"]), table,
+                        load_file)
+    try:
+        variables = [f"@c{index}" for index in range(len(columns))]
+        cursor.execute(
+            "LOAD DATA LOCAL INFILE %s INTO TABLE `" + table["name"] + "` "
+            "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ("
+            + ", ".join(variables) + ") SET "
+            + ", ".join(f"`{column['name']}` = "
+                        + load_expression(column, variable)
+                        for column, variable in zip(columns, variables))
+            + ";", (load_file.name,))
+    finally:
+        os.remove(load_file.name)
+
+
+def restore_snapshot(conn, directory):
+    """
+    Replaces the rows of every table in the snapshot at directory with the
+    snapshot's. conn must allow LOCAL INFILE (allow_local_infile=True).
+    Tables are emptied and loaded one after another, so a restore that
+    fails part way leaves some tables empty. Returns the manifest.
+    """
+    manifest = read_manifest(directory)
+    cursor = conn.cursor()
+    # keeps sp_drain_outbox (and the summary rebuilds) from applying the 
+    # restored outbox rows to summary tables that already include them
+    cursor.execute("SELECT GET_LOCK('purchase_outbox_drain', 10);")
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        raise mysql.connector.Error(
+            msg="The summary tables are already being updated",
+            sqlstate="45000")
+    try:
+        # the snapshot has the summary tables too, and is consistent, so
+        # neither the triggers nor the key checks need to run
+        cursor.execute("SET @retaildb_bulk_load = 1, FOREIGN_KEY_CHECKS = 0, "
+                       "UNIQUE_CHECKS = 0;")
+        for table in manifest["tables"]:
+            restore_table(cursor, directory, table)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SET @retaildb_bulk_load = NULL, "
+                       "FOREIGN_KEY_CHECKS = 1, UNIQUE_CHECKS = 1;")
+        cursor.execute("DO RELEASE_LOCK('purchase_outbox_drain');")
+        cursor.close()
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Save retaildb to a "
+                                     "snapshot directory or restore it "
+                                     "from one.")
+    parser.add_argument("action", choices=["dump", "restore"])
+    parser.add_argument("directory")
+    add_connection_args(parser, user="admin", password="admin_pw")
+    args = parser.parse_args()
+
+    conn = connect_from_args(args, allow_local_infile=True)
+    start = time.perf_counter()
+    try:
+        if args.action == "dump":
+            manifest = dump_snapshot(conn, args.directory)
+        else:
+            manifest = restore_snapshot(conn, args.directory)
+    except (OSError, ValueError, mysql.connector.Error) as err:
+        sys.stderr.write(f"Error: {err}\n")
+        sys.exit(1)
+    finally:
+        conn.close()
+    num_rows = sum(table["rows"] for table in manifest["tables"])
+    print(f"{'Saved' if args.action == 'dump' else 'Restored'} "
+          f"{len(manifest['tables'])} tables, {num_rows} rows in "
+          f"{time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Buffered purchase inserts for programs that add many purchases. Instead of
+one INSERT and one commit (and one redo log flush) per purchase, submitted
+purchases are queued and a background thread writes them as one
+multi-row INSERT per transaction, once FLUSH_ROWS of them are waiting or
+the oldest has waited FLUSH_DELAY_MS, whichever comes first:
+
+    >>> buffer = PurchaseWriteBuffer(connect_from_args(args))
+    >>> future = buffer.submit((purchase_id, product_id, store_id, ...))
+    >>> future.result()   # returns once the purchase is committed
+
+Each submit returns a concurrent.futures.Future that is resolved with a
+change version covering the purchase (the newest of its batch, for
+outbox_worker.wait_for_version) once the transaction holding it has
+committed, or with the error if it was rejected (SQLSTATE 45000 if out of stock), so callers know
+which purchases are durable. A rejected purchase does not lose the others
+in its batch: the batch is rolled back, split in half and each half written
+again, until only the rejected purchases are left. Anything still queued is
+written when the buffer is closed, including at interpreter exit.
+"""
+
+import atexit
+import threading
+import time
+from concurrent.futures import Future, wait
+import mysql.connector
+from abstracted import run_with_retry
+from outbox_worker import SESSION_VERSION_QUERY
+from purchases import INSERT_PURCHASE_QUERY
+
+# purchases written per transaction
+FLUSH_ROWS = 500
+# milliseconds the oldest queued purchase waits before a partial batch is
+# written
+FLUSH_DELAY_MS = 50
+# submit() waits while this many purchases are queued, so a producer faster
+# than the database cannot queue without bound
+MAX_PENDING = 10 * FLUSH_ROWS
+
+
+class PurchaseWriteBuffer:
+    """
+    Queues purchases (tuples in the order of INSERT_PURCHASE_QUERY) and
+    writes them in batches on its own thread. The buffer owns conn: no
+    other thread may use it until close() returns.
+    """
+
+    def __init__(self, conn, flush_rows=FLUSH_ROWS,
+                 flush_delay_ms=FLUSH_DELAY_MS, max_pending=MAX_PENDING):
+        self.conn = conn
+        self.flush_rows = flush_rows
+        self.flush_delay = flush_delay_ms / 1000
+        self.max_pending = max(max_pending, flush_rows)
+        # (purchase, future, time submitted), oldest first
+        self.pending = []
+        self.flush_requested = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run,
+                                       name="purchase-write-buffer",
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, purchase):
+        """
+        Queues one purchase and returns a Future resolved with its batch's
+        change version once it is committed.
+        """
+        future = Future()
+        with self.condition:
+            while len(self.pending) >= self.max_pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise RuntimeError("The purchase write buffer is closed")
+            self.pending.append((tuple(purchase), future, time.monotonic()))
+            if len(self.pending) >= self.flush_rows:
+                self.condition.notify_all()
+        return future
+
+    def flush(self):
+        """
+        Writes every queued purchase now and waits until they are committed
+        or rejected.
+        """
+        with self.condition:
+            futures = [future for _, future, _ in self.pending]
+            self.flush_requested = True
+            self.condition.notify_all()
+        wait(futures)
+
+    def close(self):
+        """
+        Writes every queued purchase and stops the writer thread. The
+        connection is left open.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def next_batch(self):
+        """
+        Waits until a batch is due and takes it off the queue. Returns None
+        once the buffer is closed and empty.
+        """
+        with self.condition:
+            while True:
+                if self.pending:
+                    waited = time.monotonic() - self.pending[0][2]
+                    if (len(self.pending) >= self.flush_rows
+                            or self.flush_requested or self.closed
+                            or waited >= self.flush_delay):
+                        break
+                    self.condition.wait(self.flush_delay - waited)
+                elif self.closed:
+                    return None
+                else:
+                    self.flush_requested = False
+                    self.condition.wait()
+            batch = self.pending[:self.flush_rows]
+            del self.pending[:self.flush_rows]
+            if not self.pending:
+                self.flush_requested = False
+            # wakes producers waiting for room
+            self.condition.notify_all()
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            # callers may have cancelled some futures while they waited
+            batch = [(purchase, future) for purchase, future, _ in batch
+                     if future.set_running_or_notify_cancel()]
+            try:
+                self.write_batch(batch)
+            except Exception as err:
+                # e.g. the connection was lost; nobody is left waiting
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+    def write_batch(self, batch):
+        """
+        Inserts a batch of purchases in one transaction and resolves their
+        futures. If the batch is rejected, each half of it is written on
+        its own, so one bad purchase costs a few more transactions rather
+        than one per purchase.
+        """
+        if not batch:
+            return
+        purchases = [purchase for purchase, _ in batch]
+
+        def insert(cursor):
+            # executemany sends these as one multi-row INSERT
+            cursor.executemany(INSERT_PURCHASE_QUERY, purchases)
+            cursor.execute(SESSION_VERSION_QUERY)
+            return cursor.fetchone()[0]
+
+        try:
+            version = run_with_retry(self.conn, insert)
+        except mysql.connector.Error as err:
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+                return
+            middle = len(batch) // 2
+            self.write_batch(batch[:middle])
+            self.write_batch(batch[middle:])
+            return
+        for _, future in batch:
+            future.set_result(version)